@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Benchmark_Run.py:
+Times the stages of the report pipeline on synthetic SurveyMonkey exports, so that changes
+can be compared without the confidential survey data. Runs offline on a CPU-only machine.
+
+Usage (from the code directory):
+    python Benchmark_Run.py                                   # NEO-IPIP 120/300, ICAR 16/60 with 100 and 1,000 rows
+    python Benchmark_Run.py --rows 100 10000 100000 --forms "NEO-IPIP 120"
+    python Benchmark_Run.py --compare Benchmark_Results/<earlier run>.json
+    python Benchmark_Run.py --import-budget                   # only check the cold start of the commands
+"""
+
+import json
+import time
+import shutil
+import argparse
+import sys
+import platform
+import subprocess
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import plotly
+
+from Functions.Synthetic_exports import write_synthetic_codebooks, write_synthetic_export
+from Functions.Get_data import EXPORT_PARSE_VERSION, read_survey_export, split_survey_info_numeric_data, get_export_sidecar
+from Functions.Codebook_loader import get_personality_codebook, get_cognitive_codebook
+from Functions.ICAR_norms import get_icar_norm_index
+from Functions.ICAR_recode import ICAR_FORMS
+from Functions.Respondent_ledger import get_respondent_keys, get_content_hashes
+from Functions.Personality_Report_Generation import build_personality_report_template, fill_personality_report
+from Functions.Cognitive_Report_Generation import cognitive_report_generation
+from Functions.Report_pipeline import score_survey_data, render_scored_exports
+
+SURVEY_FORMS = ['NEO-IPIP 120', 'NEO-IPIP 300', 'ICAR 16', 'ICAR 60']
+# Stages compared with a baseline; a stage is flagged when it is this much slower
+REGRESSION_TOLERANCE = 0.10
+# Cold start budget of each command of Survey_Report_Generation_Run.py (seconds to import the
+# command line and the module of the command), and modules the command must not import
+IMPORT_BUDGETS = {
+    'help': (0.25, ['pandas', 'numpy', 'plotly', 'kaleido', 'scipy']),
+    'classify': (0.75, ['pandas', 'plotly', 'kaleido', 'scipy']),
+    'score': (1.5, ['plotly', 'kaleido', 'scipy']),
+    'render': (1.5, ['plotly', 'kaleido', 'scipy']),
+    'run': (1.5, ['plotly', 'kaleido', 'scipy']),
+    'norms': (1.5, ['plotly', 'kaleido', 'scipy']),
+    'population': (1.5, ['plotly', 'kaleido', 'scipy']),
+}
+# Imports a command in a new interpreter and prints its import time and the modules it loaded
+IMPORT_CHECK = """
+import sys, json, time
+start = time.perf_counter()
+import Survey_Report_Generation_Run as cli
+if sys.argv[1] == 'help':
+    cli.get_parser().format_help()
+else:
+    cli.load_command_module(sys.argv[1])
+print(json.dumps({'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}))
+"""
+
+def time_stage(function, repeat=1):
+    """
+    Returns the result of a function and its fastest wall time over a number of calls.
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return result, min(seconds)
+
+def get_git_commit(code_directory):
+    """
+    Returns the current git commit of the code, with '+' added if it has uncommitted changes,
+    or None outside a git checkout.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=code_directory,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=code_directory,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ('+' if changes else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def build_reports(scored_export, codebook_all, reports):
+    """
+    Builds the report figures of the first test takers of a scored export without rendering them.
+    """
+    scored_data = scored_export['survey_data_scored'].iloc[:reports]
+    if scored_export['survey_type'] in ICAR_FORMS:
+        return [cognitive_report_generation(test_taker_data=test_taker_data, name=test_taker_data['Full Name'],
+                                            item_number=scored_export['item_number'],
+                                            dimension_items=scored_export['dimension_items']).to_dict()
+                for test_taker_data in scored_data.to_dict('records')]
+    template = build_personality_report_template(scored_data.columns, codebook_all, scored_export['item_number'])
+    return [fill_personality_report(template, values, name)
+            for values, name in zip(scored_data[template['value_fields']].to_numpy(dtype=object), scored_data['Full Name'])]
+
+def select_respondents(scored_export, respondents):
+    """
+    Returns a scored export reduced to its first respondents.
+    """
+    selected = dict(scored_export, respondents=min(respondents, scored_export['respondents']))
+    selected['survey_data_scored'] = scored_export['survey_data_scored'].iloc[:respondents]
+    selected['respondent_keys'] = scored_export['respondent_keys'][:respondents]
+    selected['content_hashes'] = scored_export['content_hashes'][:respondents]
+    return selected
+
+def benchmark_export(parent_directory, survey_data_path, survey_type, repeat, build_reports_limit, render_reports_limit,
+                     render_workers, render_backend='kaleido'):
+    """
+    Times the stages of the pipeline on one export.
+
+    Stages: reading the xlsx export without and with its sidecar, fingerprinting the responses
+    for the ledger, decoding them, scoring them, building the report figures of the first
+    build_reports_limit test takers, and rendering the reports of the first render_reports_limit
+    test takers. 'end to end' is one run of all of it from the xlsx file, as main would do it
+    with a cold sidecar, rendering the same reports.
+
+    Returns:
+        stages (dict): Stage name -> {'seconds', 'rows', 'rows_per_second'}.
+    """
+    sidecar_file = get_export_sidecar(survey_data_path)
+    codebook_all = (get_personality_codebook(parent_directory)['IPIP-NEO-ItemKey']
+                    if survey_type not in ICAR_FORMS else None)
+
+    def read_cold():
+        sidecar_file.unlink(missing_ok=True)
+        return read_survey_export(survey_data_path)
+
+    def score(survey_data):
+        respondent_keys = get_respondent_keys(survey_data)
+        content_hashes = get_content_hashes(survey_data)
+        survey_data_test_info, survey_data_numeric, likert_responses = split_survey_info_numeric_data(
+            survey_data, survey_type, respondent_keys, content_hashes)
+        return score_survey_data(parent_directory, survey_data_path, survey_data_test_info, survey_data_numeric,
+                                 likert_responses=likert_responses)
+
+    def render(scored_export):
+        shutil.rmtree(parent_directory / 'Report', ignore_errors=True)
+        (parent_directory / 'Report').mkdir()
+        return render_scored_exports(parent_directory, [select_respondents(scored_export, render_reports_limit)],
+                                     render_workers=render_workers, render_backend=render_backend)
+
+    stages = {}
+    survey_data, stages['read export (xlsx)'] = time_stage(read_cold, repeat)
+    _, stages['read export (sidecar)'] = time_stage(lambda: read_survey_export(survey_data_path), repeat)
+    rows = len(survey_data)
+    (respondent_keys, content_hashes), stages['fingerprint responses'] = time_stage(
+        lambda: (get_respondent_keys(survey_data), get_content_hashes(survey_data)), repeat)
+    (survey_data_test_info, survey_data_numeric, likert_responses), stages['decode responses'] = time_stage(
+        lambda: split_survey_info_numeric_data(survey_data, survey_type, respondent_keys, content_hashes), repeat)
+    scored_export, stages['score responses'] = time_stage(
+        lambda: score_survey_data(parent_directory, survey_data_path, survey_data_test_info, survey_data_numeric,
+                                  likert_responses=likert_responses), repeat)
+    reports, stages['build reports'] = time_stage(lambda: build_reports(scored_export, codebook_all, build_reports_limit), repeat)
+    render_results, stages['render reports'] = time_stage(lambda: render(scored_export))
+    _, stages['end to end'] = time_stage(lambda: render(score(read_cold())))
+
+    stage_rows = {'build reports': len(reports), 'render reports': len(render_results),
+                  'end to end': rows}
+    return {name: {'seconds': seconds, 'rows': stage_rows.get(name, rows),
+                   'rows_per_second': stage_rows.get(name, rows) / seconds if seconds > 0 else None}
+            for name, seconds in stages.items()}
+
+def check_import_budgets(code_directory, repeat=3, budgets=IMPORT_BUDGETS):
+    """
+    Times the cold start of each command of the command line in a new interpreter and checks
+    it against its budget and its forbidden modules.
+
+    Returns:
+        imports (dict): Per command, the fastest import time, the budget, the forbidden modules
+            that were imported and whether the command is within its budget.
+    """
+    imports = {}
+    for command, (budget, forbidden) in budgets.items():
+        seconds, loaded = [], set()
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, '-c', IMPORT_CHECK, command], cwd=code_directory,
+                                    capture_output=True, text=True, check=True).stdout
+            check = json.loads(output.splitlines()[-1])
+            seconds.append(check['seconds'])
+            loaded.update(name.split('.')[0] for name in check['modules'])
+        imported = [name for name in forbidden if name in loaded]
+        imports[command] = {'seconds': min(seconds), 'budget': budget, 'forbidden_imports': imported,
+                            'passed': min(seconds) <= budget and not imported}
+        flag = '' if imports[command]['passed'] else '  over budget' if not imported else f"  imports {', '.join(imported)}"
+        print(f"    {command:<10}{min(seconds):>8.3f}s  (budget {budget:.2f}s){flag}")
+    return imports
+
+def compare_benchmarks(baseline, current, tolerance=REGRESSION_TOLERANCE):
+    """
+    Prints the stage times of a run next to those of a baseline run and flags the stages that
+    became slower by more than the tolerance.
+
+    Returns:
+        regressions (list): (survey type, rows, stage) of the flagged stages.
+    """
+    baseline_cases = {(case['survey_type'], case['rows']): case for case in baseline['cases']}
+    regressions = []
+    print(f"\nCompared with {baseline['run'].get('commit') or 'baseline'} ({baseline['run']['started']}):")
+    print(f"{'form':<14}{'rows':>8}  {'stage':<24}{'baseline s':>12}{'current s':>12}{'ratio':>8}")
+    for case in current['cases']:
+        baseline_case = baseline_cases.get((case['survey_type'], case['rows']))
+        if baseline_case is None:
+            continue
+        for name, stage in case['stages'].items():
+            if name not in baseline_case['stages']:
+                continue
+            baseline_seconds = baseline_case['stages'][name]['seconds']
+            ratio = stage['seconds'] / baseline_seconds if baseline_seconds > 0 else np.nan
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = '  slower'
+                regressions.append((case['survey_type'], case['rows'], name))
+            print(f"{case['survey_type']:<14}{case['rows']:>8}  {name:<24}{baseline_seconds:>12.4f}"
+                  f"{stage['seconds']:>12.4f}{ratio:>8.2f}{flag}")
+    return regressions
+
+def main(forms=SURVEY_FORMS, row_counts=(100, 1000), repeat=3, build_reports_limit=1000, render_reports_limit=10,
+         render_workers=1, render_backend='kaleido', workspace=None, results_directory=None, compare=None, seed=0,
+         import_budget_only=False):
+    """
+    Runs the benchmark for each survey form and number of rows and writes the results to
+    'Benchmark_Results/benchmark_<time>_<commit>.json'.
+
+    Args:
+        forms (list): Survey forms to benchmark.
+        row_counts (list): Numbers of respondents per export.
+        repeat (int): Number of runs of each stage except rendering; the fastest counts.
+        build_reports_limit (int): Number of report figures built per export.
+        render_reports_limit (int): Number of reports rendered per export.
+        render_workers (int): Number of render processes (see render_reports).
+        render_backend (str): 'kaleido' or 'native' (see write_report).
+        workspace (str or Path): Folder of the synthetic item keys and exports; they are
+            generated once and reused by later runs with the same seed.
+        results_directory (str or Path): Folder of the result files.
+        compare (str or Path): Result file of an earlier run to compare with.
+        seed (int): Seed of the synthetic data.
+        import_budget_only (bool): Only check the cold start of the commands.
+
+    Returns:
+        results_file (Path): Path of the result file.
+        passed (bool): Whether every command started within its import budget.
+    """
+    code_directory = Path(__file__).resolve().parent
+    workspace = Path(workspace) if workspace else Path(tempfile.gettempdir()) / 'survey_report_benchmark'
+    results_directory = Path(results_directory) if results_directory else code_directory / 'Benchmark_Results'
+    parent_directory = workspace / 'Benchmark'
+
+    run = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': get_git_commit(code_directory),
+        'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(),
+        'versions': {'numpy': np.__version__, 'pandas': pd.__version__, 'plotly': plotly.__version__},
+        'settings': {'repeat': repeat, 'build_reports': build_reports_limit, 'render_reports': render_reports_limit,
+                     'render_workers': render_workers, 'render_backend': render_backend, 'seed': seed},
+    }
+    print("Checking the cold start of the commands...")
+    run['imports'] = check_import_budgets(code_directory)
+    passed = all(check['passed'] for check in run['imports'].values())
+    if import_budget_only:
+        forms = []
+    else:
+        write_synthetic_codebooks(workspace, seed=seed)
+        # Parse the item keys and norm table once, so that the first export does not pay for it
+        _, run['load codebooks seconds'] = time_stage(lambda: (get_personality_codebook(parent_directory),
+                                                               get_cognitive_codebook(parent_directory),
+                                                               get_icar_norm_index(parent_directory)))
+    cases = []
+    for survey_type in forms:
+        for rows in row_counts:
+            survey_data_path = (parent_directory / 'Data' / survey_type /
+                                f"synthetic_{rows}_seed{seed}_v{EXPORT_PARSE_VERSION}.xlsx")
+            if not survey_data_path.exists():
+                print(f"Generating {survey_type} export with {rows} rows...")
+                write_synthetic_export(survey_data_path, survey_type, rows, seed=seed)
+            print(f"Benchmarking {survey_type} with {rows} rows...")
+            stages = benchmark_export(parent_directory, survey_data_path, survey_type, repeat,
+                                      build_reports_limit, render_reports_limit, render_workers, render_backend)
+            cases.append({'survey_type': survey_type, 'rows': rows, 'stages': stages})
+            for name, stage in stages.items():
+                print(f"    {name:<24}{stage['seconds']:>10.4f}s  ({stage['rows']} rows)")
+
+    results = {'run': run, 'cases': cases}
+    results_directory.mkdir(parents=True, exist_ok=True)
+    results_file = results_directory / f"benchmark_{time.strftime('%Y%m%d-%H%M%S')}_{(run['commit'] or 'local').rstrip('+')}.json"
+    results_file.write_text(json.dumps(results, indent=2))
+    print(f"Benchmark results written to {results_file}.")
+
+    if compare:
+        regressions = compare_benchmarks(json.loads(Path(compare).read_text()), results)
+        print(f"{len(regressions)} stage(s) slower than the baseline by more than {REGRESSION_TOLERANCE:.0%}.")
+    if not passed:
+        print("Some commands started slower than their import budget or imported modules they should not.")
+    return results_file, passed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the report pipeline on synthetic exports.")
+    parser.add_argument('--forms', nargs='+', default=SURVEY_FORMS, choices=SURVEY_FORMS)
+    parser.add_argument('--rows', nargs='+', type=int, default=[100, 1000], help="respondents per export (e.g. 100 100000)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--build-reports', type=int, default=1000, help="report figures built per export")
+    parser.add_argument('--render-reports', type=int, default=10, help="reports rendered per export")
+    parser.add_argument('--render-workers', type=int, default=1)
+    parser.add_argument('--render-backend', default='kaleido', choices=['kaleido', 'native'])
+    parser.add_argument('--workspace', help="folder of the synthetic data (default: a folder in the temp directory)")
+    parser.add_argument('--results', help="folder of the result files (default: Benchmark_Results)")
+    parser.add_argument('--compare', help="result file of an earlier run to compare with")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--import-budget', action='store_true',
+                        help="only check the cold start of the commands; exit with status 1 when a check fails")
+    arguments = parser.parse_args()
+    _, passed = main(forms=arguments.forms, row_counts=arguments.rows, repeat=arguments.repeat,
+         build_reports_limit=arguments.build_reports, render_reports_limit=arguments.render_reports,
+         render_workers=arguments.render_workers, render_backend=arguments.render_backend, workspace=arguments.workspace, results_directory=arguments.results,
+         compare=arguments.compare, seed=arguments.seed, import_budget_only=arguments.import_budget)
+    if arguments.import_budget and not passed:
+        sys.exit(1)
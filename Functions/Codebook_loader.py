@@ -0,0 +1,86 @@
+import pandas as pd
+import numpy as np
+from pathlib import Path
+
+from Functions.File_cache import load_with_sidecar
+from Functions.Run_metrics import stage
+
+# Codebooks already loaded in this process, keyed by the resolved spreadsheet path
+_loaded_codebooks = {}
+
+def build_personality_codebook(codebook_file):
+    """
+    Parses 'Personality Item Key.xlsx' and derives the dimension, recode and short-form tables.
+
+    Args:
+        codebook_file (Path): Path to the personality item key.
+
+    Returns:
+        tables (dict): The full NEO IPIP codebook with 'Dimension' and 'Recode' columns added,
+            the 120-item and 300-item form codebooks, and the social desirability codebook.
+    """
+    codebook_sheets = pd.read_excel(codebook_file, sheet_name=['IPIP-NEO-ItemKey', 'Social_Desirability'])
+    codebook_all = codebook_sheets['IPIP-NEO-ItemKey']
+
+    # Add FFM dimension based on Key content
+    codebook_all['Dimension'] = np.where(codebook_all.Key.str.contains('O'), 'Openness',
+                                  np.where(codebook_all.Key.str.contains('C'), 'Conscientiousness',
+                                  np.where(codebook_all.Key.str.contains('E'), 'Extroversion',
+                                  np.where(codebook_all.Key.str.contains('A'), 'Agreeableness',
+                                  np.where(codebook_all.Key.str.contains('N'), 'Neuroticism', pd.NA)))))
+    # Mark items that require reverse coding
+    codebook_all['Recode'] = np.where(codebook_all.Sign.str.contains('-'), 'Yes', 'No')
+
+    return {
+        'IPIP-NEO-ItemKey': codebook_all,
+        'NEO-IPIP 120': codebook_all.dropna(subset=['Short#']).copy()[['Dimension', 'Recode', 'Facet', 'Item']],
+        'NEO-IPIP 300': codebook_all[['Dimension', 'Recode', 'Facet', 'Item']].copy(),
+        'Social_Desirability': codebook_sheets['Social_Desirability'],
+    }
+
+def build_cognitive_codebook(codebook_file):
+    """
+    Parses 'ICAR Item Key.xlsx'.
+    """
+    return {'ICAR Item Key': pd.read_excel(codebook_file)}
+
+def load_codebook(codebook_file, build_function):
+    """
+    Returns the parsed tables of a codebook spreadsheet, parsing it at most once per change.
+
+    The parsed tables are kept in memory for the rest of the process and in a pickle file
+    next to the spreadsheet (see load_with_sidecar).
+
+    Args:
+        codebook_file (str or Path): Path to the codebook spreadsheet.
+        build_function (function): Parses the spreadsheet into a dict of DataFrames.
+
+    Returns:
+        tables (dict): Parsed codebook tables. They are shared, so callers must not modify them.
+    """
+    codebook_file = Path(codebook_file).resolve()
+    if not codebook_file.exists():
+        raise FileNotFoundError(f"Codebook not found: {codebook_file}")
+
+    loaded = _loaded_codebooks.get(codebook_file)
+    if loaded is not None and loaded['source_mtime'] == codebook_file.stat().st_mtime_ns:
+        return loaded['tables']
+
+    with stage('load codebook'):
+        tables, source_mtime = load_with_sidecar(codebook_file, build_function)
+    _loaded_codebooks[codebook_file] = {'source_mtime': source_mtime, 'tables': tables}
+    return tables
+
+def get_personality_codebook(parent_directory):
+    """
+    Returns the tables of 'IPIP/Personality Item Key.xlsx' for the given parent directory.
+    """
+    codebook_file = Path(parent_directory).parent / 'IPIP' / 'Personality Item Key.xlsx'
+    return load_codebook(codebook_file, build_personality_codebook)
+
+def get_cognitive_codebook(parent_directory):
+    """
+    Returns the ICAR item key from 'ICAR/ICAR Item Key.xlsx' for the given parent directory.
+    """
+    codebook_file = Path(parent_directory).parent / 'ICAR' / 'ICAR Item Key.xlsx'
+    return load_codebook(codebook_file, build_cognitive_codebook)['ICAR Item Key']
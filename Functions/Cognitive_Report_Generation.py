@@ -0,0 +1,95 @@
+import math
+
+# Version of the report layout; increase it when the layout changes, so cached reports are rendered again
+REPORT_TEMPLATE_VERSION = 2
+# Header fields shown in the report
+HEADER_FIELDS = ['Email address', 'Completion Time', 'Response Time']
+
+def get_report_fields(dimension_items):
+    """
+    Returns the scored fields shown in the cognitive report of a form with the given dimensions.
+    """
+    return (HEADER_FIELDS + ['ICAR_Total', 'ICAR60_Total Percentile'] + list(dimension_items)
+            + [f"{d}_60 Percentile" for d in dimension_items])
+
+def format_percentile(percentile):
+    """
+    Returns a percentile as shown in the report: rounded, or 'n/a' when it is missing (e.g.
+    when the test taker has no score, see lookup_icar_norms).
+    """
+    return 'n/a' if percentile is None or math.isnan(percentile) else f"{percentile:.0f}"
+
+def get_cognitive_report_spec(test_taker_data, name, item_number, dimension_items):
+    """
+    Returns the figure spec of a cognitive report for the given test taker as plain dicts:
+    the figure of cognitive_report_generation without Plotly's default template, which the
+    native PDF writer draws without importing Plotly.
+
+    Args:
+        test_taker_data (Series): Scored data of the test taker: header fields, the number of
+            correct answers per dimension ('<dimension>') and in total ('ICAR_Total'), and the
+            norm percentiles ('<dimension>_60 Percentile' and 'ICAR60_Total Percentile').
+        name (str): Full name of the test taker.
+        item_number (int): Number of cognitive items (16 or 60).
+        dimension_items (dict): Number of items of the form per dimension, in report order.
+
+    Returns:
+        figure_spec (dict): 'data' and 'layout' of the figure.
+    """
+    y_labels = ["<b>Total</b>"] + list(dimension_items)
+    scores = [test_taker_data['ICAR_Total']] + [test_taker_data[d] for d in dimension_items]
+    score_totals = [item_number] + list(dimension_items.values())
+    percentiles = [test_taker_data['ICAR60_Total Percentile']] + [test_taker_data[f"{d}_60 Percentile"] for d in dimension_items]
+    text = [f"{score:.0f} of {total} correct | percentile {format_percentile(percentile)}"
+            for score, total, percentile in zip(scores, score_totals, percentiles)]
+    # A missing percentile is drawn as an empty bar, so that its row still shows its text
+    bar_lengths = [0 if percentile is None or math.isnan(percentile) else percentile for percentile in percentiles]
+
+    data = [{
+        'type': 'bar', 'x': bar_lengths, 'y': y_labels, 'orientation': 'h', 'text': text,
+        'textposition': 'outside', 'textfont': {'size': 9},
+        'marker': {'color': ['SteelBlue'] + ['LightSkyBlue'] * len(dimension_items)},
+    }]
+
+    title_text = (
+        f"Cognitive Report <br><sub><b>{name}</b></sub> "
+        f"<br><sub>{test_taker_data['Email address']}</sub>"
+    )
+    annotation_text = (
+        f"DATE/TIME OF COMPLETION<br><b>{test_taker_data['Completion Time']}</b>"
+        f"<br><br>TIME TO COMPLETION <br><b>{test_taker_data['Response Time']}</b>"
+        f"<br><br>COGNITIVE SCORE<br><b>{test_taker_data['ICAR_Total']:.0f} (Out of {item_number} Total)</b>"
+        f"<br><br>PERCENTILE<br><b>{format_percentile(test_taker_data['ICAR60_Total Percentile'])}</b>"
+    )
+
+    layout = dict(
+        autosize=True,
+        height=600,
+        title=dict(text=title_text, y=0.95, yanchor='top', font=dict(size=15)),
+        font=dict(size=9),
+        yaxis=dict(autorange="reversed", showgrid=False, type='category'),
+        xaxis=dict(range=[0, 130], showgrid=False, visible=False),
+        margin=dict(t=200, l=10, r=20, b=30),
+        plot_bgcolor='rgba(0, 0, 0, 0)',
+        showlegend=False,
+        annotations=[dict(text=annotation_text, x=0.8, y=1.02, xref='paper', yref='paper', yanchor='bottom',
+                          showarrow=False, font=dict(size=9), align='right')]
+    )
+    return {'data': data, 'layout': layout}
+
+def cognitive_report_generation(test_taker_data, name, item_number, dimension_items):
+    """
+    Generates a Plotly-based cognitive report for the given test taker.
+
+    Args:
+        test_taker_data (Series): Scored data of the test taker (see get_cognitive_report_spec).
+        name (str): Full name of the test taker.
+        item_number (int): Number of cognitive items (16 or 60).
+        dimension_items (dict): Number of items of the form per dimension, in report order.
+
+    Returns:
+        fig (Plotly Figure): Generated report figure (see get_cognitive_report_spec).
+    """
+    # Plotly is imported when the first report is built, so runs that do not render start faster
+    import plotly.graph_objects as go
+    return go.Figure(get_cognitive_report_spec(test_taker_data, name, item_number, dimension_items))
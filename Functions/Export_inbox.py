@@ -0,0 +1,129 @@
+import openpyxl
+from pathlib import Path
+
+def get_header_column_count(file_path):
+    """
+    Returns the number of columns of a SurveyMonkey export, read from its two header rows
+    with a streaming parse, without loading the responses.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        num_cols = 0
+        for row in workbook.worksheets[0].iter_rows(min_row=1, max_row=2, values_only=True):
+            filled = [n for n, value in enumerate(row) if value is not None]
+            if filled:
+                num_cols = max(num_cols, filled[-1] + 1)
+    finally:
+        workbook.close()
+    return num_cols
+
+def get_survey_type(num_cols):
+    """
+    Returns the survey type (and data sub-folder name) that matches a column count.
+    """
+    if num_cols < 50:
+        return "ICAR 16"
+    elif (num_cols > 50) and (num_cols < 120):
+        return "ICAR 60"
+    elif (num_cols > 120) and (num_cols < 300):
+        return "NEO-IPIP 120"
+    elif num_cols > 300:
+        return "NEO-IPIP 300"
+    else:
+        raise ValueError("Survey data does not match any expected format based on column count.")
+
+def move_to_survey_folder(file_path, data_directory):
+    """
+    Classifies an export by its header and moves it into the matching survey sub-folder
+    of the data directory. The move is a single rename, so it is atomic on one file system.
+
+    Returns:
+        new_file_path (Path): Path of the export in its survey sub-folder.
+    """
+    file_path = Path(file_path)
+    target_dir = Path(data_directory) / get_survey_type(get_header_column_count(file_path))
+    target_dir.mkdir(parents=True, exist_ok=True)
+    new_file_path = target_dir / file_path.name
+
+    # Move (rename) the file if not already in the target directory
+    if file_path.exists() and file_path != new_file_path:
+        try:
+            file_path.rename(new_file_path)
+        except Exception as e:
+            raise IOError(f"Error moving file {file_path} to {new_file_path}: {e}")
+    return new_file_path
+
+def move_to_failed_folder(file_path, data_directory):
+    """
+    Moves an export that could not be processed into the 'Failed' sub-folder of the data
+    directory, out of the inbox and the survey sub-folders, so it can be looked at and put
+    back in the inbox to try again. An earlier failed export of the same name is kept: a
+    number is added to the file name ('export (2).xlsx', ...).
+
+    Returns:
+        new_file_path (Path): Path of the export in the 'Failed' folder.
+    """
+    file_path = Path(file_path)
+    target_dir = Path(data_directory) / 'Failed'
+    target_dir.mkdir(parents=True, exist_ok=True)
+    new_file_path, n = target_dir / file_path.name, 1
+    while new_file_path.exists():
+        n += 1
+        new_file_path = target_dir / f"{file_path.stem} ({n}){file_path.suffix}"
+    file_path.rename(new_file_path)
+    return new_file_path
+
+def list_exports(directory):
+    """
+    Returns the Excel files in a directory, oldest first, without the lock files that Excel
+    keeps next to an open workbook ('~$*.xlsx').
+    """
+    xlsx_files = [f for f in Path(directory).glob('*.xlsx') if not f.name.startswith('~$')]
+    xlsx_files.sort(key=lambda x: x.stat().st_mtime)
+    return xlsx_files
+
+def get_pending_file_paths(parent_directory, sub_directory):
+    """
+    Returns all Excel exports waiting in the data directory (not yet moved into a survey
+    sub-folder), oldest first. Excel lock files ('~$*.xlsx') are ignored.
+    """
+    return list_exports(Path(parent_directory) / sub_directory)
+
+def get_previous_file_path(file_path):
+    """
+    Returns the export that precedes the given one in its survey sub-folder by modification
+    time, or the export itself if it is the first one.
+    """
+    file_path = Path(file_path)
+    xlsx_files = list_exports(file_path.parent)
+    position = xlsx_files.index(file_path)
+    return xlsx_files[position - 1] if position > 0 else file_path
+
+def get_file_path(parent_directory, sub_directory):
+    """
+    Returns the path to the most recent Excel data file for processing,
+    and moves it into a subdirectory based on its number of columns. Excel lock files
+    ('~$*.xlsx') are ignored.
+    """
+    data_directory = Path(parent_directory) / sub_directory
+    # Get all Excel files in the data directory, oldest first
+    xlsx_files = list_exports(data_directory)
+    if not xlsx_files:
+        raise FileNotFoundError(f"No Excel files found in {data_directory}")
+    most_recent_file_path = xlsx_files[-1]
+    
+    new_file_path = move_to_survey_folder(most_recent_file_path, data_directory)
+    target_dir = new_file_path.parent
+
+    # Get the most recent file(s) in the target directory
+    xlsx_files_new = list_exports(target_dir)
+    
+    if len(xlsx_files_new) < 1:
+        raise FileNotFoundError(f"No Excel files found in target directory {target_dir}")
+    elif len(xlsx_files_new) == 1:
+        most_recent_new_file_path = xlsx_files_new[-1]
+        last_file_new_path = xlsx_files_new[-1]
+    else:
+        most_recent_new_file_path = xlsx_files_new[-1]
+        last_file_new_path = xlsx_files_new[-2]
+    return str(most_recent_new_file_path), str(last_file_new_path)
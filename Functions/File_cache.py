@@ -0,0 +1,64 @@
+import os
+import hashlib
+import pickle
+from pathlib import Path
+
+def get_file_hash(file_path):
+    """
+    Returns the SHA-256 hash of a file's content.
+    """
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+def load_with_sidecar(source_file, build_function, sidecar_file=None):
+    """
+    Returns the parsed content of a source file, reusing a pickle sidecar while the file is unchanged.
+
+    The sidecar is reused as long as the source file has the same modification time or,
+    failing that, the same content hash. Otherwise the file is parsed again and the sidecar
+    is rewritten.
+
+    Args:
+        source_file (str or Path): Path to the source file (e.g. an xlsx spreadsheet).
+        build_function (function): Parses the source file; its result must be picklable.
+        sidecar_file (str or Path): Path of the sidecar. Defaults to the source path with a '.pkl' suffix.
+
+    Returns:
+        content: Result of build_function for the current version of the source file.
+        source_mtime (int): Modification time of the source file in nanoseconds.
+    """
+    source_file = Path(source_file)
+    if not source_file.exists():
+        raise FileNotFoundError(f"File not found: {source_file}")
+    sidecar_file = Path(sidecar_file) if sidecar_file is not None else source_file.with_suffix('.pkl')
+    source_mtime = source_file.stat().st_mtime_ns
+
+    cached = None
+    if sidecar_file.exists():
+        try:
+            with open(sidecar_file, 'rb') as f:
+                cached = pickle.load(f)
+        except Exception:
+            cached = None
+        if not isinstance(cached, dict) or not {'source_mtime', 'source_hash', 'content'} <= cached.keys():
+            cached = None
+
+    if cached is not None and cached['source_mtime'] == source_mtime:
+        return cached['content'], source_mtime
+
+    source_hash = get_file_hash(source_file)
+    if cached is None or cached['source_hash'] != source_hash:
+        cached = {'source_hash': source_hash, 'content': build_function(source_file)}
+    cached['source_mtime'] = source_mtime
+    # Write to a temporary file first, so concurrent readers never see a partial sidecar
+    temporary_file = sidecar_file.with_name(f"{sidecar_file.name}.{os.getpid()}.tmp")
+    try:
+        with open(temporary_file, 'wb') as f:
+            pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_file, sidecar_file)
+    except OSError:
+        pass  # The sidecar is optional; a read-only folder only costs a re-parse
+    return cached['content'], source_mtime
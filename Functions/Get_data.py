@@ -1,76 +1,220 @@
 import pandas as pd
-import os
 from pathlib import Path
-import glob
-
-def get_file_path(parent_directory, sub_directory):
-    """
-    Returns the path to the most recent Excel data file for processing,
-    and moves it into a subdirectory based on its number of columns.
-    """
-    data_directory = Path(parent_directory) / sub_directory
-    # Get all Excel files in the data directory
-    xlsx_files = list(data_directory.glob('*.xlsx'))
-    if not xlsx_files:
-        raise FileNotFoundError(f"No Excel files found in {data_directory}")
-    
-    # Sort files by modification time
-    xlsx_files.sort(key=lambda x: x.stat().st_mtime)
-    most_recent_file_path = xlsx_files[-1]
-    
-    latest_survey_data_raw = pd.read_excel(most_recent_file_path, skiprows=1)
-    most_recent_file_name = most_recent_file_path.name
-
-    num_cols = len(latest_survey_data_raw.columns)
-    if num_cols < 50:
-        target_subdir = "ICAR 16"
-    elif (num_cols > 50) and (num_cols < 120):
-        target_subdir = "ICAR 60"
-    elif (num_cols > 120) and (num_cols < 300):
-        target_subdir = "NEO-IPIP 120"
-    elif num_cols > 300:
-        target_subdir = "NEO-IPIP 300"
-    else:
-        raise ValueError("Survey data does not match any expected format based on column count.")
+import numpy as np
+import openpyxl
 
-    target_dir = data_directory / target_subdir
-    target_dir.mkdir(parents=True, exist_ok=True)
-    new_file_path = target_dir / most_recent_file_name
+from Functions.File_cache import load_with_sidecar
+from Functions.Export_inbox import get_file_path
+from Functions.Response_decoder import decode_likert_responses
+from Functions.Respondent_ledger import open_ledger, get_respondent_keys, get_content_hashes, find_unprocessed
+from Functions.Run_metrics import stage
 
-    # Move (rename) the file if not already in the target directory
-    if most_recent_file_path.exists() and most_recent_file_path != new_file_path:
-        try:
-            most_recent_file_path.rename(new_file_path)
-        except Exception as e:
-            raise IOError(f"Error moving file {most_recent_file_path} to {new_file_path}: {e}")
-
-    # Get the most recent file(s) in the target directory
-    xlsx_files_new = list(target_dir.glob('*.xlsx'))
-    xlsx_files_new.sort(key=lambda x: x.stat().st_mtime)
-    
-    if len(xlsx_files_new) < 1:
-        raise FileNotFoundError(f"No Excel files found in target directory {target_dir}")
-    elif len(xlsx_files_new) == 1:
-        most_recent_new_file_path = xlsx_files_new[-1]
-        last_file_new_path = xlsx_files_new[-1]
-    else:
-        most_recent_new_file_path = xlsx_files_new[-1]
-        last_file_new_path = xlsx_files_new[-2]
-    return str(most_recent_new_file_path), str(last_file_new_path)
+# Second header row label of a question with a single answer column, which is then named by
+# its question in the first header row
+ANSWER_LABELS = ('Response', 'Open-Ended Response')
+# Version of the column naming of parsed exports, part of their sidecar name so exports parsed
+# before a change are parsed again
+EXPORT_PARSE_VERSION = 2
+
+def read_header_rows(file_path):
+    """
+    Returns the two header rows of a SurveyMonkey export as lists of cell values (None for an
+    empty cell), with a streaming parse that does not load the responses.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = [list(row) for row in workbook.worksheets[0].iter_rows(min_row=1, max_row=2, values_only=True)]
+    finally:
+        workbook.close()
+    return (rows + [[], []])[:2]
+
+def get_column_names(question_row, answer_row):
+    """
+    Names the columns of a SurveyMonkey export from its two header rows. The second row
+    names the answer columns of matrix questions (e.g. the NEO IPIP items); a question with a
+    single answer column is labelled 'Response' there, and is named by the first row instead
+    (e.g. the ICAR items, which are matched by name with the item key). Names are then made
+    unique (see get_unique_column_names).
+    """
+    names = []
+    for n, answer in enumerate(answer_row):
+        question = question_row[n] if n < len(question_row) else None
+        names.append(question if answer in ANSWER_LABELS and question is not None else answer)
+    return get_unique_column_names(names)
+
+def parse_survey_export(file_path):
+    """
+    Parses a SurveyMonkey export, with the column names of get_column_names.
+    """
+    survey_data = pd.read_excel(file_path, skiprows=1)
+    question_row, answer_row = read_header_rows(file_path)
+    width = survey_data.shape[1]
+    survey_data.columns = get_column_names(question_row[:width], (answer_row + [None] * width)[:width])
+    return survey_data
+
+def get_unique_column_names(header):
+    """
+    Names the columns of a header row the way pandas does: empty cells become
+    'Unnamed: <position>' and repeated names get a '.1', '.2', ... suffix.
+    """
+    columns, seen = [], {}
+    for n, value in enumerate(header):
+        name = f"Unnamed: {n}" if value is None else value
+        if name in seen:
+            seen[name] += 1
+            while f"{name}.{seen[name]}" in seen:
+                seen[name] += 1
+            name_unique = f"{name}.{seen[name]}"
+            seen[name_unique] = 0
+            columns.append(name_unique)
+        else:
+            seen[name] = 0
+            columns.append(name)
+    return columns
+
+def iter_survey_export_blocks(file_path, chunk_size):
+    """
+    Streams a SurveyMonkey export in blocks of rows, with the column names of
+    parse_survey_export, without loading the whole workbook into memory.
+
+    Args:
+        file_path (str or Path): Path to the export.
+        chunk_size (int): Number of response rows per block.
+
+    Yields:
+        survey_data (DataFrame): Responses of one block, indexed by their row position in the export.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(min_row=1, values_only=True)
+        question_row = list(next(rows, None) or [])
+        header = list(next(rows, None) or [])
+        # Trailing empty header cells are not columns
+        while header and header[-1] is None:
+            header.pop()
+        if not header:
+            return
+        columns = get_column_names(question_row, header)
+        width = len(columns)
+
+        def to_frame(block, start):
+            # Empty cells become NaN and whole numbers stored as floats become int, like pandas does
+            block = [[np.nan if v is None else int(v) if isinstance(v, float) and v.is_integer() else v for v in row]
+                     for row in block]
+            return pd.DataFrame(block, columns=columns, index=pd.RangeIndex(start, start + len(block)))
+
+        block, start = [], 0
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            if any(value is not None for value in row[width:]):
+                raise ValueError(f"Response row wider than the header in {file_path}; read it with parse_survey_export instead.")
+            block.append((list(row) + [None] * width)[:width])
+            if len(block) == chunk_size:
+                yield to_frame(block, start)
+                start += len(block)
+                block = []
+        if block:
+            yield to_frame(block, start)
+    finally:
+        workbook.close()
 
-def get_survey_info_numeric_data(parent_directory):
+def get_export_sidecar(file_path):
     """
-    Reads in the latest survey data in Excel format and returns two dataframes:
-    one with test information and one with numeric responses.
+    Returns the path of the pickle sidecar of a parsed export (see EXPORT_PARSE_VERSION).
+    """
+    file_path = Path(file_path)
+    return file_path.with_name(f"{file_path.stem}.v{EXPORT_PARSE_VERSION}.pkl")
+
+def read_survey_export(file_path):
+    """
+    Reads a SurveyMonkey export. The parsed data is kept in a pickle sidecar next to the
+    export (see get_export_sidecar), so later runs over the same, unchanged file skip the xlsx parse.
+    """
+    with stage('read export') as span:
+        survey_data, _ = load_with_sidecar(file_path, parse_survey_export, sidecar_file=get_export_sidecar(file_path))
+        span['rows'] = len(survey_data)
+    return survey_data
+
+def get_survey_info_numeric_data(parent_directory, incremental=False):
+    """
+    Reads in the latest survey data in Excel format and returns two dataframes, one with
+    test information and one with numeric responses, and the decoded Likert answers (see
+    get_numeric_responses).
+
+    By default, new responses are those that differ from the previous export. With
+    incremental=True, they are the responses of the latest export that the respondent
+    ledger has no up-to-date report for (new, changed, or never rendered).
+    The test information includes 'Survey Type', 'Respondent Key' and 'Content Hash'
+    columns for recording the rendered reports in the ledger.
     """
     latest_survey_data_path, last_survey_data_path = get_file_path(parent_directory=parent_directory, sub_directory='Data')
-    latest_survey_data_raw = pd.read_excel(latest_survey_data_path, skiprows=1)
-    if latest_survey_data_path == last_survey_data_path:
-        latest_survey_data_original = latest_survey_data_raw.copy()
+    return read_survey_info_numeric_data(parent_directory, latest_survey_data_path, last_survey_data_path, incremental=incremental)
+
+def read_survey_info_numeric_data(parent_directory, latest_survey_data_path, last_survey_data_path, incremental=False,
+                                  latest_survey_data_raw=None):
+    """
+    Reads in the given survey export and returns the test information, the numeric
+    responses and the decoded Likert answers. See get_survey_info_numeric_data.
+
+    Args:
+        parent_directory (str or Path): Parent folder for the repository.
+        latest_survey_data_path (str or Path): Export to process, inside its survey sub-folder.
+        last_survey_data_path (str or Path): Previous export of the same survey, used to find
+            new responses when incremental is False (the same path if there is none).
+        incremental (bool): Find new responses with the respondent ledger instead.
+        latest_survey_data_raw (DataFrame): The export as read by read_survey_export, if the
+            caller has already read it.
+    """
+    latest_survey_data_path, last_survey_data_path = str(latest_survey_data_path), str(last_survey_data_path)
+    survey_type = Path(latest_survey_data_path).parent.name
+    if latest_survey_data_raw is None:
+        latest_survey_data_raw = read_survey_export(latest_survey_data_path)
+    if incremental:
+        latest_survey_data_original, respondent_keys, content_hashes = select_unprocessed_responses(
+            parent_directory, survey_type, latest_survey_data_raw)
     else:
-        last_survey_data = pd.read_excel(last_survey_data_path, skiprows=1)
-        latest_survey_data_original = pd.concat([last_survey_data, latest_survey_data_raw]).drop_duplicates(keep=False)
+        if latest_survey_data_path == last_survey_data_path:
+            latest_survey_data_original = latest_survey_data_raw.copy()
+        else:
+            last_survey_data = read_survey_export(last_survey_data_path)
+            latest_survey_data_original = pd.concat([last_survey_data, latest_survey_data_raw]).drop_duplicates(keep=False)
+        respondent_keys = get_respondent_keys(latest_survey_data_original)
+        content_hashes = get_content_hashes(latest_survey_data_original)
+    with stage('decode responses', rows=len(latest_survey_data_original)):
+        return split_survey_info_numeric_data(latest_survey_data_original, survey_type, respondent_keys, content_hashes)
+
+def select_unprocessed_responses(parent_directory, survey_type, survey_data):
+    """
+    Keeps the responses that the respondent ledger has no up-to-date report for.
+
+    Returns:
+        survey_data (DataFrame): The new, changed or never rendered responses.
+        respondent_keys (Series): Their respondent keys.
+        content_hashes (Series): Their content hashes.
+    """
+    with stage('select unprocessed responses', rows=len(survey_data)):
+        respondent_keys = get_respondent_keys(survey_data)
+        content_hashes = get_content_hashes(survey_data)
+        ledger = open_ledger(parent_directory)
+        try:
+            unprocessed = find_unprocessed(ledger, survey_type, respondent_keys, content_hashes)
+        finally:
+            ledger.close()
+    return survey_data[unprocessed], respondent_keys[unprocessed], content_hashes[unprocessed]
+
+def split_survey_info_numeric_data(latest_survey_data_original, survey_type, respondent_keys, content_hashes):
+    """
+    Splits raw survey responses into a dataframe with test information and a dataframe
+    with numeric responses, and returns the decoded Likert answers with them (see
+    get_numeric_responses).
 
+    Args:
+        latest_survey_data_original (DataFrame): Responses as read by parse_survey_export.
+        survey_type (str): Survey type, e.g. 'NEO-IPIP 120'.
+        respondent_keys (Series): Respondent key of each response.
+        content_hashes (Series): Content hash of each response.
+    """
     # Extract test information columns
     if latest_survey_data_original.shape[1] < 15:
         raise ValueError("Not enough columns in the survey data for test information extraction.")
@@ -80,6 +224,9 @@ def get_survey_info_numeric_data(parent_directory):
         latest_survey_data_test_info.columns[1]: 'End Date', 
         latest_survey_data_test_info.columns[2]: 'IP Address'
     }, inplace=True)
+    latest_survey_data_test_info['Survey Type'] = survey_type
+    latest_survey_data_test_info['Respondent Key'] = respondent_keys.to_numpy()
+    latest_survey_data_test_info['Content Hash'] = content_hashes.to_numpy()
 
     # Combine first, last, and (if present) middle name columns
     if not {'First name', 'Last name'}.issubset(latest_survey_data_original.columns):
@@ -96,6 +243,7 @@ def get_survey_info_numeric_data(parent_directory):
             pd.to_datetime(latest_survey_data_test_info['End Date']) - 
             pd.to_datetime(latest_survey_data_test_info['Start Date'])
         ).dt.total_seconds() / 60
+        latest_survey_data_test_info['Response Seconds'] = (response_time_minutes * 60).to_numpy(dtype=float)
         latest_survey_data_test_info['Response Time'] = pd.to_datetime(response_time_minutes, unit='m').dt.strftime('%H:%M:%S')
     except Exception as e:
         raise ValueError("Error calculating response time: " + str(e))
@@ -106,18 +254,33 @@ def get_survey_info_numeric_data(parent_directory):
     except Exception as e:
         raise ValueError("Error formatting completion time: " + str(e))
 
+    latest_survey_data_numeric, likert_responses = get_numeric_responses(latest_survey_data_original)
+    unknown_counts = likert_responses['unknown_counts']
+    if unknown_counts.any():
+        print(f"{unknown_counts.sum()} unrecognized answer(s) treated as missing in: "
+              f"{', '.join(unknown_counts[unknown_counts > 0].index.astype(str))}")
+    return latest_survey_data_test_info, latest_survey_data_numeric, likert_responses
+
+def get_numeric_responses(survey_data):
+    """
+    Returns the numeric responses of raw survey responses: the columns without "Unnamed" in
+    their name, with the Likert answers as uint8 codes (1-5, 0 for a missing answer).
+
+    Returns:
+        survey_data_numeric (DataFrame): The numeric responses.
+        likert_responses (dict): Output of decode_likert_responses, kept for scoring the
+            items straight from it (see get_item_matrix): 'responses' (uint8 matrix with one
+            row per response and one column per item), 'items' (item columns, in survey order)
+            and 'unknown_counts' (number of unrecognized answers per item column).
+    """
     # Remove columns with "Unnamed" in their name
-    cols_to_drop = list(latest_survey_data_original.filter(regex='Unnamed').columns)
-    latest_survey_data_survey = latest_survey_data_original.drop(columns=cols_to_drop)
-    
-    # Recode string responses to numeric values
-    latest_survey_data_numeric = latest_survey_data_survey.replace({
-        'Inaccurate': 1, 'Moderately Inaccurate': 2, 
-        'Neither': 3, 'Moderately Accurate': 4, 'Accurate': 5
-    })
-
-    if latest_survey_data_numeric.shape[1] <= 4:
-        raise ValueError("Not enough survey data columns for variance calculation.")
-    latest_survey_data_test_info['Response Variance'] = (latest_survey_data_numeric.iloc[:, 4:].std(axis=1) * 10).round(0).astype(float)
-    
-    return latest_survey_data_test_info, latest_survey_data_numeric
+    cols_to_drop = list(survey_data.filter(regex='Unnamed').columns)
+    survey_data_survey = survey_data.drop(columns=cols_to_drop)
+
+    # Recode string responses to numeric values (uint8 codes 1-5, 0 for a missing answer)
+    responses, likert_items, unknown_counts = decode_likert_responses(survey_data_survey)
+    survey_data_numeric = pd.concat([
+        survey_data_survey.drop(columns=likert_items),
+        pd.DataFrame(responses, index=survey_data_survey.index, columns=likert_items)
+    ], axis=1)[survey_data_survey.columns]
+    return survey_data_numeric, {'responses': responses, 'items': likert_items, 'unknown_counts': unknown_counts}
@@ -0,0 +1,133 @@
+import pandas as pd
+import numpy as np
+from pathlib import Path
+
+from Functions.File_cache import load_with_sidecar
+from Functions.Run_metrics import stage
+
+# Age bands of the norm groups, as [lower, upper) edges in years
+AGE_BAND_EDGES = [0, 18, 25, 35, 45, 55, 65, np.inf]
+# Age bands with fewer norm respondents than this fall back to the norm group of all ages
+MIN_NORM_GROUP_SIZE = 30
+
+# Version of the norm index layout, part of its sidecar name so an older index is rebuilt
+NORM_INDEX_VERSION = 2
+
+# Norm indexes already loaded in this process, keyed by the resolved norm data path
+_loaded_norm_indexes = {}
+
+def get_age_bands(ages, age_band_edges=AGE_BAND_EDGES):
+    """
+    Returns the position of each age in the age bands, or -1 for a missing or out-of-range age.
+    """
+    ages = np.asarray(ages, dtype=float)
+    bands = np.searchsorted(age_band_edges, ages, side='right') - 1
+    in_range = np.isfinite(ages) & (bands >= 0) & (bands < len(age_band_edges) - 1)
+    return np.where(in_range, bands, -1)
+
+def get_column_moments(score_matrix):
+    """
+    Returns the mean and standard deviation of each column over its non-missing scores (NaN
+    for a column with fewer than one and two scores respectively).
+    """
+    present = np.isfinite(score_matrix)
+    count = present.sum(axis=0)
+    values = np.where(present, score_matrix, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(count > 0, values.sum(axis=0) / count, np.nan)
+        squares = (np.where(present, score_matrix - mean, 0) ** 2).sum(axis=0)
+        std = np.where(count > 1, np.sqrt(squares / (count - 1)), np.nan)
+    return mean, std
+
+def build_icar_norm_index(norm_file):
+    """
+    Builds the age-banded norm index of an ICAR norm table ('ICAR_Norm_Data.csv').
+
+    Args:
+        norm_file (Path): Norm table with an 'age' column and one column per score.
+
+    Returns:
+        norm_index (dict): The score names, the age band edges, and per norm group (one per
+            age band, then all ages) the column-wise sorted scores (missing scores last), the
+            number of scores, mean and standard deviation of each column, and the group size.
+    """
+    norm_data = pd.read_csv(norm_file)
+    scores = [c for c in norm_data.columns if c != 'age']
+    score_matrix = norm_data[scores].to_numpy(dtype=float)
+    bands = get_age_bands(norm_data['age'])
+
+    groups = [score_matrix[bands == band] for band in range(len(AGE_BAND_EDGES) - 1)] + [score_matrix]
+    return {
+        'scores': scores,
+        'age_band_edges': np.asarray(AGE_BAND_EDGES, dtype=float),
+        'sorted_scores': [np.sort(group, axis=0) for group in groups],
+        'score_count': np.array([np.isfinite(group).sum(axis=0) for group in groups]),
+        'mean': np.array([get_column_moments(group)[0] for group in groups]),
+        'std': np.array([get_column_moments(group)[1] for group in groups]),
+        'group_size': np.array([len(group) for group in groups]),
+    }
+
+def get_icar_norm_index(parent_directory):
+    """
+    Returns the norm index of 'ICAR/ICAR_Norm_Data.csv' for the given parent directory.
+
+    The index is kept in memory for the rest of the process and in 'ICAR_Norm_Index_v2.pkl'
+    (see NORM_INDEX_VERSION) next to the norm table, and is rebuilt whenever the norm table changes.
+    """
+    norm_file = (Path(parent_directory).parent / 'ICAR' / 'ICAR_Norm_Data.csv').resolve()
+    if not norm_file.exists():
+        raise FileNotFoundError(f"ICAR norm data not found: {norm_file}; run ICAR_norm_data.py first")
+
+    loaded = _loaded_norm_indexes.get(norm_file)
+    if loaded is not None and loaded['source_mtime'] == norm_file.stat().st_mtime_ns:
+        return loaded['norm_index']
+
+    with stage('load ICAR norm index'):
+        norm_index, source_mtime = load_with_sidecar(
+            norm_file, build_icar_norm_index, sidecar_file=norm_file.with_name(f'ICAR_Norm_Index_v{NORM_INDEX_VERSION}.pkl'))
+    _loaded_norm_indexes[norm_file] = {'source_mtime': source_mtime, 'norm_index': norm_index}
+    return norm_index
+
+def lookup_icar_norms(norm_index, ages, score_matrix, score_names=None):
+    """
+    Returns the percentiles and z-scores of many test takers against their age-matched norm groups.
+
+    Test takers without a usable age, or whose age band has fewer than MIN_NORM_GROUP_SIZE
+    norm respondents, are compared with the norm group of all ages. The percentile is the
+    percentage of the norm group that scored strictly lower, among the norm respondents who
+    have the score (see score_ICAR).
+
+    Args:
+        norm_index (dict): Output of build_icar_norm_index.
+        ages (array-like): Age of each test taker.
+        score_matrix (ndarray): One row per test taker, one column per score in score_names.
+        score_names (list): Names of the score columns; all scores of the index by default.
+
+    Returns:
+        percentiles (ndarray): Percentiles (0-100), shaped like score_matrix.
+        z_scores (ndarray): z-scores, shaped like score_matrix; NaN where the norm group has no spread.
+    """
+    score_names = norm_index['scores'] if score_names is None else list(score_names)
+    score_position = [norm_index['scores'].index(name) for name in score_names]
+    score_matrix = np.asarray(score_matrix, dtype=float).reshape(-1, len(score_names))
+
+    all_ages = len(norm_index['group_size']) - 1
+    groups = get_age_bands(ages, norm_index['age_band_edges'])
+    groups = np.where(groups < 0, all_ages, groups)
+    groups = np.where(norm_index['group_size'][groups] < MIN_NORM_GROUP_SIZE, all_ages, groups)
+
+    percentiles = np.full(score_matrix.shape, np.nan)
+    for group in np.unique(groups):
+        in_group = groups == group
+        sorted_scores = norm_index['sorted_scores'][group]
+        for n, position in enumerate(score_position):
+            below = np.searchsorted(sorted_scores[:, position], score_matrix[in_group, n], side='left')
+            count = norm_index['score_count'][group, position]
+            percentiles[in_group, n] = below / count * 100 if count else np.nan
+    percentiles[np.isnan(score_matrix)] = np.nan
+
+    mean = norm_index['mean'][groups][:, score_position]
+    std = norm_index['std'][groups][:, score_position]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_scores = np.where(std > 0, (score_matrix - mean) / std, np.nan)
+    return percentiles, z_scores
@@ -0,0 +1,170 @@
+import pandas as pd
+import numpy as np
+
+from Functions.Codebook_loader import get_cognitive_codebook
+
+# Item key column with the item names of each ICAR form, by survey type
+ICAR_FORMS = {'ICAR 16': 'ICAR16', 'ICAR 60': 'ICAR60'}
+# Item key column with the correct answer of each item
+ANSWER_COLUMN = 'answer'
+
+def compile_ICAR_key(codebook, item_column, data_columns, item_column_60=None):
+    """
+    Compiles the ICAR item key into the weight matrix used for matrix-based scoring.
+
+    A dimension score is the sum of the dimension's items, and 'ICAR_Total' the sum of the
+    dimension scores. The '_60' scores put every respondent on the scale of the full ICAR 60,
+    whichever items they were given: a dimension's '_60' score is the share of correct
+    answers among the dimension's '_60' items the respondent was given, times the number of
+    '_60' item names of the dimension, and 'ICAR60_Total' is the same over all '_60' items
+    (see score_ICAR). The norm data and the test takers are scored alike.
+
+    Args:
+        codebook (DataFrame): ICAR item key with a 'dimension' column and columns of item names.
+        item_column (str): Codebook column with the item names of the dimension scores.
+        data_columns (Index): Columns of the data; items not in the data are left out.
+        item_column_60 (str): Codebook column with the item names of the '_60' scores;
+            item_column by default.
+
+    Returns:
+        scoring_key (dict): Item names, the item-by-score weight matrix, the score names
+            ('ICAR_Total', 'ICAR60_Total', the dimensions, then the dimensions with '_60'
+            added), the full-form item count of each score (0 for the unscaled scores), the
+            dimension names and the number of items per dimension.
+    """
+    if item_column_60 is None:
+        item_column_60 = item_column
+    dimensions = list(codebook.dimension.unique())
+    items = [i for i in pd.unique(codebook[[item_column, item_column_60]].to_numpy().ravel())
+             if i in data_columns]
+    item_position = {item: n for n, item in enumerate(items)}
+
+    item_dimension = np.zeros((len(items), len(dimensions)), dtype=np.float64)
+    item_dimension_60 = np.zeros((len(items), len(dimensions)), dtype=np.float64)
+    dimension_item_count_60 = np.zeros(len(dimensions))
+    for n, d in enumerate(dimensions):
+        dimension_items = codebook[codebook.dimension == d][item_column].unique()
+        dimension_items_60 = codebook[codebook.dimension == d][item_column_60].dropna().unique()
+        dimension_item_count_60[n] = len(dimension_items_60)
+        for item in dimension_items:
+            if item in item_position:
+                item_dimension[item_position[item], n] = 1
+        for item in dimension_items_60:
+            if item in item_position:
+                item_dimension_60[item_position[item], n] = 1
+
+    weights = np.column_stack([
+        item_dimension.sum(axis=1), item_dimension_60.sum(axis=1), item_dimension, item_dimension_60])
+    return {
+        'items': items,
+        'weights': weights,
+        'scores': ['ICAR_Total', 'ICAR60_Total'] + dimensions + [f"{d}_60" for d in dimensions],
+        'full_form_items': np.concatenate([[0, dimension_item_count_60.sum()], np.zeros(len(dimensions)),
+                                           dimension_item_count_60]),
+        'dimensions': dimensions,
+        'dimension_item_count': item_dimension.sum(axis=0).astype(np.int64),
+    }
+
+def score_ICAR(scoring_key, item_matrix, administered=None):
+    """
+    Scores a respondent-by-item matrix of item scores (1 correct, 0 incorrect, NaN missing)
+    with a compiled ICAR key in matrix products.
+
+    Args:
+        scoring_key (dict): Output of compile_ICAR_key.
+        item_matrix (ndarray): Item scores in the order of scoring_key['items'].
+        administered (ndarray): True for the items each respondent was given. By default the
+            items with a score, as in the SAPA norm data, where each respondent was given a
+            random subset of the items. Test takers are given every item of their form, so a
+            missing answer counts as a wrong one.
+
+    Returns:
+        scores (ndarray): One column per name in scoring_key['scores']; a '_60' score is NaN
+            when the respondent was given none of its items.
+    """
+    item_matrix = np.asarray(item_matrix, dtype=np.float64)
+    if administered is None:
+        administered = ~np.isnan(item_matrix)
+    scores = np.nan_to_num(item_matrix) @ scoring_key['weights']
+    # Scale the '_60' scores from the items given to all items of the full form
+    scaled = scoring_key['full_form_items'] > 0
+    given = np.asarray(administered, dtype=np.float64) @ scoring_key['weights'][:, scaled]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores[:, scaled] = np.where(given > 0, scores[:, scaled] / given, np.nan) * scoring_key['full_form_items'][scaled]
+    return scores
+
+def normalize_answers(answers):
+    """
+    Returns answers as stripped, case-folded strings, with whole numbers written without
+    decimals (4.0 and '4' both become '4'), so that responses and answer keys compare equal.
+    Missing answers are NaN. The result has the shape of the input.
+    """
+    answers = np.asarray(answers, dtype=object)
+    # Answers repeat a few options, so only the distinct values are normalized
+    codes, values = pd.factorize(answers.ravel())
+    values = pd.Series(values, dtype=object)
+    numbers = pd.to_numeric(values, errors='coerce')
+    whole = numbers.notna() & (numbers % 1 == 0)
+    text = values.astype(str).str.strip().str.casefold()
+    text[whole] = numbers[whole].astype(np.int64).astype(str)
+    text[text == ''] = np.nan
+    # Missing answers have code -1, which picks the trailing NaN
+    text = np.append(text.to_numpy(dtype=object), np.nan)
+    return text[codes].reshape(answers.shape)
+
+def get_item_columns(survey_data, form_codebook, item_column):
+    """
+    Returns the columns of the survey data that hold the items of an ICAR form, in the order
+    of the item key.
+
+    The items are found by their names in the item key, in the form's column or in the
+    'ICAR60' column. In a SurveyMonkey export, each item is named by its question, the first
+    header row (see get_column_names).
+    """
+    for column in (item_column, 'ICAR60'):
+        names = list(form_codebook[column])
+        if set(names) <= set(survey_data.columns):
+            return names
+    missing = [name for name in form_codebook[item_column] if name not in survey_data.columns]
+    raise ValueError(f"{len(missing)} of the {len(form_codebook)} {item_column} items of the item key are not "
+                     f"columns of the survey data (e.g. {missing[0]!r}); name each question of the survey "
+                     f"as its item in the item key.")
+
+def recode_ICAR(parent_directory, survey_data, survey_type):
+    """
+    Scores ICAR-16 or ICAR-60 responses against the answer key in 'ICAR Item Key.xlsx'.
+
+    All responses are compared with the answer key at once, and the dimension, '_60' and
+    total scores are computed as for the norm data (see compile_ICAR_key): the '_60' scores
+    of an ICAR 16 test taker are scaled from the 4 items per dimension to the full ICAR 60,
+    and those of an ICAR 60 test taker are their plain sums.
+
+    Args:
+        parent_directory (str or Path): Parent folder for the repository.
+        survey_data (DataFrame): Responses with one column per ICAR item.
+        survey_type (str): 'ICAR 16' or 'ICAR 60'.
+
+    Returns:
+        item_scores (DataFrame): 1 for a correct, 0 for a wrong and NaN for a missing answer,
+            with the items named as in the 'ICAR60' column of the item key.
+        ICAR_scores (DataFrame): One column per score of the compiled key.
+        scoring_key (dict): Output of compile_ICAR_key for the items of the form.
+    """
+    codebook_all = get_cognitive_codebook(parent_directory)
+    if ANSWER_COLUMN not in codebook_all.columns:
+        raise ValueError(f"ICAR Item Key.xlsx has no '{ANSWER_COLUMN}' column with the correct answers.")
+    item_column = ICAR_FORMS[survey_type]
+    form_codebook = codebook_all.dropna(subset=[item_column])
+
+    item_columns = get_item_columns(survey_data, form_codebook, item_column)
+    responses = normalize_answers(survey_data[item_columns].to_numpy(dtype=object))
+    answers = normalize_answers(form_codebook[ANSWER_COLUMN].to_numpy(dtype=object))
+    item_scores = np.where(pd.isna(responses), np.nan, (responses == answers).astype(np.float64))
+    item_scores = pd.DataFrame(item_scores, index=survey_data.index, columns=list(form_codebook['ICAR60']))
+
+    scoring_key = compile_ICAR_key(codebook_all, 'ICAR60', item_scores.columns)
+    # Every item of the form was given to the test taker, answered or not
+    item_matrix = item_scores[scoring_key['items']].to_numpy()
+    ICAR_scores = pd.DataFrame(score_ICAR(scoring_key, item_matrix, administered=np.ones(item_matrix.shape, dtype=bool)),
+                               index=survey_data.index, columns=scoring_key['scores'])
+    return item_scores, ICAR_scores, scoring_key
@@ -1,97 +1,138 @@
 import pandas as pd
 import numpy as np
-from pathlib import Path
 
-def recode_NEO_IPIP(parent_directory, survey_data):
+from Functions.Codebook_loader import get_personality_codebook
+from Functions.Response_decoder import decode_blank_items, get_item_matrix
+
+def compile_NEO_IPIP_key(codebook, survey_columns):
     """
-    Recodes the items in the NEO IPIP 120 and 300 surveys into facets and dimensions.
+    Compiles the item key of one NEO IPIP form into the arrays used for matrix-based scoring.
+
+    Args:
+        codebook (DataFrame): Codebook of the form with 'Dimension', 'Recode', 'Facet' and 'Item' columns.
+        survey_columns (Index): Columns of the survey data; items not in the survey are left out.
+
+    Returns:
+        scoring_key (dict): Item names, reverse-key vector, item-to-facet and facet-to-dimension
+            weight matrices, facet and dimension names, and the facet count per dimension.
+    """
+    items = [i for i in codebook.Item.unique() if i in survey_columns]
+    facets = list(codebook.Facet.unique())
+    dimensions = list(codebook.Dimension.unique())
+
+    # An item is reverse coded only if every codebook row for it is marked for recoding
+    reverse = codebook.groupby('Item', sort=False)['Recode'].agg(lambda x: x.str.contains('Yes').all())
+    reverse = reverse.reindex(items).to_numpy(dtype=bool)
+
+    item_facet = np.zeros((len(items), len(facets)), dtype=np.int64)
+    item_position = {item: n for n, item in enumerate(items)}
+    facet_position = {facet: n for n, facet in enumerate(facets)}
+    for item, facet in codebook[['Item', 'Facet']].drop_duplicates().itertuples(index=False):
+        if item in item_position:
+            item_facet[item_position[item], facet_position[facet]] = 1
+
+    facet_dimension = np.zeros((len(facets), len(dimensions)), dtype=np.int64)
+    dimension_position = {dimension: n for n, dimension in enumerate(dimensions)}
+    for facet, dimension in codebook[['Facet', 'Dimension']].drop_duplicates().itertuples(index=False):
+        facet_dimension[facet_position[facet], dimension_position[dimension]] = 1
+
+    return {
+        'items': items,
+        'reverse': reverse,
+        'item_facet': item_facet,
+        'facets': facets,
+        'facet_dimension': facet_dimension,
+        'dimensions': dimensions,
+        'facet_count': facet_dimension.sum(axis=0),
+    }
+
+def score_NEO_IPIP(scoring_key, item_matrix):
+    """
+    Scores a respondent-by-item matrix with a compiled NEO IPIP key.
+
+    Args:
+        scoring_key (dict): Output of compile_NEO_IPIP_key.
+        item_matrix (ndarray): Numeric responses (1-5) in the order of scoring_key['items'],
+            either float with NaN or 0 for a missing answer (0 when uint8 codes are mixed with
+            float columns), or uint8 with 0 for a missing answer (see decode_likert_responses).
+
+    Returns:
+        recoded (ndarray): Item responses after reverse coding.
+        facet_scores (ndarray): Facet sums, one column per facet.
+        dimension_scores (ndarray): Dimension averages over facets, one column per dimension.
+        personality_score (ndarray): Total of all recoded items.
+    """
+    if item_matrix.dtype == np.uint8:
+        # Missing answers are already zero and stay zero
+        recoded = np.where(scoring_key['reverse'] & (item_matrix > 0), 6 - item_matrix, item_matrix).astype(np.uint8)
+        recoded_filled = recoded
+    else:
+        # A missing answer must not be reverse coded into a 6
+        item_matrix = np.where(item_matrix == 0, np.nan, item_matrix)
+        recoded = np.where(scoring_key['reverse'], 6 - item_matrix, item_matrix)
+        # Missing answers count as zero, as in a pandas row sum
+        recoded_filled = np.nan_to_num(recoded) if recoded.dtype.kind == 'f' else recoded
+    # Floating-point products use BLAS; the sums of 1-5 codes are exact
+    facet_scores = recoded_filled.astype(np.float64) @ scoring_key['item_facet']
+    dimension_scores = np.round((facet_scores @ scoring_key['facet_dimension']) / scoring_key['facet_count'], 0)
+    personality_score = recoded_filled.sum(axis=1, dtype=np.float64)
+    return recoded, facet_scores, dimension_scores, personality_score
+
+def get_NEO_IPIP_form_codebook(codebook_tables, survey_data):
+    """
+    Returns the codebook of the NEO IPIP form (120 or 300 items) of the survey data.
     """
-    project_path = Path(parent_directory).parent
-    codebook_directory = project_path / 'IPIP'
-    codebook_file = codebook_directory / 'Personality Item Key.xlsx'
-    if not codebook_file.exists():
-        raise FileNotFoundError(f"Codebook not found: {codebook_file}")
-    codebook_all = pd.read_excel(codebook_file, sheet_name='IPIP-NEO-ItemKey')
-    
-    # Add FFM dimension based on Key content
-    codebook_all['Dimension'] = np.where(codebook_all.Key.str.contains('O'), 'Openness', 
-                                  np.where(codebook_all.Key.str.contains('C'), 'Conscientiousness', 
-                                  np.where(codebook_all.Key.str.contains('E'), 'Extroversion', 
-                                  np.where(codebook_all.Key.str.contains('A'), 'Agreeableness', 
-                                  np.where(codebook_all.Key.str.contains('N'), 'Neuroticism', pd.NA)))))
-    # Mark items that require reverse coding
-    codebook_all['Recode'] = np.where(codebook_all.Sign.str.contains('-'), 'Yes', 'No')
-    
-    # Create separate codebooks for 300-item and 120-item surveys
-    codebook_300 = codebook_all[['Dimension', 'Recode', 'Facet', 'Item']].copy()
-    codebook_120 = codebook_all.dropna(subset=['Short#']).copy()[['Dimension', 'Recode', 'Facet', 'Item']]
-    
     if len(survey_data.columns) < 300:  # NEO IPIP 120
-        for i in codebook_120.Item.unique():
-            if codebook_120[codebook_120.Item == i]['Recode'].str.contains('Yes').all():
-                survey_data[i] = 6 - survey_data[i]
-        
-        # Calculate average scores for dimensions
-        for d in codebook_all.Dimension.unique():
-            dimension_items = codebook_120[codebook_120.Dimension == d]['Item'].unique()
-            survey_data_slice = survey_data[survey_data.columns.intersection(dimension_items)]
-            if len(dimension_items) > 0:
-                dimension_df = pd.DataFrame({d: (survey_data_slice.sum(axis=1) / 
-                    len(codebook_120[codebook_120.Dimension == d]['Facet'].unique())).round(0)},
-                    index=survey_data_slice.index)
-                survey_data = pd.concat([survey_data, dimension_df], axis=1)
-            
-        # Sum facets
-        for f in codebook_120.Facet.unique():
-            facet_items = codebook_120[codebook_120.Facet == f]['Item'].unique()
-            survey_data_slice = survey_data[survey_data.columns.intersection(facet_items)]
-            facet_df = pd.DataFrame({f: survey_data_slice.sum(axis=1)}, index=survey_data.index)
-            survey_data = pd.concat([survey_data, facet_df], axis=1)
-        
-        # Reorganize: each dimension followed by its facets
-        data_reorganize_list = {}
-        for d in codebook_all.Dimension.unique():
-            dimension_series = survey_data[d]
-            facet_items = codebook_120[codebook_120.Dimension == d]['Facet'].unique()
-            facet_df = survey_data[survey_data.columns.intersection(facet_items)]
-            data_reorganize_list[d] = pd.concat([dimension_series, facet_df], axis=1)
-        
-        survey_data_reorganize = pd.concat(data_reorganize_list, axis=1)
-        survey_data_personality_score = pd.DataFrame({'Personality Score': survey_data[survey_data.columns.intersection(codebook_120.Item.unique())].sum(axis=1)},
-                                                      index=survey_data.index)
+        return codebook_tables['NEO-IPIP 120']
     elif len(survey_data.columns) > 300:  # NEO IPIP 300
-        # Use codebook_300 for reverse coding
-        for i in codebook_300.Item.unique():
-            if codebook_300[codebook_300.Item == i]['Recode'].str.contains('Yes').all():
-                survey_data[i] = 6 - survey_data[i]
-        
-        # Calculate sums for dimensions
-        for d in codebook_all.Dimension.unique():
-            dimension_items = codebook_300[codebook_300.Dimension == d]['Item'].unique()
-            survey_data_slice = survey_data[survey_data.columns.intersection(dimension_items)]
-            if len(dimension_items) > 0:
-                dimension_df = pd.DataFrame({d: (survey_data_slice.sum(axis=1) / 
-                    len(codebook_300[codebook_300.Dimension == d]['Facet'].unique())).round(0)},
-                    index=survey_data_slice.index)
-                survey_data = pd.concat([survey_data, dimension_df], axis=1)
-            
-        # Sum facets
-        for f in codebook_300.Facet.unique():
-            facet_items = codebook_300[codebook_300.Facet == f]['Item'].unique()
-            survey_data_slice = survey_data[survey_data.columns.intersection(facet_items)]
-            facet_df = pd.DataFrame({f: survey_data_slice.sum(axis=1)}, index=survey_data.index)
-            survey_data = pd.concat([survey_data, facet_df], axis=1)
-
-        # Reorganize: each dimension followed by its facets
-        data_reorganize_list = {}
-        for d in codebook_all.Dimension.unique():
-            dimension_series = survey_data[d]
-            facet_items = codebook_300[codebook_300.Dimension == d]['Facet'].unique()
-            facet_df = survey_data[survey_data.columns.intersection(facet_items)]
-            data_reorganize_list[d] = pd.concat([dimension_series, facet_df], axis=1)
-        
-        survey_data_reorganize = pd.concat(data_reorganize_list, axis=1)
-        survey_data_personality_score = pd.DataFrame({'Personality Score': survey_data[survey_data.columns.intersection(codebook_300.Item.unique())].sum(axis=1)},
-                                                      index=survey_data.index)
-    
+        return codebook_tables['NEO-IPIP 300']
+    raise ValueError("Survey data does not match the NEO IPIP 120 or 300 format based on column count.")
+
+def recode_NEO_IPIP(parent_directory, survey_data, likert_responses=None):
+    """
+    Recodes the items in the NEO IPIP 120 and 300 surveys into facets and dimensions.
+
+    The items are scored from likert_responses (see get_numeric_responses) when given,
+    otherwise from the columns of survey_data.
+    """
+    codebook_tables = get_personality_codebook(parent_directory)
+    codebook_all = codebook_tables['IPIP-NEO-ItemKey']
+
+    # Select the codebook for the 120-item or 300-item survey
+    codebook_form = get_NEO_IPIP_form_codebook(codebook_tables, survey_data)
+
+    # Score all items, facets and dimensions with a few matrix products
+    scoring_key = compile_NEO_IPIP_key(codebook_form, survey_data.columns)
+    decode_blank_items(survey_data, scoring_key['items'])
+    item_data = survey_data[scoring_key['items']]
+    item_matrix = get_item_matrix(survey_data, scoring_key['items'], likert_responses)
+    recoded, facet_scores, dimension_scores, personality_score = score_NEO_IPIP(scoring_key, item_matrix)
+
+    # Write the reverse-coded items back, as later steps read them from survey_data
+    item_is_integer = np.array([pd.api.types.is_integer_dtype(t) for t in item_data.dtypes])
+    integer_items = {item: dtype for item, dtype in item_data.dtypes.items() if pd.api.types.is_integer_dtype(dtype)}
+    # Integer columns keep 0 for a missing answer
+    survey_data[scoring_key['items']] = pd.DataFrame(recoded, index=survey_data.index, columns=item_data.columns).fillna(
+        {item: 0 for item in integer_items}).astype(integer_items)
+
+    # Facet and total sums stay integer when all of their items are integer columns
+    facet_is_integer = ((~item_is_integer).astype(np.int64) @ scoring_key['item_facet']) == 0
+    if item_is_integer.all():
+        personality_score = personality_score.astype(np.int64)
+
+    # Reorganize: each dimension followed by its facets
+    data_reorganize_list = {}
+    for d in codebook_all.Dimension.unique():
+        n = scoring_key['dimensions'].index(d)
+        dimension_columns = {d: dimension_scores[:, n]}
+        for f in np.flatnonzero(scoring_key['facet_dimension'][:, n]):
+            if facet_is_integer[f]:
+                dimension_columns[scoring_key['facets'][f]] = facet_scores[:, f].astype(np.int64)
+            else:
+                dimension_columns[scoring_key['facets'][f]] = facet_scores[:, f]
+        data_reorganize_list[d] = pd.DataFrame(dimension_columns, index=survey_data.index)
+
+    survey_data_reorganize = pd.concat(data_reorganize_list, axis=1)
+    survey_data_personality_score = pd.DataFrame({'Personality Score': personality_score}, index=survey_data.index)
+
     return survey_data_reorganize, survey_data_personality_score, codebook_all
@@ -0,0 +1,296 @@
+import re
+import html
+import time
+import zlib
+
+# Version of the native drawing; increase it when the drawing changes, so cached reports are rendered again
+NATIVE_RENDERER_VERSION = 2
+# Figure pixels per PDF point, as in the PDF files Kaleido writes
+PIXELS_PER_POINT = 4 / 3
+# Line height of multi-line text, in font sizes (Plotly's default)
+LINE_SPACING = 1.3
+# Widths of the characters 32-126 in the standard Helvetica and Helvetica-Bold fonts, in
+# thousandths of the font size (Adobe font metrics); other characters use the width of 'n'
+HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+HELVETICA_BOLD_WIDTHS = [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+]
+# CSS colors used by the report layouts
+NAMED_COLORS = {
+    'lightskyblue': (135, 206, 250), 'darkorange': (255, 140, 0), 'indianred': (205, 92, 92),
+    'lightseagreen': (32, 178, 170), 'mediumpurple': (147, 112, 219), 'steelblue': (70, 130, 180),
+    'white': (255, 255, 255), 'black': (0, 0, 0),
+}
+# Defaults of the 'plotly' template, for figures without a template
+DEFAULT_FONT_COLOR = '#2a3f5f'
+DEFAULT_BAR_LINE = {'color': 'rgb(229,236,246)', 'width': 0.5}
+
+def get_rgb(color):
+    """
+    Returns a CSS color ('SteelBlue', '#2a3f5f' or 'rgb(229,236,246)') as red, green and blue
+    fractions.
+    """
+    color = color.strip().lower()
+    if color in NAMED_COLORS:
+        rgb = NAMED_COLORS[color]
+    elif re.fullmatch(r'#[0-9a-f]{6}', color):
+        rgb = tuple(int(color[n:n + 2], 16) for n in (1, 3, 5))
+    elif re.fullmatch(r'#[0-9a-f]{3}', color):
+        rgb = tuple(17 * int(c, 16) for c in color[1:])
+    elif re.fullmatch(r'rgba?\(.*\)', color):
+        rgb = tuple(float(c) for c in color[color.index('(') + 1:-1].split(',')[:3])
+    else:
+        raise ValueError(f"Unsupported color: {color}")
+    return tuple(c / 255 for c in rgb)
+
+def get_text_width(text, size, bold=False):
+    """
+    Returns the width of a text in the Helvetica font, in pixels.
+    """
+    widths = HELVETICA_BOLD_WIDTHS if bold else HELVETICA_WIDTHS
+    default = widths[ord('n') - 32]
+    return size * sum(widths[ord(c) - 32] if 32 <= ord(c) <= 126 else default for c in text) / 1000
+
+def parse_figure_text(text):
+    """
+    Splits a Plotly text with '<br>', '<b>' and '<sub>' tags into lines of (text, bold, sub)
+    segments. Other tags are dropped.
+    """
+    lines = []
+    for line in re.split(r'<br\s*/?>', str(text), flags=re.IGNORECASE):
+        segments, bold, sub = [], 0, 0
+        for part in re.split(r'(<[^>]*>)', line):
+            tag = part.lower().replace(' ', '')
+            if tag in ('<b>', '</b>'):
+                bold += 1 if tag == '<b>' else -1
+            elif tag in ('<sub>', '</sub>'):
+                sub += 1 if tag == '<sub>' else -1
+            elif part and not part.startswith('<'):
+                segments.append((html.unescape(part), bold > 0, sub > 0))
+        lines.append(segments)
+    return lines
+
+def get_segment_size(size, sub):
+    return size * 0.7 if sub else size
+
+def get_line_width(segments, size):
+    return sum(get_text_width(text, get_segment_size(size, sub), bold) for text, bold, sub in segments)
+
+def encode_pdf_text(text):
+    """
+    Returns a text as a PDF string in the WinAnsi encoding of the standard fonts.
+
+    Raises:
+        UnicodeEncodeError: For characters the standard fonts do not have (e.g. Polish,
+            Czech or Cyrillic letters outside Windows-1252), rather than drawing them as '?'.
+    """
+    encoded = text.encode('cp1252')
+    return b'(' + encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+def draw_text_line(content, segments, x, baseline, size, rgb):
+    """
+    Adds a line of text segments, starting at x, to the page content. Subscript segments are
+    drawn at 70% size and 0.3 of their size lower, as Plotly does.
+    """
+    for text, bold, sub in segments:
+        segment_size = get_segment_size(size, sub)
+        y = baseline + 0.3 * segment_size if sub else baseline
+        content.append(b'BT %.3f %.3f %.3f rg /%s %.2f Tf 1 0 0 -1 %.2f %.2f Tm %s Tj ET' % (
+            *rgb, b'F2' if bold else b'F1', segment_size, x, y, encode_pdf_text(text)))
+        x += get_text_width(text, segment_size, bold)
+
+def get_anchor(anchor, position, low, middle, high):
+    """
+    Resolves Plotly's 'auto' anchor of a paper position: the low side in the first third,
+    the high side in the last third, the middle otherwise.
+    """
+    if anchor not in (None, 'auto'):
+        return anchor
+    return low if position <= 1 / 3 else high if position >= 2 / 3 else middle
+
+def get_layout_axes(layout, traces):
+    """
+    Returns, per y axis of the traces, its categories and pixel domain fraction, and per x
+    axis its value range, with matched x axes sharing the range of their group.
+    """
+    y_axes, x_groups = {}, {}
+    for trace in traces:
+        y_name = 'yaxis' + trace.get('yaxis', 'y')[1:]
+        x_name = 'xaxis' + trace.get('xaxis', 'x')[1:]
+        categories = y_axes.setdefault(y_name, {'categories': [], 'domain': layout.get(y_name, {}).get('domain', [0, 1])})['categories']
+        categories.extend(c for c in trace['y'] if c not in categories)
+        matches = layout.get(x_name, {}).get('matches')
+        group = 'xaxis' + matches[1:] if matches else x_name
+        values = [v for v in trace['x'] if v is not None and v == v]
+        x_groups.setdefault(group, []).extend(values)
+    x_ranges = {}
+    for trace in traces:
+        x_name = 'xaxis' + trace.get('xaxis', 'x')[1:]
+        matches = layout.get(x_name, {}).get('matches')
+        group = 'xaxis' + matches[1:] if matches else x_name
+        x_range = layout.get(x_name, {}).get('range') or layout.get(group, {}).get('range')
+        if not x_range:
+            # Bars start at 0; the longest one fills 95% of the plot width
+            largest = max([0] + x_groups[group])
+            x_range = [0, largest / 0.95 if largest > 0 else 1]
+        x_ranges[x_name] = x_range
+    return y_axes, x_ranges
+
+def write_native_report(figure_spec, output_path):
+    """
+    Writes a report figure (horizontal bar charts with category axes, a title and text
+    annotations, as in the personality and cognitive reports) straight to a vector PDF, without
+    Plotly or a browser.
+
+    The drawing follows Plotly's layout rules for these figures (automatic left margin,
+    subplot domains, bar gap, outside bar text, title and annotation positions), with the
+    standard Helvetica fonts in place of Open Sans, so reports look like the Kaleido ones.
+    Text with characters outside Windows-1252, which the standard fonts do not have, raises
+    a UnicodeEncodeError before the file is written (write_report renders such reports with
+    Kaleido instead).
+
+    Args:
+        figure_spec (dict): Figure as returned by Figure.to_dict() or fill_personality_report.
+        output_path (str): Path of the PDF file.
+
+    Returns:
+        seconds (float): Time spent writing the report.
+    """
+    start = time.perf_counter()
+    traces, layout = figure_spec['data'], figure_spec['layout']
+    template = layout.get('template', {})
+    width, height = layout.get('width', 700), layout.get('height', 500)
+    font_size = layout.get('font', {}).get('size', 12)
+    font_rgb = get_rgb(layout.get('font', {}).get('color')
+                       or template.get('layout', {}).get('font', {}).get('color', DEFAULT_FONT_COLOR))
+    bar_line = dict(DEFAULT_BAR_LINE, **template.get('data', {}).get('bar', [{}])[0].get('marker', {}).get('line', {}))
+    bar_gap = layout.get('bargap', 0.2)
+    margin = dict({'l': 80, 'r': 80, 't': 100, 'b': 80}, **layout.get('margin', {}))
+
+    y_axes, x_ranges = get_layout_axes(layout, traces)
+    tick_labels = {name: [parse_figure_text(c)[0] for c in axis['categories']] for name, axis in y_axes.items()}
+    # The left margin grows to fit the widest tick label
+    label_width = max([get_line_width(label, font_size) for labels in tick_labels.values() for label in labels] or [0])
+    plot_left = max(margin['l'], label_width + 3)
+    plot_right, plot_top, plot_bottom = width - margin['r'], margin['t'], height - margin['b']
+    plot_width, plot_height = plot_right - plot_left, plot_bottom - plot_top
+
+    # Page coordinates in figure pixels, from the top left corner
+    content = [b'%.5f 0 0 %.5f 0 %.3f cm' % (1 / PIXELS_PER_POINT, -1 / PIXELS_PER_POINT, height / PIXELS_PER_POINT),
+               b'1 1 1 rg 0 0 %d %d re f' % (width, height)]
+    opacity_states = {}
+    for trace in traces:
+        y_name = 'yaxis' + trace.get('yaxis', 'y')[1:]
+        x_name = 'xaxis' + trace.get('xaxis', 'x')[1:]
+        axis = y_axes[y_name]
+        axis_top = plot_top + (1 - axis['domain'][1]) * plot_height
+        band = (axis['domain'][1] - axis['domain'][0]) * plot_height / len(axis['categories'])
+        x_min, x_max = x_ranges[x_name]
+        marker = trace.get('marker', {})
+        colors, opacities = marker.get('color', '#636efa'), marker.get('opacity', 1)
+        texts = trace.get('text')
+        text_size = trace.get('textfont', {}).get('size', font_size)
+
+        def get_x(value):
+            return plot_left + min(max((value - x_min) / (x_max - x_min), 0), 1) * plot_width
+
+        for n, (value, category) in enumerate(zip(trace['x'], trace['y'])):
+            if value is None or value != value:
+                continue
+            # Categories run from the top down (reversed axis)
+            band_top = axis_top + axis['categories'].index(category) * band
+            color = colors[n] if isinstance(colors, (list, tuple)) else colors
+            opacity = opacities[n] if isinstance(opacities, (list, tuple)) else opacities
+            state = opacity_states.setdefault(round(opacity, 3), b'G%d' % (len(opacity_states) + 1))
+            bar_start, bar_end = get_x(0), get_x(value)
+            content.append(b'/%s gs %.3f %.3f %.3f rg %.3f %.3f %.3f RG %.2f w %.2f %.2f %.2f %.2f re B' % (
+                state, *get_rgb(color), *get_rgb(bar_line['color']), bar_line['width'],
+                bar_start, band_top + band * bar_gap / 2, bar_end - bar_start, band * (1 - bar_gap)))
+            if texts is not None and trace.get('textposition') == 'outside':
+                text = texts[n] if isinstance(texts, (list, tuple)) else texts
+                content.append(b'/G0 gs')
+                draw_text_line(content, parse_figure_text(text)[0], bar_end + 3, band_top + band / 2 + text_size / 3,
+                               text_size, font_rgb)
+
+    # Tick labels, right-aligned against the plot area
+    content.append(b'/G0 gs')
+    for name, axis in y_axes.items():
+        axis_top = plot_top + (1 - axis['domain'][1]) * plot_height
+        band = (axis['domain'][1] - axis['domain'][0]) * plot_height / len(axis['categories'])
+        for n, label in enumerate(tick_labels[name]):
+            draw_text_line(content, label, plot_left - 1 - get_line_width(label, font_size),
+                           axis_top + (n + 0.5) * band + 0.35 * font_size, font_size, font_rgb)
+
+    title = layout.get('title', {})
+    if title.get('text'):
+        title_size = title.get('font', {}).get('size', font_size * 1.25)
+        lines = parse_figure_text(title['text'])
+        title_y = title.get('y', 'auto')
+        if title_y == 'auto':
+            top = margin['t'] / 2 - len(lines) * LINE_SPACING * title_size / 2
+        else:
+            top = (1 - title_y) * height
+        for n, segments in enumerate(lines):
+            draw_text_line(content, segments, title.get('x', 0.05) * width,
+                           top + 0.7 * title_size + n * LINE_SPACING * title_size, title_size, font_rgb)
+
+    # Annotations are placed in paper coordinates, as in the report layouts
+    for annotation in layout.get('annotations', []):
+        size = annotation.get('font', {}).get('size', font_size)
+        lines = parse_figure_text(annotation.get('text', ''))
+        line_widths = [get_line_width(segments, size) for segments in lines]
+        box_width, box_height = max(line_widths) + 4, len(lines) * LINE_SPACING * size + 2
+        x, y = annotation.get('x', 0.5), annotation.get('y', 0.5)
+        x_px = plot_left + x * plot_width
+        y_px = plot_top + (1 - y) * plot_height
+        if annotation.get('showarrow', True):
+            # The text box is centered on the arrow tail, the arrow ending at the point
+            box_left = x_px + annotation.get('ax', -10) - box_width / 2
+            box_top = y_px + annotation.get('ay', -30) - box_height / 2
+        else:
+            x_anchor = get_anchor(annotation.get('xanchor'), x, 'left', 'center', 'right')
+            y_anchor = get_anchor(annotation.get('yanchor'), y, 'bottom', 'middle', 'top')
+            box_left = x_px - {'left': 0, 'center': 0.5, 'right': 1}[x_anchor] * box_width
+            box_top = y_px - {'top': 0, 'middle': 0.5, 'bottom': 1}[y_anchor] * box_height
+        align = annotation.get('align', 'center')
+        for n, (segments, line_width) in enumerate(zip(lines, line_widths)):
+            line_left = (box_left + 2 if align == 'left' else box_left + box_width - 2 - line_width if align == 'right'
+                         else box_left + (box_width - line_width) / 2)
+            draw_text_line(content, segments, line_left, box_top + 1 + size + n * LINE_SPACING * size, size, font_rgb)
+
+    stream = zlib.compress(b'\n'.join(content))
+    states = b' '.join(b'/%s << /Type /ExtGState /ca %.3f /CA %.3f >>' % (name, opacity, opacity)
+                       for opacity, name in [(1, b'G0')] + [(o, n) for o, n in opacity_states.items()])
+    fonts = b' '.join(b'/%s << /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>' % (name, font)
+                      for name, font in ((b'F1', b'Helvetica'), (b'F2', b'Helvetica-Bold')))
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] /Contents 4 0 R '
+        b'/Resources << /Font << %s >> /ExtGState << %s >> >> >>' % (width / PIXELS_PER_POINT, height / PIXELS_PER_POINT, fonts, states),
+        b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(stream), stream),
+    ]
+    pdf = [b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n']
+    offsets, position = [], len(pdf[0])
+    for n, body in enumerate(objects, 1):
+        offsets.append(position)
+        pdf.append(b'%d 0 obj\n%s\nendobj\n' % (n, body))
+        position += len(pdf[-1])
+    pdf.append(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+               + b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+               + b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, position))
+    with open(output_path, 'wb') as f:
+        f.write(b''.join(pdf))
+    return time.perf_counter() - start
@@ -1,62 +1,105 @@
 import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import numpy as np
 
-def personality_report_generation(test_taker_df, name, item_number):
+from Functions.Reshape_data import reshape_scores_long, iter_test_taker_data
+
+# Dimensions with associated colors and subplot row numbers
+DIMENSIONS_INFO = [
+    ('Openness', 'LightSkyBlue', 1),
+    ('Conscientiousness', 'DarkOrange', 2),
+    ('Extroversion', 'IndianRed', 3),
+    ('Agreeableness', 'lightseagreen', 4),
+    ('Neuroticism', 'MediumPurple', 5)
+]
+# Version of the report layout; increase it when the layout changes, so cached reports are rendered again
+REPORT_TEMPLATE_VERSION = 2
+# Header fields shown in the report
+HEADER_FIELDS = ['Email address', 'Completion Time', 'Response Time', 'Personality Score',
+                 'Social Desirability Score', 'Response Variance']
+# Response quality fields shown next to the header, with their labels
+QUALITY_LABELS = [('Longest String', 'LONGEST STRING'), ('Even-Odd Consistency', 'EVEN-ODD CONSISTENCY'),
+                  ('Mahalanobis Distance', 'MAHALANOBIS DISTANCE'), ('Seconds per Item', 'SECONDS PER ITEM')]
+
+def get_quality_text(header):
     """
-    Generates a Plotly-based personality report for the given test taker.
-    
+    Returns the text of the response quality block of the report header.
+
     Args:
-        test_taker_df (DataFrame): DataFrame containing personality scores.
-        name (str): Full name of the test taker.
-        item_number (int): Number of personality items (120 or 300).
-        
-    Returns:
-        fig (Plotly Figure): Generated report figure.
+        header (dict): Header values by field; fields that are missing or NaN (e.g. the
+            Mahalanobis distance of a small cohort, or data scored before these fields
+            existed) are shown as 'n/a'.
+    """
+    values = [header.get(field) for field, _ in QUALITY_LABELS]
+    return "<br><br>".join(f"{label}<br><b>{'n/a' if pd.isna(value) else value}</b>"
+                           for (_, label), value in zip(QUALITY_LABELS, values))
+
+def get_dimension_data(test_taker_df):
+    """
+    Returns the rows of each dimension: the dimension score followed by its facet scores.
     """
-    personality_score_total = 5 * item_number
     dimension_data_list = {}
     for dimension in test_taker_df['Dimension'].dropna().unique():
         dimension_data_dimension = test_taker_df[test_taker_df['Facet'].str.contains(dimension, na=False)]
         dimension_data_facet = test_taker_df[test_taker_df['Dimension'].str.contains(dimension, na=False)]
         dimension_data_list[dimension] = pd.concat([dimension_data_dimension, dimension_data_facet])
-    
-    fig = make_subplots(rows=5, cols=1, shared_xaxes=True, vertical_spacing=0.02)
-    
+    return dimension_data_list
+
+def get_personality_report_spec(test_taker_df, name, item_number):
+    """
+    Returns the figure spec of a personality report for the given test taker as plain dicts:
+    the figure of personality_report_generation without Plotly's default template, which the
+    native PDF writer draws without importing Plotly.
+
+    Args:
+        test_taker_df (DataFrame): DataFrame containing personality scores.
+        name (str): Full name of the test taker.
+        item_number (int): Number of personality items (120 or 300).
+
+    Returns:
+        figure_spec (dict): 'data' and 'layout' of the figure.
+    """
+    personality_score_total = 5 * item_number
+    dimension_data_list = get_dimension_data(test_taker_df)
+
+    # Five rows of subplots sharing the x axis of the bottom row, laid out as make_subplots does
+    rows, vertical_spacing = 5, 0.02
+    row_height = (1.0 - vertical_spacing * (rows - 1)) / rows
+    layout = {}
+    for row in range(1, rows + 1):
+        suffix = '' if row == 1 else str(row)
+        # Summed as make_subplots does, so the domains are the same floats
+        bottom = sum([row_height] * (rows - row)) + (rows - row) * vertical_spacing
+        layout[f"xaxis{suffix}"] = {'anchor': f"y{suffix}", 'domain': [0.0, 1.0]}
+        if row < rows:
+            layout[f"xaxis{suffix}"].update(matches=f"x{rows}", showticklabels=False)
+        layout[f"yaxis{suffix}"] = {'anchor': f"x{suffix}", 'domain': [bottom, min(bottom + row_height, 1.0)],
+                                    'autorange': 'reversed', 'showgrid': False, 'type': 'category'}
+    layout[f"xaxis{rows}"].update(showgrid=False, visible=False)
+
     # Helper function to compute opacities safely
     def compute_opacities(values):
         max_val = max(values) if max(values) != 0 else 1  # Avoid division by zero
         return [value / max_val for value in values]
-    
-    # Define dimensions with associated colors and subplot row numbers
-    dimensions_info = [
-        ('Openness', 'LightSkyBlue', 1),
-        ('Conscientiousness', 'DarkOrange', 2),
-        ('Extroversion', 'IndianRed', 3),
-        ('Agreeableness', 'lightseagreen', 4),
-        ('Neuroticism', 'MediumPurple', 5)
-    ]
-    
-    for dim, color, row in dimensions_info:
+
+    data = []
+    for dim, color, row in DIMENSIONS_INFO:
         if dim not in dimension_data_list:
             continue
-        data = dimension_data_list[dim]
-        if name not in data.columns:
+        dimension_data = dimension_data_list[dim]
+        if name not in dimension_data.columns:
             continue
-        values = data.loc[:, name].tolist()
-        opacities = compute_opacities(values)
+        values = dimension_data.loc[:, name].tolist()
         # Use the first value for the overall dimension, the rest for facets
-        y_labels = [f"<b>{dim}</b>"] + data.reset_index().iloc[1:]['Facet'].tolist()
-        fig.add_trace(go.Bar(
-            x=values,
-            y=y_labels,
-            orientation='h',
-            text=values,
-            textposition='outside',
-            textfont_size=9,
-            marker=dict(color=color, opacity=opacities)
-        ), row, 1)
-    
+        y_labels = [f"<b>{dim}</b>"] + dimension_data.reset_index().iloc[1:]['Facet'].tolist()
+        suffix = '' if row == 1 else str(row)
+        # Bar texts as strings, as Plotly validates them and fill_personality_report fills them in
+        data.append({
+            'type': 'bar', 'x': values, 'y': y_labels, 'orientation': 'h', 'text': [str(value) for value in values],
+            'textposition': 'outside', 'textfont': {'size': 9},
+            'marker': {'color': color, 'opacity': compute_opacities(values)},
+            'xaxis': f"x{suffix}", 'yaxis': f"y{suffix}",
+        })
+
     individual_data = test_taker_df.set_index('Facet')
     title_text = (
         f"Personality Report <br><sub><b>{name}</b></sub> "
@@ -69,26 +112,118 @@ def personality_report_generation(test_taker_df, name, item_number):
         f"<br><br>SOCIAL DESIRABILITY SCORE<br><b>{individual_data.loc['Social Desirability Score'].iloc[0]}</b>"
         f"<br><br>VARIATION SCORE<br><b>{individual_data.loc['Response Variance'].iloc[0]}</b>"
     )
-    
-    fig.update_layout(
+    quality_text = get_quality_text({field: individual_data.loc[field].iloc[0] for field, _ in QUALITY_LABELS
+                                     if field in individual_data.index})
+
+    layout.update(
         autosize=True,
         height=1200,
         title=dict(text=title_text, y=0.95, yanchor='top', font=dict(size=15)),
         font=dict(size=9),
-        yaxis=dict(autorange="reversed", showgrid=False, type='category'),
-        yaxis2=dict(autorange="reversed", showgrid=False, type='category'),
-        yaxis3=dict(autorange="reversed", showgrid=False, type='category'),
-        yaxis4=dict(autorange="reversed", showgrid=False, type='category'),
-        yaxis5=dict(autorange="reversed", showgrid=False, type='category'),
-        xaxis5=dict(showgrid=False, visible=False),
         margin=dict(t=200, l=10, r=20, b=30),
         plot_bgcolor='rgba(0, 0, 0, 0)',
-        showlegend=False
+        showlegend=False,
+        annotations=[
+            dict(text=annotation_text, x=0.8, y=1.08, xref='paper', yref='paper', font=dict(size=9), align='right'),
+            dict(text=quality_text, x=0.5, y=1.08, xref='paper', yref='paper', font=dict(size=9), align='right'),
+        ]
     )
-    fig.add_annotation(
-        text=annotation_text,
-        x=0.8, y=1.08, xref='paper', yref='paper',
-        font=dict(size=9),
-        align='right'
+    return {'data': data, 'layout': layout}
+
+def personality_report_generation(test_taker_df, name, item_number):
+    """
+    Generates a Plotly-based personality report for the given test taker.
+    
+    Args:
+        test_taker_df (DataFrame): DataFrame containing personality scores.
+        name (str): Full name of the test taker.
+        item_number (int): Number of personality items (120 or 300).
+        
+    Returns:
+        fig (Plotly Figure): Generated report figure (see get_personality_report_spec).
+    """
+    # Plotly is imported when the first report is built, so runs that do not render start faster
+    import plotly.graph_objects as go
+    return go.Figure(get_personality_report_spec(test_taker_df, name, item_number))
+
+def build_personality_report_template(fields, codebook_all, item_number, backend='kaleido'):
+    """
+    Builds the figure of a personality report once per form, to be filled in per test taker
+    with fill_personality_report.
+
+    The figure is laid out by personality_report_generation for a placeholder test taker,
+    so filled-in reports are identical to the ones it generates.
+
+    Args:
+        fields (Index): Columns of the scored data, starting with 'Full Name' (see score_survey_data).
+        codebook_all (DataFrame): Codebook with 'Dimension' and 'Facet' columns.
+        item_number (int): Number of personality items (120 or 300).
+        backend (str): Render backend of the reports (see write_report); the native one
+            draws the plain figure spec, so Plotly is not imported.
+
+    Returns:
+        template (dict): The placeholder figure spec, the value fields (fields without
+            'Full Name'), the positions in the value fields of the bars of each trace and of
+            the header fields, and the personality score total.
+    """
+    placeholder = pd.DataFrame([[''] + [1] * (len(fields) - 1)], columns=fields)
+    _, name, _, test_taker_df = next(iter_test_taker_data(reshape_scores_long(placeholder, codebook_all)))
+    if backend == 'native':
+        figure = get_personality_report_spec(test_taker_df=test_taker_df, name=name, item_number=item_number)
+    else:
+        figure = personality_report_generation(test_taker_df=test_taker_df, name=name, item_number=item_number).to_dict()
+
+    # Same traces as personality_report_generation; test_taker_df rows are the value fields
+    dimension_data_list = get_dimension_data(test_taker_df)
+    trace_fields = [dimension_data_list[dim].index.to_numpy() for dim, _, _ in DIMENSIONS_INFO
+                    if dim in dimension_data_list]
+    facets = test_taker_df['Facet']
+    return {
+        'figure': figure,
+        'value_fields': fields.drop('Full Name'),
+        'trace_fields': trace_fields,
+        'header_fields': {field: int(np.flatnonzero(facets == field)[0])
+                          for field in HEADER_FIELDS + [field for field, _ in QUALITY_LABELS] if (facets == field).any()},
+        'personality_score_total': 5 * item_number,
+    }
+
+def fill_personality_report(template, values, name):
+    """
+    Returns the figure spec of one test taker's personality report, without building and
+    validating Plotly objects.
+
+    Args:
+        template (dict): Output of build_personality_report_template.
+        values (ndarray): The test taker's row of the scored data as objects, in the order of
+            template['value_fields'].
+        name (str): Full name of the test taker.
+
+    Returns:
+        figure_spec (dict): Figure as returned by Figure.to_dict(). Parts that do not change
+            between test takers are shared with the template and must not be modified.
+    """
+    figure = template['figure']
+    data = []
+    for trace, positions in zip(figure['data'], template['trace_fields']):
+        values_trace = values[positions].tolist()
+        max_val = max(values_trace) if max(values_trace) != 0 else 1  # Avoid division by zero
+        data.append(dict(trace, x=values_trace, text=[str(value) for value in values_trace],
+                         marker=dict(trace['marker'], opacity=[value / max_val for value in values_trace])))
+
+    header = {field: values[position] for field, position in template['header_fields'].items()}
+    title_text = (
+        f"Personality Report <br><sub><b>{name}</b></sub> "
+        f"<br><sub>{header['Email address']}</sub>"
+    )
+    annotation_text = (
+        f"DATE/TIME OF COMPLETION<br><b>{header['Completion Time']}</b>"
+        f"<br><br>TIME TO COMPLETION <br><b>{header['Response Time']}</b>"
+        f"<br><br>PERSONALITY SCORE<br><b>{header['Personality Score']} (Out of {template['personality_score_total']} Total)</b>"
+        f"<br><br>SOCIAL DESIRABILITY SCORE<br><b>{header['Social Desirability Score']}</b>"
+        f"<br><br>VARIATION SCORE<br><b>{header['Response Variance']}</b>"
     )
-    return fig
+    layout = dict(figure['layout'],
+                  title=dict(figure['layout']['title'], text=title_text),
+                  annotations=[dict(figure['layout']['annotations'][0], text=annotation_text),
+                               dict(figure['layout']['annotations'][1], text=get_quality_text(header))])
+    return {'data': data, 'layout': layout}
@@ -0,0 +1,314 @@
+import os
+import time
+import sqlite3
+import pandas as pd
+import numpy as np
+from pathlib import Path
+
+from Functions.Results_store import write_table, read_table, list_tables
+
+# Score values are counted in the histograms at this many decimals; facet, dimension and
+# total scores are whole numbers, so their percentiles are exact
+HISTOGRAM_DECIMALS = 2
+# Cohort of a respondent: the month the survey was completed
+COHORT_FORMAT = '%Y-%m'
+
+def get_cohorts(end_dates):
+    """
+    Returns the cohort of each respondent ('2024-01', ...) from the end dates of the survey,
+    or 'Unknown' where the end date is missing.
+    """
+    cohorts = pd.to_datetime(pd.Series(end_dates), errors='coerce').dt.strftime(COHORT_FORMAT)
+    return cohorts.fillna('Unknown').to_numpy(dtype=object)
+
+def open_population_store(parent_directory):
+    """
+    Opens (and creates if needed) the population store in the 'Population' folder.
+
+    The store keeps the scores of every respondent ever scored, once per survey type and
+    respondent, in columnar files partitioned by survey type and cohort
+    ('Population/<survey type>/<cohort>/part_<time>_<process>'), and a summary of each score
+    per survey type and cohort in 'population.sqlite': count, mean, sum of squared deviations,
+    minimum, maximum and a histogram of the values. Summaries of different cohorts merge
+    exactly, so population percentiles are looked up without reading the stored scores.
+
+    Args:
+        parent_directory (str or Path): Parent folder for the repository.
+
+    Returns:
+        store (dict): The store folder and a connection to its database.
+    """
+    directory = Path(parent_directory) / 'Population'
+    directory.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(directory / 'population.sqlite')
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS population_respondents (
+            survey_type TEXT NOT NULL,
+            respondent_key TEXT NOT NULL,
+            cohort TEXT NOT NULL,
+            added_at REAL NOT NULL,
+            PRIMARY KEY (survey_type, respondent_key)
+        );
+        CREATE TABLE IF NOT EXISTS score_moments (
+            survey_type TEXT NOT NULL,
+            cohort TEXT NOT NULL,
+            field TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            mean REAL NOT NULL,
+            m2 REAL NOT NULL,
+            minimum REAL NOT NULL,
+            maximum REAL NOT NULL,
+            PRIMARY KEY (survey_type, cohort, field)
+        );
+        CREATE TABLE IF NOT EXISTS score_histograms (
+            survey_type TEXT NOT NULL,
+            cohort TEXT NOT NULL,
+            field TEXT NOT NULL,
+            value REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (survey_type, cohort, field, value)
+        );
+        CREATE TEMP TABLE IF NOT EXISTS candidate_keys (respondent_key TEXT PRIMARY KEY);
+    """)
+    connection.commit()
+    return {'directory': directory, 'connection': connection}
+
+def close_population_store(store):
+    """
+    Closes the database connection of a population store.
+    """
+    store['connection'].close()
+
+def get_population_fields(scored_data):
+    """
+    Returns the score fields of scored data that are summarized in the population store: its
+    numeric columns, without norm percentiles, which depend on the norm group.
+    """
+    return [c for c in scored_data.columns
+            if pd.api.types.is_numeric_dtype(scored_data[c]) and not str(c).endswith(' Percentile')]
+
+def merge_score_moments(first, second):
+    """
+    Merges the moments (count, mean, m2, minimum, maximum) of two disjoint groups of values
+    into the moments of all of them.
+    """
+    if first['count'] == 0:
+        return dict(second)
+    if second['count'] == 0:
+        return dict(first)
+    count = first['count'] + second['count']
+    delta = second['mean'] - first['mean']
+    return {
+        'count': count,
+        'mean': first['mean'] + delta * second['count'] / count,
+        'm2': first['m2'] + second['m2'] + delta ** 2 * first['count'] * second['count'] / count,
+        'minimum': min(first['minimum'], second['minimum']),
+        'maximum': max(first['maximum'], second['maximum']),
+    }
+
+def get_part_path(store, survey_type, cohort):
+    """
+    Returns a new path (without suffix, see write_table) for a file of scores of a cohort.
+    """
+    return (store['directory'] / survey_type / cohort /
+            f"part_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{time.perf_counter_ns()}")
+
+def append_to_population(store, survey_type, scored_data, respondent_keys, cohorts):
+    """
+    Adds scored respondents to the population store and updates the summaries of their cohorts.
+
+    A respondent is kept once per survey type, with their latest scores: a respondent already
+    in the store (e.g. scored again from a later export, after their answers were edited)
+    replaces their stored row, so that they are not counted twice and their old scores leave
+    the summaries. The summaries of the cohorts of new respondents are updated with their
+    scores only; those of the cohorts that replaced respondents come from are recomputed from
+    the stored scores of the cohort, which are rewritten without them.
+
+    Args:
+        store (dict): Output of open_population_store.
+        survey_type (str): Survey type, e.g. 'NEO-IPIP 120'.
+        scored_data (DataFrame): Scored data of the respondents (see score_survey_data).
+        respondent_keys (array-like): Respondent key of each row.
+        cohorts (array-like): Cohort of each row (see get_cohorts).
+
+    Returns:
+        added (int): Number of respondents added or replaced.
+    """
+    connection = store['connection']
+    new_data = scored_data[get_population_fields(scored_data)].assign(**{
+        'Respondent Key': np.asarray(respondent_keys, dtype=str), 'Cohort': np.asarray(cohorts, dtype=object)})
+    new_data = new_data.drop_duplicates(subset='Respondent Key', keep='last').reset_index(drop=True)
+    if new_data.empty:
+        return 0
+
+    connection.execute("DELETE FROM candidate_keys")
+    connection.executemany("INSERT INTO candidate_keys VALUES (?)", ((key,) for key in new_data['Respondent Key']))
+    stored_cohorts = dict(connection.execute(
+        "SELECT c.respondent_key, p.cohort FROM candidate_keys c JOIN population_respondents p "
+        "ON p.survey_type = ? AND p.respondent_key = c.respondent_key", (survey_type,)))
+
+    # Cohorts that replaced respondents leave are summarized again from the scores they keep
+    old_part_files, kept_data = [], []
+    for cohort in sorted(set(stored_cohorts.values())):
+        cohort_files = list_tables(store['directory'] / survey_type / cohort)
+        cohort_data = pd.concat([read_table(p) for p in cohort_files], ignore_index=True) if cohort_files else None
+        if cohort_data is not None:
+            kept_data.append(cohort_data[~cohort_data['Respondent Key'].isin(stored_cohorts)])
+        old_part_files += cohort_files
+        connection.execute("DELETE FROM score_moments WHERE survey_type = ? AND cohort = ?", (survey_type, cohort))
+        connection.execute("DELETE FROM score_histograms WHERE survey_type = ? AND cohort = ?", (survey_type, cohort))
+    summary_data = pd.concat(kept_data + [new_data], ignore_index=True)
+    fields = get_population_fields(summary_data)
+
+    added_at = time.time()
+    connection.executemany(
+        "INSERT OR REPLACE INTO population_respondents (survey_type, respondent_key, cohort, added_at) VALUES (?, ?, ?, ?)",
+        [(survey_type, key, cohort, added_at) for key, cohort in zip(new_data['Respondent Key'], new_data['Cohort'])])
+
+    # Moments of the new scores per cohort, merged into the stored ones (none for rewritten cohorts)
+    groups = summary_data.groupby('Cohort')[fields]
+    new_moments = {'count': groups.count(), 'mean': groups.mean(), 'm2': groups.var(ddof=0) * groups.count(),
+                   'minimum': groups.min(), 'maximum': groups.max()}
+    for cohort in new_moments['count'].index:
+        for field in fields:
+            moments = {name: new_moments[name].at[cohort, field] for name in new_moments}
+            if moments['count'] == 0:
+                continue
+            stored = connection.execute(
+                "SELECT count, mean, m2, minimum, maximum FROM score_moments WHERE survey_type = ? AND cohort = ? AND field = ?",
+                (survey_type, cohort, field)).fetchone()
+            if stored is not None:
+                moments = merge_score_moments(dict(zip(('count', 'mean', 'm2', 'minimum', 'maximum'), stored)), moments)
+            connection.execute(
+                "INSERT OR REPLACE INTO score_moments (survey_type, cohort, field, count, mean, m2, minimum, maximum) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (survey_type, cohort, field, int(moments['count']), float(moments['mean']), float(moments['m2']),
+                 float(moments['minimum']), float(moments['maximum'])))
+
+    values = summary_data.melt(id_vars='Cohort', value_vars=fields, var_name='Field', value_name='Value').dropna()
+    values['Value'] = values['Value'].astype(float).round(HISTOGRAM_DECIMALS)
+    histogram = values.groupby(['Cohort', 'Field', 'Value']).size()
+    connection.executemany(
+        "INSERT INTO score_histograms (survey_type, cohort, field, value, count) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (survey_type, cohort, field, value) DO UPDATE SET count = count + excluded.count",
+        [(survey_type, cohort, field, float(value), int(count)) for (cohort, field, value), count in histogram.items()])
+
+    # The scores are written before the summaries are committed, so both are kept or neither;
+    # the files of rewritten cohorts are removed once the summaries no longer count them
+    part_files = []
+    try:
+        for cohort, cohort_data in summary_data.groupby('Cohort'):
+            part_files.append(write_table(cohort_data.reset_index(drop=True), get_part_path(store, survey_type, cohort)))
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        for part_file in part_files:
+            part_file.unlink(missing_ok=True)
+        raise
+    for part_file in old_part_files:
+        part_file.unlink(missing_ok=True)
+    return len(new_data)
+
+def get_population_summaries(store, survey_type, cohorts=None, fields=None):
+    """
+    Returns the population summary of each score of a survey type, over all cohorts or some.
+
+    Args:
+        store (dict): Output of open_population_store.
+        survey_type (str): Survey type, e.g. 'NEO-IPIP 120'.
+        cohorts (list): Cohorts to include; all cohorts by default.
+        fields (list): Score fields to include; all fields by default.
+
+    Returns:
+        summaries (dict): Per field, the merged moments (see merge_score_moments) with the
+            standard deviation 'std', and the distinct 'values' in ascending order with the
+            'counts_below' (number of values strictly lower than each of them).
+    """
+    connection = store['connection']
+    conditions, parameters = "survey_type = ?", [survey_type]
+    if cohorts is not None:
+        conditions += f" AND cohort IN ({', '.join('?' * len(cohorts))})"
+        parameters += list(cohorts)
+    if fields is not None:
+        conditions += f" AND field IN ({', '.join('?' * len(fields))})"
+        parameters += list(fields)
+
+    summaries = {}
+    for field, count, mean, m2, minimum, maximum in connection.execute(
+            f"SELECT field, count, mean, m2, minimum, maximum FROM score_moments WHERE {conditions} ORDER BY cohort",
+            parameters):
+        moments = {'count': count, 'mean': mean, 'm2': m2, 'minimum': minimum, 'maximum': maximum}
+        summaries[field] = merge_score_moments(summaries[field], moments) if field in summaries else moments
+    histograms = pd.read_sql_query(
+        f"SELECT field, value, SUM(count) AS count FROM score_histograms WHERE {conditions} GROUP BY field, value "
+        "ORDER BY field, value", connection, params=parameters)
+    for field, histogram in histograms.groupby('field'):
+        counts = histogram['count'].to_numpy(dtype=np.int64)
+        summaries[field].update(values=histogram['value'].to_numpy(dtype=float),
+                                counts_below=np.concatenate([[0], np.cumsum(counts)[:-1]]))
+    for summary in summaries.values():
+        summary['std'] = np.sqrt(summary['m2'] / (summary['count'] - 1)) if summary['count'] > 1 else np.nan
+    return summaries
+
+def lookup_population_percentiles(summaries, score_matrix, fields):
+    """
+    Returns the percentiles and z-scores of many test takers against the population.
+
+    The percentile is the percentage of the population that scored strictly lower, as for
+    the ICAR norms (see lookup_icar_norms). Each lookup is a binary search in the histogram
+    of a score, so it takes the same time however many respondents are stored.
+
+    Args:
+        summaries (dict): Output of get_population_summaries.
+        score_matrix (ndarray): One row per test taker, one column per field.
+        fields (list): Score fields of the columns of score_matrix.
+
+    Returns:
+        percentiles (ndarray): Percentiles (0-100), shaped like score_matrix; NaN for a
+            missing score or a field without population data.
+        z_scores (ndarray): z-scores, shaped like score_matrix.
+    """
+    score_matrix = np.asarray(score_matrix, dtype=float).reshape(-1, len(fields))
+    percentiles = np.full(score_matrix.shape, np.nan)
+    z_scores = np.full(score_matrix.shape, np.nan)
+    for n, field in enumerate(fields):
+        summary = summaries.get(field)
+        if summary is None or 'values' not in summary:
+            continue
+        scores = np.round(score_matrix[:, n], HISTOGRAM_DECIMALS)
+        position = np.searchsorted(summary['values'], scores, side='left')
+        below = np.append(summary['counts_below'], summary['count'])[position]
+        percentiles[:, n] = np.where(np.isnan(scores), np.nan, below / summary['count'] * 100)
+        if summary['std'] > 0:
+            z_scores[:, n] = (score_matrix[:, n] - summary['mean']) / summary['std']
+    return percentiles, z_scores
+
+def get_population_quantiles(summary, quantiles):
+    """
+    Returns quantiles (between 0 and 1) of a score from its population summary (see
+    get_population_summaries): for each, the lowest value that at least that share of the
+    population scored at or below.
+    """
+    if 'values' not in summary:
+        return np.full(len(quantiles), np.nan)
+    counts_up_to = np.append(summary['counts_below'][1:], summary['count'])
+    positions = np.searchsorted(counts_up_to, np.asarray(quantiles, dtype=float) * summary['count'], side='left')
+    return summary['values'][np.minimum(positions, len(summary['values']) - 1)]
+
+def read_population(store, survey_type, cohorts=None, columns=None):
+    """
+    Reads the stored scores of a survey type, of all cohorts or some, into one DataFrame.
+
+    Args:
+        store (dict): Output of open_population_store.
+        survey_type (str): Survey type, e.g. 'NEO-IPIP 120'.
+        cohorts (list): Cohorts to read; all cohorts by default.
+        columns (list): Columns to read; all columns by default.
+    """
+    survey_directory = store['directory'] / survey_type
+    cohort_directories = sorted(d for d in survey_directory.iterdir() if d.is_dir()) if survey_directory.exists() else []
+    parts = [read_table(p, columns=columns) for d in cohort_directories
+             if cohorts is None or d.name in cohorts for p in list_tables(d)]
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True)
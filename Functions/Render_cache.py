@@ -0,0 +1,120 @@
+import os
+import shutil
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+
+# Rendered reports kept in the cache, in bytes; the least recently used are removed first
+REPORT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+def get_report_key(backend_version, *report_inputs):
+    """
+    Returns a hash of the inputs of a report (e.g. template version, name, item number and
+    the scored values it shows) that identifies the rendered report file.
+
+    The inputs are hashed through their repr, which is exact for numbers, strings and
+    timestamps.
+
+    Args:
+        backend_version (tuple): Version of the renderer, which changes the output too
+            (see get_backend_version in Report_Rendering.py).
+        report_inputs: Everything else the report depends on.
+    """
+    key_inputs = tuple(backend_version) + report_inputs
+    return hashlib.sha256(repr(key_inputs).encode('utf-8')).hexdigest()
+
+def open_report_cache(cache_directory, max_bytes=REPORT_CACHE_MAX_BYTES):
+    """
+    Opens a content-addressed cache of rendered reports, stored as '<key>.pdf' files.
+
+    The time a report was last stored or used is its file's modification time, so the
+    least-recently-used order carries over from one run to the next.
+
+    Args:
+        cache_directory (str or Path): Folder of the cache; created if needed.
+        max_bytes (int): Size bound of the cache.
+
+    Returns:
+        cache (dict): Cache state and hit/miss statistics.
+    """
+    cache_directory = Path(cache_directory)
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    entries = []
+    with os.scandir(cache_directory) as files:
+        for entry in files:
+            if entry.name.endswith('.pdf') and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, entry.name[:-len('.pdf')], stat.st_size))
+    # Least recently used first
+    files = OrderedDict((key, size) for _, key, size in sorted(entries))
+    return {'directory': cache_directory, 'max_bytes': max_bytes, 'files': files,
+            'bytes': sum(files.values()), 'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+
+def get_cached_report(cache, report_key, output_path):
+    """
+    Writes a copy of the cached report of a key to the output path. It is a copy rather than
+    a hard link, so that editing the report in the Report folder leaves the cached one intact.
+
+    Returns:
+        hit (bool): Whether the report was in the cache.
+    """
+    if report_key not in cache['files']:
+        cache['misses'] += 1
+        return False
+    cache_file = cache['directory'] / f"{report_key}.pdf"
+    output_path = Path(output_path)
+    temporary_file = output_path.with_name(f"{output_path.name}.{os.getpid()}.tmp")
+    try:
+        shutil.copyfile(cache_file, temporary_file)
+        os.replace(temporary_file, output_path)
+        os.utime(cache_file)
+    except FileNotFoundError:
+        # Removed by hand since the cache was opened
+        cache['bytes'] -= cache['files'].pop(report_key)
+        cache['misses'] += 1
+        return False
+    cache['files'].move_to_end(report_key)
+    cache['hits'] += 1
+    return True
+
+def release_report_file(output_path):
+    """
+    Removes a report file that is a hard link into the cache (as earlier versions took reports
+    from the cache), so that rendering a new report to its path does not overwrite the
+    cached one.
+    """
+    try:
+        if os.stat(output_path).st_nlink > 1:
+            os.unlink(output_path)
+    except FileNotFoundError:
+        pass
+
+def store_report(cache, report_key, report_file):
+    """
+    Copies a rendered report into the cache, then removes the least recently used reports
+    while the cache is larger than its bound.
+    """
+    cache_file = cache['directory'] / f"{report_key}.pdf"
+    temporary_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    shutil.copyfile(report_file, temporary_file)
+    os.replace(temporary_file, cache_file)
+    size = cache_file.stat().st_size
+    cache['bytes'] += size - cache['files'].pop(report_key, 0)
+    cache['files'][report_key] = size
+    cache['stored'] += 1
+
+    while cache['bytes'] > cache['max_bytes'] and len(cache['files']) > 1:
+        old_key, size = cache['files'].popitem(last=False)
+        (cache['directory'] / f"{old_key}.pdf").unlink(missing_ok=True)
+        cache['bytes'] -= size
+        cache['evicted'] += 1
+
+def summarize_report_cache(cache):
+    """
+    Prints the hit and miss counts of a run and the size of the cache.
+    """
+    lookups = cache['hits'] + cache['misses']
+    if lookups:
+        print(f"Report cache: {cache['hits']} hit(s), {cache['misses']} miss(es) "
+              f"({cache['hits'] / lookups:.0%} hit rate); {cache['evicted']} report(s) evicted; "
+              f"{cache['bytes'] / 1024 ** 2:.1f} of {cache['max_bytes'] / 1024 ** 2:.0f} MB used.")
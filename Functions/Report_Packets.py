@@ -0,0 +1,391 @@
+import re
+import time
+import zipfile
+from pathlib import Path
+
+# Objects of a PDF file: '<number> <generation> obj'
+PDF_OBJECT = re.compile(rb'(\d+)\s+(\d+)\s+obj\b')
+# Indirect references: '<number> <generation> R'
+PDF_REFERENCE = re.compile(rb'(\d+)\s+(\d+)\s+R\b')
+# A name, number or keyword value, and a dictionary key with the white space around it
+PDF_TOKEN = re.compile(rb'/?[^\s/<>\[\]()]*')
+PDF_KEY = re.compile(rb'\s*/([^\s/<>\[\]()]+)\s*')
+
+# Objects written when a PDF packet is closed
+PACKET_CATALOG, PACKET_PAGES, PACKET_OUTLINES = 1, 2, 3
+# Page attributes that a page inherits from its page tree nodes when it does not set them
+INHERITABLE_PAGE_ATTRIBUTES = (b'Resources', b'MediaBox', b'CropBox', b'Rotate')
+
+def read_pdf_objects(pdf_data):
+    """
+    Reads the objects of a PDF file with classic cross-reference tables, as written by Kaleido
+    and the native writer, including incremental updates (sections linked by /Prev).
+
+    Args:
+        pdf_data (bytes): Content of the PDF file.
+
+    Returns:
+        objects (dict): Object number -> (dictionary part, stream data or None). The dictionary
+            part is the text between 'obj' and 'stream'/'endobj'.
+        trailer (bytes): The trailer dictionary of the last update.
+
+    Raises:
+        ValueError: For cross-reference streams (PDF 1.5 and later object streams), which
+            would need their objects to be decompressed.
+    """
+    # The last 'startxref' is that of the last update
+    startxref = int(re.findall(rb'startxref\s+(\d+)', pdf_data[-1024:])[-1])
+    offsets, seen, trailer = {}, set(), None
+    while startxref is not None:
+        if not pdf_data.startswith(b'xref', startxref):
+            raise ValueError("Only PDF files with classic cross-reference tables can be added to a packet "
+                             "(this one has a cross-reference stream).")
+        trailer_start = pdf_data.index(b'trailer', startxref)
+        xref_lines = pdf_data[startxref + 4:trailer_start].split()
+        n = 0
+        while n < len(xref_lines):
+            first, count = int(xref_lines[n]), int(xref_lines[n + 1])
+            n += 2
+            for number in range(first, first + count):
+                # Later updates come first; their entries replace or free the earlier ones
+                if number not in seen and xref_lines[n + 2] == b'n':
+                    offsets[number] = int(xref_lines[n])
+                seen.add(number)
+                n += 3
+        section_trailer = pdf_data[trailer_start + len(b'trailer'):pdf_data.index(b'startxref', trailer_start)]
+        if b'/XRefStm' in section_trailer:
+            raise ValueError("Only PDF files with classic cross-reference tables can be added to a packet "
+                             "(this one also has a cross-reference stream).")
+        trailer = trailer if trailer is not None else section_trailer
+        previous = re.search(rb'/Prev\s+(\d+)', section_trailer)
+        startxref = int(previous.group(1)) if previous else None
+
+    objects = {}
+    for number, offset in offsets.items():
+        header = PDF_OBJECT.match(pdf_data, offset)
+        body_start = header.end()
+        body_end = pdf_data.index(b'endobj', body_start)
+        stream_start = pdf_data.find(b'stream', body_start, body_end)
+        if stream_start < 0:
+            objects[number] = (pdf_data[body_start:body_end].strip(), None)
+            continue
+        dictionary = pdf_data[body_start:stream_start].strip()
+        length = re.search(rb'/Length\s+(\d+)(\s+\d+\s+R)?', dictionary)
+        if length.group(2):
+            length_offset = offsets[int(length.group(1))]
+            length = int(pdf_data[PDF_OBJECT.match(pdf_data, length_offset).end():].split(None, 1)[0])
+        else:
+            length = int(length.group(1))
+        data_start = stream_start + len(b'stream')
+        data_start += 2 if pdf_data.startswith(b'\r\n', data_start) else 1
+        objects[number] = (dictionary, pdf_data[data_start:data_start + length])
+    return objects, trailer
+
+def get_pdf_value_end(dictionary, start):
+    """
+    Returns the end of the PDF value that starts at a position of a dictionary: a nested
+    dictionary or array, a string, an indirect reference or a single token.
+    """
+    if dictionary.startswith(b'<', start) and not dictionary.startswith(b'<<', start):
+        # Hexadecimal string
+        return dictionary.index(b'>', start) + 1
+    if dictionary.startswith((b'<<', b'[', b'('), start):
+        depth, n = 0, start
+        while n < len(dictionary):
+            if dictionary.startswith(b'(', n):
+                # Strings may hold unbalanced brackets; escaped and nested parentheses are skipped
+                nesting, n = 1, n + 1
+                while nesting and n < len(dictionary):
+                    if dictionary[n:n + 1] == b'\\':
+                        n += 1
+                    elif dictionary[n:n + 1] in b'()':
+                        nesting += 1 if dictionary[n:n + 1] == b'(' else -1
+                    n += 1
+                if depth == 0:
+                    return n
+                continue
+            if dictionary.startswith(b'<', n) and not dictionary.startswith(b'<<', n):
+                n = dictionary.index(b'>', n) + 1
+            elif dictionary.startswith(b'<<', n) or dictionary[n:n + 1] == b'[':
+                depth += 1
+                n += 2 if dictionary[n:n + 1] == b'<' else 1
+            elif dictionary.startswith(b'>>', n) or dictionary[n:n + 1] == b']':
+                depth -= 1
+                n += 2 if dictionary[n:n + 1] == b'>' else 1
+                if depth == 0:
+                    return n
+            else:
+                n += 1
+        raise ValueError("Unbalanced PDF dictionary.")
+    reference = PDF_REFERENCE.match(dictionary, start)
+    if reference:
+        return reference.end()
+    return PDF_TOKEN.match(dictionary, start).end()
+
+def get_pdf_dictionary_entries(dictionary):
+    """
+    Returns the entries of a PDF dictionary ('<<...>>') as (key, value start, value end),
+    without those of the dictionaries nested in it.
+    """
+    entries, n = [], dictionary.index(b'<<') + 2
+    while True:
+        key = PDF_KEY.match(dictionary, n)
+        if key is None:
+            return entries
+        value_end = get_pdf_value_end(dictionary, key.end())
+        entries.append((key.group(1), key.end(), value_end))
+        n = value_end
+
+def get_pdf_dictionary_value(dictionary, key):
+    """
+    Returns the value of a key of a PDF dictionary as bytes, or None when it is not set.
+    """
+    for entry_key, value_start, value_end in get_pdf_dictionary_entries(dictionary):
+        if entry_key == key:
+            return dictionary[value_start:value_end]
+    return None
+
+def get_pdf_reference(value):
+    """
+    Returns the object number of an indirect reference value, or None for a direct value.
+    """
+    reference = PDF_REFERENCE.fullmatch(value.strip()) if value is not None else None
+    return int(reference.group(1)) if reference else None
+
+def get_pdf_pages(objects, pages):
+    """
+    Returns the pages of a page tree in document order, with the page attributes each one
+    inherits from its page tree nodes (see INHERITABLE_PAGE_ATTRIBUTES).
+
+    Args:
+        objects (dict): Output of read_pdf_objects.
+        pages (int): Object number of the page tree root.
+
+    Returns:
+        page_list (list): (object number, {attribute: value}) of each page.
+        tree_nodes (set): Object numbers of the page tree nodes.
+    """
+    page_list, tree_nodes = [], set()
+
+    def visit(number, inherited):
+        dictionary = objects[number][0]
+        kids = get_pdf_dictionary_value(dictionary, b'Kids')
+        if not re.search(rb'/Type\s*/Pages\b', dictionary) or kids is None:
+            page_list.append((number, inherited))
+            return
+        tree_nodes.add(number)
+        inherited = dict(inherited)
+        for attribute in INHERITABLE_PAGE_ATTRIBUTES:
+            value = get_pdf_dictionary_value(dictionary, attribute)
+            if value is not None:
+                inherited[attribute] = value
+        for kid in PDF_REFERENCE.finditer(kids):
+            visit(int(kid.group(1)), inherited)
+
+    visit(pages, {})
+    return page_list, tree_nodes
+
+def get_packet_page(dictionary, inherited):
+    """
+    Returns the dictionary of a page for a packet: with the attributes it inherits set on the
+    page itself, and without its /StructParents, since the packet has no structure tree.
+    """
+    entries = get_pdf_dictionary_entries(dictionary)
+    keys = {key for key, _, _ in entries}
+    kept = [b'/%s %s' % (key, dictionary[start:end]) for key, start, end in entries if key != b'StructParents']
+    kept += [b'/%s %s' % (attribute, value) for attribute, value in inherited.items() if attribute not in keys]
+    return b'<<' + b' '.join(kept) + b'>>'
+
+def get_pdf_text_string(text):
+    """
+    Returns a text as a PDF string in UTF-16 (hexadecimal), which allows any character.
+    """
+    return b'<FEFF' + str(text).encode('utf-16-be').hex().upper().encode() + b'>'
+
+def open_report_packet(packet_path):
+    """
+    Opens a packet file that reports are streamed into one at a time: a multi-page PDF when
+    the path ends in '.pdf', or a zip archive of the report files when it ends in '.zip'.
+
+    Returns:
+        packet (dict): Packet state for add_report_to_packet and close_report_packet.
+    """
+    packet_path = Path(packet_path)
+    packet_path.parent.mkdir(parents=True, exist_ok=True)
+    packet = {'path': packet_path, 'format': packet_path.suffix.lstrip('.').lower(), 'reports': 0}
+    if packet['format'] == 'zip':
+        packet['file'] = zipfile.ZipFile(packet_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        packet['names'] = set()
+    elif packet['format'] == 'pdf':
+        packet['file'] = open(packet_path, 'wb')
+        packet['file'].write(b'%PDF-1.4\n%\xd3\xeb\xe9\xe1\n')
+        packet.update({'offsets': {}, 'next_object': PACKET_OUTLINES + 1, 'pages': [], 'bookmarks': []})
+    else:
+        raise ValueError(f"Unsupported packet format: {packet_path.suffix} (use .pdf or .zip)")
+    return packet
+
+def write_pdf_object(packet, number, dictionary, stream=None):
+    """
+    Appends one object to a PDF packet.
+    """
+    packet['offsets'][number] = packet['file'].tell()
+    packet['file'].write(b'%d 0 obj\n' % number + dictionary)
+    if stream is not None:
+        packet['file'].write(b'\nstream\n' + stream + b'\nendstream')
+    packet['file'].write(b'\nendobj\n')
+
+def add_report_to_packet(packet, report_file, title):
+    """
+    Appends a rendered report to a packet. A PDF packet gets the pages of the report and a
+    bookmark with the given title; a zip packet gets the report file.
+
+    Args:
+        packet (dict): Output of open_report_packet.
+        report_file (str or Path): Rendered report.
+        title (str): Bookmark title, or file name in a zip packet, e.g. the name of the test taker.
+    """
+    report_file = Path(report_file)
+    packet['reports'] += 1
+    if packet['format'] == 'zip':
+        # Reports are stored under the title; namesakes get a number as in get_report_path
+        arcname, n = f"{title}{report_file.suffix}", 1
+        while arcname in packet['names']:
+            n += 1
+            arcname = f"{title} ({n}){report_file.suffix}"
+        packet['names'].add(arcname)
+        packet['file'].write(report_file, arcname=arcname)
+        return
+
+    objects, trailer = read_pdf_objects(report_file.read_bytes())
+    root = int(re.search(rb'/Root\s+(\d+)\s+\d+\s+R', trailer).group(1))
+    pages = int(re.search(rb'/Pages\s+(\d+)\s+\d+\s+R', objects[root][0]).group(1))
+    page_list, tree_nodes = get_pdf_pages(objects, pages)
+
+    # Renumber the objects the report's pages use after those already in the packet; the
+    # pages join the packet's page tree, and the report's catalog, page tree nodes, document
+    # information and structure tree are left out
+    page_dictionaries = {number: get_packet_page(objects[number][0], inherited) for number, inherited in page_list}
+    numbers = {node: PACKET_PAGES for node in tree_nodes}
+    used, to_visit = [], [number for number, _ in page_list]
+    while to_visit:
+        number = to_visit.pop()
+        if number in numbers or number not in objects:
+            continue
+        numbers[number] = None
+        used.append(number)
+        to_visit.extend(int(match.group(1)) for match in
+                        PDF_REFERENCE.finditer(page_dictionaries.get(number, objects[number][0])))
+    for number in sorted(used):
+        numbers[number] = packet['next_object']
+        packet['next_object'] += 1
+
+    def renumber(match):
+        # A reference to an object that is left out, e.g. the catalog, is a reference to null
+        number = numbers.get(int(match.group(1)))
+        return b'%d 0 R' % number if number is not None else b'null'
+
+    for number in sorted(used):
+        dictionary, stream = objects[number]
+        write_pdf_object(packet, numbers[number], PDF_REFERENCE.sub(renumber, page_dictionaries.get(number, dictionary)),
+                         stream)
+    packet['pages'].extend(numbers[number] for number, _ in page_list)
+    if page_list:
+        packet['bookmarks'].append((title, numbers[page_list[0][0]]))
+
+def close_report_packet(packet):
+    """
+    Finishes a packet: a PDF packet gets its page tree, bookmarks and cross-reference table.
+
+    Returns:
+        packet_path (Path): Path of the packet file.
+    """
+    if packet['format'] == 'zip':
+        packet['file'].close()
+        return packet['path']
+
+    bookmarks = packet['bookmarks']
+    bookmark_numbers = list(range(packet['next_object'], packet['next_object'] + len(bookmarks)))
+    write_pdf_object(packet, PACKET_CATALOG, b'<</Type /Catalog /Pages %d 0 R /Outlines %d 0 R /PageMode /UseOutlines>>'
+                     % (PACKET_PAGES, PACKET_OUTLINES))
+    write_pdf_object(packet, PACKET_PAGES, b'<</Type /Pages /Count %d /Kids [%s]>>'
+                     % (len(packet['pages']), b' '.join(b'%d 0 R' % page for page in packet['pages'])))
+    if bookmarks:
+        write_pdf_object(packet, PACKET_OUTLINES, b'<</Type /Outlines /First %d 0 R /Last %d 0 R /Count %d>>'
+                         % (bookmark_numbers[0], bookmark_numbers[-1], len(bookmarks)))
+    else:
+        write_pdf_object(packet, PACKET_OUTLINES, b'<</Type /Outlines /Count 0>>')
+    for n, ((title, page), number) in enumerate(zip(bookmarks, bookmark_numbers)):
+        links = b''.join([
+            b' /Prev %d 0 R' % bookmark_numbers[n - 1] if n > 0 else b'',
+            b' /Next %d 0 R' % bookmark_numbers[n + 1] if n + 1 < len(bookmarks) else b'',
+        ])
+        write_pdf_object(packet, number, b'<</Title %s /Parent %d 0 R /Dest [%d 0 R /Fit]%s>>'
+                         % (get_pdf_text_string(title), PACKET_OUTLINES, page, links))
+
+    size = bookmark_numbers[-1] + 1 if bookmarks else packet['next_object']
+    xref_offset = packet['file'].tell()
+    xref = [b'xref\n0 %d\n' % size, b'0000000000 65535 f \n']
+    for number in range(1, size):
+        offset = packet['offsets'].get(number)
+        xref.append(b'%010d 00000 n \n' % offset if offset is not None else b'0000000000 00000 f \n')
+    packet['file'].write(b''.join(xref))
+    packet['file'].write(b'trailer\n<</Size %d /Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n' % (size, PACKET_CATALOG, xref_offset))
+    packet['file'].close()
+    return packet['path']
+
+def open_report_packets(packet_format='pdf', reports_per_packet=None):
+    """
+    Starts the packets of a run, one series of packet files per cohort.
+
+    Args:
+        packet_format (str): 'pdf' for multi-page PDFs with a bookmark per report, or 'zip'.
+        reports_per_packet (int): Start a new packet file after this many reports; one file
+            per cohort by default.
+
+    Returns:
+        packets (dict): State for add_report_to_packets and close_report_packets.
+    """
+    return {'format': packet_format, 'reports_per_packet': reports_per_packet,
+            'run': time.strftime('%Y%m%d-%H%M%S'), 'series': {}, 'closed': []}
+
+def add_report_to_packets(packets, packet_name, report_file, title):
+    """
+    Adds a rendered report to the packet series of a cohort.
+
+    Packet files are named '<packet_name>_<run time>.<format>', with '_part<number>' added
+    before the format when reports_per_packet is set, so earlier packets are never overwritten.
+
+    Args:
+        packets (dict): Output of open_report_packets.
+        packet_name (Path): Path of the cohort's packets without the run time and suffix.
+        report_file (str or Path): Rendered report.
+        title (str): Bookmark title.
+
+    Returns:
+        packet_path (Path): Packet file that received the report.
+    """
+    series = packets['series'].setdefault(str(packet_name), {'packet': None, 'part': 0})
+    packet = series['packet']
+    if packet is None or (packets['reports_per_packet'] and packet['reports'] >= packets['reports_per_packet']):
+        if packet is not None:
+            packets['closed'].append(close_report_packet(packet))
+        series['part'] += 1
+        packet_name = Path(packet_name)
+        part = f"_part{series['part']:03d}" if packets['reports_per_packet'] else ''
+        packet = series['packet'] = open_report_packet(
+            packet_name.with_name(f"{packet_name.name}_{packets['run']}{part}.{packets['format']}"))
+    add_report_to_packet(packet, report_file, title)
+    return packet['path']
+
+def close_report_packets(packets):
+    """
+    Finishes all open packets of a run.
+
+    Returns:
+        packet_paths (list): Paths of all packet files written in the run.
+    """
+    for series in packets['series'].values():
+        if series['packet'] is not None:
+            packets['closed'].append(close_report_packet(series['packet']))
+            series['packet'] = None
+    return packets['closed']
@@ -0,0 +1,291 @@
+import os
+import time
+import signal
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from Functions.Native_Report_Rendering import NATIVE_RENDERER_VERSION, write_native_report
+
+# Time a report may take in a render worker, from when a worker takes it up, before the
+# worker is taken to hang and the pool is restarted
+RENDER_TIMEOUT_SECONDS = 120
+
+def start_render_worker(backend='kaleido'):
+    """
+    Starts the Kaleido process of a render worker, so its first report does not pay for it.
+
+    Workers ignore Ctrl+C, which reaches every process of the terminal: the main process
+    decides when to stop, and lets the reports in flight finish.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if backend == 'kaleido':
+        import plotly.io as pio
+        pio.to_image({'data': [], 'layout': {}}, format='pdf', engine='kaleido')
+
+def open_render_pool(workers=None, backend='kaleido', warm_up=True):
+    """
+    Starts a pool of render worker processes, which can be shared by several render_reports
+    calls (e.g. in a long-running service) so that each call does not start Kaleido again.
+
+    Args:
+        workers (int): Number of render processes (see render_reports).
+        backend (str): 'kaleido' or 'native' (see write_report).
+        warm_up (bool): Wait until every worker has started, instead of starting them as the
+            first reports come in.
+
+    Returns:
+        render_pool (dict): Pool state, or None if reports are rendered in the current process.
+    """
+    if workers is None:
+        workers = 1 if backend == 'native' else os.cpu_count() or 1
+    if workers <= 1:
+        return None
+    context = multiprocessing.get_context('spawn')
+    render_pool = {'workers': workers, 'backend': backend, 'context': context,
+                   'executor': ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                   initializer=start_render_worker, initargs=(backend,))}
+    if warm_up:
+        wait([render_pool['executor'].submit(time.sleep, 0) for _ in range(workers)])
+    return render_pool
+
+def restart_render_pool(render_pool, terminate=False):
+    """
+    Replaces the executor of a render pool, e.g. after a worker crashed and took it down.
+
+    Args:
+        render_pool (dict): Output of open_render_pool.
+        terminate (bool): Also stop the worker processes of the old executor, e.g. when one
+            of them hangs; otherwise they are left to finish their current report.
+    """
+    processes = get_worker_processes(render_pool['executor']) if terminate else []
+    render_pool['executor'].shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+    render_pool['executor'] = ProcessPoolExecutor(max_workers=render_pool['workers'], mp_context=render_pool['context'],
+                                                  initializer=start_render_worker, initargs=(render_pool['backend'],))
+
+def get_worker_processes(executor):
+    """
+    Returns the worker processes of a process pool executor, or an empty list if they cannot
+    be found.
+
+    ProcessPoolExecutor has no public way to stop a busy worker: shutdown() only cancels the
+    reports that have not started, and a hung worker keeps running. Its private '_processes'
+    attribute is the only way to reach the workers; should a Python version drop it, the
+    hung workers are left behind by shutdown(cancel_futures=True) and the new pool starts anyway.
+    """
+    processes = getattr(executor, '_processes', None)
+    return list(processes.values()) if isinstance(processes, dict) else []
+
+def start_render_deadlines(pending, workers, timeout):
+    """
+    Starts the timeout of the reports in flight that a worker has taken up.
+
+    The pool hands out reports in the order they were submitted, so the first reports in
+    flight, one per worker, are being rendered; the others wait in the pool's queue, and
+    their time has not started yet.
+
+    Args:
+        pending (dict): (figure_spec, result, deadline) of each future in flight, in the
+            order they were submitted; deadline is None until the report is taken up.
+        workers (int): Number of render processes.
+        timeout (float): Seconds a report may take (see render_reports).
+    """
+    now = time.monotonic()
+    for future, (figure_spec, result, deadline) in list(pending.items())[:workers]:
+        if deadline is None:
+            pending[future] = (figure_spec, result, now + timeout)
+
+def close_render_pool(render_pool):
+    """
+    Stops the workers of a render pool once the reports in flight are written.
+    """
+    if render_pool is not None:
+        render_pool['executor'].shutdown(wait=True, cancel_futures=True)
+
+def write_report(figure_spec, output_path, backend='kaleido'):
+    """
+    Writes one serialized Plotly figure to the output path with Kaleido, or with the native
+    PDF writer (see write_native_report). Reports with text the native writer cannot draw
+    are rendered with Kaleido.
+
+    The figure is not validated again, so it must come from Figure.to_dict() or a report
+    template (see fill_personality_report).
+
+    Args:
+        figure_spec (dict): Figure as returned by Figure.to_dict().
+        output_path (str): Path of the image file; the format follows the file extension
+            (the native backend writes PDF only).
+        backend (str): 'kaleido' or 'native'.
+
+    Returns:
+        seconds (float): Time spent writing the report.
+    """
+    if backend == 'native':
+        try:
+            return write_native_report(figure_spec, output_path)
+        except UnicodeEncodeError:
+            # Text the standard PDF fonts do not have, e.g. a Cyrillic name: the report is
+            # rendered with Kaleido, with Plotly's default template as the Kaleido backend does
+            import plotly.graph_objects as go
+            figure_spec = go.Figure(figure_spec).to_dict()
+    # Plotly and Kaleido are only imported once reports are rendered with them
+    import plotly.io as pio
+    start = time.perf_counter()
+    pio.write_image(figure_spec, output_path, engine='kaleido', validate=False)
+    return time.perf_counter() - start
+
+def get_backend_version(backend='kaleido'):
+    """
+    Returns the version of a render backend, as part of the report cache keys: the Plotly
+    and Kaleido versions, or the native writer's version. Plotly and Kaleido are only
+    imported for the Kaleido backend.
+    """
+    if backend == 'native':
+        return (backend, NATIVE_RENDERER_VERSION)
+    import plotly
+    import kaleido
+    return (plotly.__version__, getattr(kaleido, '__version__', None))
+
+def render_reports(report_jobs, workers=None, retries=1, on_rendered=None, backend='kaleido', render_pool=None,
+                   timeout=RENDER_TIMEOUT_SECONDS):
+    """
+    Renders report figures to files with a pool of warm Kaleido workers, or with the native
+    PDF writer.
+
+    Args:
+        report_jobs (iterable): (figure_spec, output_path) pairs. It is consumed lazily,
+            so reports are rendered while later ones are still being built.
+        workers (int): Number of render processes. Defaults to the number of CPUs, or to 1
+            with the native backend, which takes milliseconds per report; 1 renders in the
+            current process.
+        retries (int): Number of times a failed report is tried again.
+        on_rendered (function): Called in the current process with the result of each report
+            as soon as it is written, e.g. to add it to a report packet.
+        backend (str): 'kaleido' or 'native' (see write_report).
+        render_pool (dict): Output of open_render_pool, to render with workers that are
+            already running; workers is then ignored and the pool is left open.
+        timeout (float): Seconds a report may take once a render worker has taken it up
+            (reports waiting for a free worker are not timed). A report that takes
+            longer counts as a failed attempt, and the pool is restarted, since its worker may
+            hang without ever crashing. Reports rendered in the current process have no timeout.
+
+    Returns:
+        results (list): One dict per report with 'output_path', 'status' ('ok' or 'failed'),
+            'attempts', 'seconds' (render time of the last attempt) and 'error'.
+    """
+    own_pool = render_pool is None
+    if own_pool:
+        render_pool = open_render_pool(workers, backend, warm_up=False)
+    results = []
+
+    if render_pool is None:
+        for figure_spec, output_path in report_jobs:
+            result = {'output_path': str(output_path), 'status': 'failed', 'attempts': 0, 'seconds': None, 'error': None}
+            while result['attempts'] <= retries:
+                result['attempts'] += 1
+                try:
+                    result['seconds'] = write_report(figure_spec, str(output_path), backend)
+                    result['status'], result['error'] = 'ok', None
+                    break
+                except Exception as e:
+                    result['error'] = repr(e)
+            results.append(result)
+            if result['status'] == 'ok' and on_rendered is not None:
+                on_rendered(result)
+        return results
+
+    # Keep a bounded number of reports in flight so the job iterator is not drained into memory
+    max_in_flight = 2 * render_pool['workers']
+    pending = {}
+    retry_queue = deque()
+    report_jobs = iter(report_jobs)
+    jobs_left = True
+    try:
+        while jobs_left or retry_queue or pending:
+            while len(pending) < max_in_flight and (retry_queue or jobs_left):
+                if retry_queue:
+                    figure_spec, result = retry_queue.popleft()
+                else:
+                    try:
+                        figure_spec, output_path = next(report_jobs)
+                    except StopIteration:
+                        jobs_left = False
+                        break
+                    result = {'output_path': str(output_path), 'status': 'failed', 'attempts': 0, 'seconds': None, 'error': None}
+                    results.append(result)
+                result['attempts'] += 1
+                try:
+                    future = render_pool['executor'].submit(write_report, figure_spec, result['output_path'], backend)
+                except BrokenProcessPool:
+                    # The pool broke while it was idle, e.g. a worker was killed between two calls
+                    restart_render_pool(render_pool)
+                    future = render_pool['executor'].submit(write_report, figure_spec, result['output_path'], backend)
+                pending[future] = (figure_spec, result, None)
+            if not pending:
+                continue
+
+            start_render_deadlines(pending, render_pool['workers'], timeout)
+            next_deadline = min(deadline for _, _, deadline in pending.values() if deadline is not None)
+            done, _ = wait(pending, timeout=max(next_deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                # A worker hangs: its reports fail this attempt, the other reports in flight are sent again
+                restart_render_pool(render_pool, terminate=True)
+                for lost_future, (lost_spec, lost_result, deadline) in list(pending.items()):
+                    if deadline is not None and deadline <= next_deadline:
+                        lost_result['error'] = f"TimeoutError('not rendered within {timeout} s')"
+                        if lost_result['attempts'] <= retries:
+                            retry_queue.append((lost_spec, lost_result))
+                    else:
+                        lost_result['attempts'] -= 1
+                        retry_queue.append((lost_spec, lost_result))
+                pending.clear()
+                continue
+            for future in done:
+                figure_spec, result, _ = pending.pop(future)
+                try:
+                    result['seconds'] = future.result()
+                    result['status'], result['error'] = 'ok', None
+                except BrokenProcessPool as e:
+                    # A crashed worker takes the pool down; start a new one for the remaining reports
+                    result['error'] = repr(e)
+                    restart_render_pool(render_pool)
+                    for lost_future, (lost_spec, lost_result, _) in list(pending.items()):
+                        lost_result['attempts'] -= 1
+                        retry_queue.append((lost_spec, lost_result))
+                    pending.clear()
+                    if result['attempts'] <= retries:
+                        retry_queue.append((figure_spec, result))
+                    break
+                except Exception as e:
+                    result['error'] = repr(e)
+                    if result['attempts'] <= retries:
+                        retry_queue.append((figure_spec, result))
+                else:
+                    if on_rendered is not None:
+                        on_rendered(result)
+    finally:
+        if own_pool:
+            close_render_pool(render_pool)
+    return results
+
+def summarize_render_results(results):
+    """
+    Prints the number of rendered, reused and failed reports and the render time per report.
+    """
+    rendered = [r for r in results if r['status'] == 'ok' and not r.get('cached')]
+    cached = [r for r in results if r.get('cached')]
+    failed = [r for r in results if r['status'] != 'ok']
+    retried = [r for r in results if r['attempts'] > 1]
+    if rendered:
+        seconds = sorted(r['seconds'] for r in rendered)
+        print(f"Rendered {len(rendered)} report(s); render time per report: "
+              f"median {seconds[len(seconds) // 2]:.3f}s, max {seconds[-1]:.3f}s.")
+    if cached:
+        print(f"Reused {len(cached)} unchanged report(s) from the report cache.")
+    if retried:
+        print(f"{len(retried)} report(s) needed more than one attempt.")
+    for r in failed:
+        print(f"Failed to render {r['output_path']} after {r['attempts']} attempt(s): {r['error']}")
@@ -0,0 +1,814 @@
+"""
+Run modes of the report pipeline: score survey exports, render their reports and record
+them in the respondent ledger. Started from the command line by Survey_Report_Generation_Run.py.
+"""
+
+import os
+import csv
+import time
+import queue
+import signal
+import threading
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+from pathlib import Path
+
+from Functions.Export_inbox import (get_file_path, get_pending_file_paths, move_to_survey_folder, move_to_failed_folder,
+                                    get_previous_file_path)
+from Functions.Get_data import (read_survey_info_numeric_data, iter_survey_export_blocks, select_unprocessed_responses,
+                                split_survey_info_numeric_data, read_survey_export, get_numeric_responses)
+from Functions.Codebook_loader import get_personality_codebook, get_cognitive_codebook
+from Functions.NEO_IPIP_recode import recode_NEO_IPIP
+from Functions.Social_Desire_recode import recode_SDS
+from Functions.Response_quality import score_response_quality, update_quality_reference
+from Functions.ICAR_recode import ICAR_FORMS, recode_ICAR
+from Functions.ICAR_norms import get_icar_norm_index, lookup_icar_norms
+from Functions import Personality_Report_Generation, Cognitive_Report_Generation
+from Functions.Personality_Report_Generation import build_personality_report_template, fill_personality_report
+from Functions.Cognitive_Report_Generation import (cognitive_report_generation, get_cognitive_report_spec,
+                                                   get_report_fields)
+from Functions.Report_Rendering import (render_reports, summarize_render_results, open_render_pool, close_render_pool,
+                                       get_backend_version)
+from Functions.Report_Packets import open_report_packets, add_report_to_packets, close_report_packets
+from Functions.Render_cache import (open_report_cache, get_report_key, get_cached_report, release_report_file,
+                                    store_report, summarize_report_cache)
+from Functions.Run_metrics import stage, record_values, take_run_metrics, merge_run_metrics, finish_run_metrics
+from Functions.Population_store import get_cohorts, open_population_store, append_to_population, close_population_store
+from Functions.Results_store import (write_result_block, list_tables, read_results, write_results_info,
+                                     read_results_info)
+from Functions.Respondent_ledger import (open_ledger, get_recorded_respondents, get_recorded_report_paths,
+                                         get_report_path, record_reports, get_respondent_keys, get_content_hashes)
+
+def score_survey_export(parent_directory, latest_survey_data_path, last_survey_data_path, incremental=False):
+    """
+    Scores the new responses of one survey export.
+
+    Args:
+        parent_directory (Path): Parent folder for the repository.
+        latest_survey_data_path (str or Path): Export to score, inside its survey sub-folder.
+        last_survey_data_path (str or Path): Previous export of the same survey.
+        incremental (bool): Find new responses with the respondent ledger.
+
+    Returns:
+        scored_export (dict): See score_survey_data.
+    """
+    # Retrieve both test info and numeric survey data, reading the export once
+    latest_survey_data_raw = read_survey_export(latest_survey_data_path)
+    latest_survey_data_test_info, latest_survey_data_numeric, likert_responses = read_survey_info_numeric_data(
+        parent_directory, latest_survey_data_path, last_survey_data_path, incremental=incremental,
+        latest_survey_data_raw=latest_survey_data_raw)
+    quality_reference = (add_to_export_quality_reference(parent_directory, Path(latest_survey_data_path).parent.name,
+                                                          latest_survey_data_raw)
+                         if not latest_survey_data_test_info.empty else None)
+    del latest_survey_data_raw
+    return score_survey_data(parent_directory, latest_survey_data_path, latest_survey_data_test_info, latest_survey_data_numeric,
+                             likert_responses=likert_responses, quality_reference=quality_reference)
+
+def add_to_export_quality_reference(parent_directory, survey_type, survey_data, quality_reference=None):
+    """
+    Adds the responses of a personality export, or of one block of it, to the response
+    quality reference of the export (see update_quality_reference). Built from all responses
+    of the export, the reference makes the Mahalanobis distance of a response the same
+    whichever responses of the export are scored with it: all of them, a block, or only the
+    new ones.
+
+    Args:
+        parent_directory (Path): Parent folder for the repository.
+        survey_type (str): Survey form of the export, e.g. 'NEO-IPIP 120'.
+        survey_data (DataFrame): Responses as read by read_survey_export or
+            iter_survey_export_blocks.
+        quality_reference (dict): Reference of the blocks added so far, or None for the first.
+
+    Returns:
+        quality_reference (dict): The reference, or None for cognitive tests and forms that
+            are not recognized.
+    """
+    if survey_type in ICAR_FORMS:
+        return None
+    with stage('build response quality reference', rows=len(survey_data)):
+        survey_data_numeric, likert_responses = get_numeric_responses(survey_data)
+        if len(survey_data_numeric.columns) <= 70:  # Not an IPIP NEO form (see score_survey_data)
+            return None
+        return update_quality_reference(parent_directory, survey_data_numeric, quality_reference, likert_responses)
+
+def score_survey_export_in_worker(*score_job):
+    """
+    Scores a survey export in a worker process (see score_survey_export), and returns the run
+    metrics of the worker with it as 'run_metrics' when metrics are switched on.
+    """
+    scored_export = score_survey_export(*score_job)
+    scored_export['run_metrics'] = take_run_metrics()
+    return scored_export
+
+def score_survey_data(parent_directory, survey_data_path, survey_data_test_info, survey_data_numeric, likert_responses=None,
+                      quality_reference=None):
+    """
+    Scores test information and numeric responses read from a survey export.
+
+    Args:
+        parent_directory (Path): Parent folder for the repository.
+        survey_data_path (str or Path): Export the responses come from, inside its survey sub-folder.
+        survey_data_test_info (DataFrame): Test information (see get_survey_info_numeric_data).
+        survey_data_numeric (DataFrame): Numeric responses (see get_survey_info_numeric_data).
+        likert_responses (dict): Decoded Likert answers of the responses (see
+            get_numeric_responses), from which the personality items are scored; by default,
+            from the columns of survey_data_numeric.
+        quality_reference (dict): Response quality reference of the whole export (see
+            add_to_export_quality_reference); by default, the responses given.
+
+    Returns:
+        scored_export (dict): 'file_path', 'survey_type' and 'respondents' (number of responses).
+            For surveys with responses, also 'item_number', 'survey_data_scored' (one row per
+            test taker: name, header fields and scores), 'respondent_keys', 'content_hashes' and
+            'cohorts' (month of completion, see get_cohorts).
+            Personality scores are the response quality fields (see get_response_quality),
+            the social desirability and personality scores and the dimension and facet
+            scores; cognitive scores are the
+            ICAR scores with their norm percentiles, and cognitive tests also get
+            'dimension_items' (number of items per dimension).
+    """
+    scored_export = {
+        'file_path': str(survey_data_path),
+        'survey_type': Path(survey_data_path).parent.name,
+        'respondents': len(survey_data_test_info),
+    }
+    if survey_data_test_info.empty:
+        return scored_export
+
+    if scored_export['survey_type'] in ICAR_FORMS:  # ICAR 16 or ICAR 60 test
+        with stage('recode ICAR', rows=len(survey_data_numeric)):
+            survey_data_item_scores, survey_data_ICAR_scores, scoring_key = recode_ICAR(
+                parent_directory=parent_directory, survey_data=survey_data_numeric, survey_type=scored_export['survey_type'])
+
+        # Percentiles against the age-matched norm group, on the ICAR 60 scale of the norm data
+        norm_scores = [f"{d}_60" for d in scoring_key['dimensions']] + ['ICAR60_Total']
+        age_columns = [c for c in survey_data_numeric.columns if str(c).strip().lower() == 'age']
+        ages = (pd.to_numeric(survey_data_numeric[age_columns[0]], errors='coerce') if age_columns
+                else np.full(len(survey_data_numeric), np.nan))
+        norm_index = get_icar_norm_index(parent_directory)
+        with stage('look up ICAR norms', rows=len(survey_data_numeric)):
+            percentiles, _ = lookup_icar_norms(norm_index, ages, survey_data_ICAR_scores[norm_scores].to_numpy(), norm_scores)
+        survey_data_percentiles = pd.DataFrame(percentiles, index=survey_data_numeric.index,
+                                               columns=[f"{score} Percentile" for score in norm_scores])
+
+        merge_cols = ['Full Name', 'Response Time', 'Completion Time', 'Email address']
+        scored_export['survey_data_scored'] = pd.concat([
+            survey_data_test_info[merge_cols],
+            survey_data_ICAR_scores,
+            survey_data_percentiles
+        ], axis=1)
+
+        scored_export['item_number'] = survey_data_item_scores.shape[1]
+        scored_export['dimension_items'] = {d: int(n) for d, n in zip(scoring_key['dimensions'], scoring_key['dimension_item_count']) if n > 0}
+        scored_export['respondent_keys'] = survey_data_test_info['Respondent Key'].to_numpy()
+        scored_export['content_hashes'] = survey_data_test_info['Content Hash'].to_numpy()
+        scored_export['cohorts'] = get_cohorts(survey_data_test_info['End Date'])
+    elif len(survey_data_numeric.columns) > 70:  # IPIP NEO 120 or NEO 300 survey
+        # Response quality is scored on the answers as given, before they are reverse coded
+        with stage('score response quality', rows=len(survey_data_numeric)):
+            survey_data_quality = score_response_quality(parent_directory, survey_data_test_info, survey_data_numeric,
+                                                         reference=quality_reference, likert_responses=likert_responses)
+
+        # Recode personality survey data
+        with stage('recode NEO-IPIP', rows=len(survey_data_numeric)):
+            survey_data_numeric_calculate, survey_data_personality_score, codebook_all = recode_NEO_IPIP(
+                parent_directory=parent_directory, survey_data=survey_data_numeric, likert_responses=likert_responses)
+
+        # If the dataframe has a multi-index, flatten it
+        if hasattr(survey_data_numeric_calculate.columns, 'get_level_values'):
+            survey_data_numeric_calculate.columns = survey_data_numeric_calculate.columns.get_level_values(1)
+
+        with stage('recode SDS', rows=len(survey_data_numeric)):
+            survey_data_SDS = recode_SDS(parent_directory=parent_directory, survey_data=survey_data_numeric)
+        merge_cols = ['Full Name', 'Response Time', 'Completion Time', 'Email address']
+        scored_export['survey_data_scored'] = pd.concat([
+            survey_data_test_info[merge_cols],
+            survey_data_quality,
+            survey_data_SDS,
+            survey_data_personality_score,
+            survey_data_numeric_calculate
+        ], axis=1)
+
+        scored_export['item_number'] = 120 if (len(survey_data_numeric.columns) < 200) else 300
+        scored_export['respondent_keys'] = survey_data_test_info['Respondent Key'].to_numpy()
+        scored_export['content_hashes'] = survey_data_test_info['Content Hash'].to_numpy()
+        scored_export['cohorts'] = get_cohorts(survey_data_test_info['End Date'])
+    return scored_export
+
+def add_to_population(parent_directory, scored_exports):
+    """
+    Adds the respondents of scored exports to the population store in the 'Population'
+    folder and updates its summaries (see append_to_population).
+    """
+    scored_exports = [e for e in scored_exports if 'survey_data_scored' in e]
+    if not scored_exports:
+        return
+    store = open_population_store(parent_directory)
+    try:
+        with stage('add to population', rows=sum(e['respondents'] for e in scored_exports)):
+            for scored_export in scored_exports:
+                append_to_population(store, scored_export['survey_type'], scored_export['survey_data_scored'],
+                                     scored_export['respondent_keys'], scored_export['cohorts'])
+    finally:
+        close_population_store(store)
+
+def render_scored_exports(parent_directory, scored_exports, render_workers=None, packets=None, report_cache=None,
+                          render_backend='kaleido', render_pool=None, report_templates=None):
+    """
+    Renders the personality and cognitive reports of scored exports and records them in the
+    respondent ledger.
+
+    The exports are taken newest first. A respondent who appears in several exports of the
+    same survey gets one report, from the newest export.
+
+    Args:
+        parent_directory (Path): Parent folder for the repository.
+        scored_exports (list): Outputs of score_survey_export, oldest first.
+        render_workers (int): Number of render processes (see render_reports).
+        packets (dict): Output of open_report_packets. If given, each report is added to the
+            packet of its export ('Report/Packets/<report type>s_<export name>') as soon as it is
+            rendered, instead of being kept as a file of its own.
+        report_cache (dict): Output of open_report_cache. If given, a report whose inputs
+            (template version, name, item number and the scored values it shows) were rendered
+            before is taken from the cache instead of being rendered again.
+        render_backend (str): 'kaleido', or 'native' to draw the reports with the native PDF
+            writer (see write_native_report).
+        render_pool (dict): Output of open_render_pool, to render with workers that are
+            already running instead of starting render_workers new ones.
+        report_templates (dict): Personality report layouts built by earlier calls, to reuse
+            them; layouts built in this call are added to it.
+
+    Returns:
+        render_results (list): Outputs of render_reports, followed by one entry per report
+            taken from the cache (with 'cached' set to True).
+    """
+    scored_exports = [e for e in scored_exports if 'survey_data_scored' in e]
+    if not scored_exports:
+        return []
+    if any(e['survey_type'] not in ICAR_FORMS for e in scored_exports):
+        codebook_all = get_personality_codebook(parent_directory)['IPIP-NEO-ItemKey']
+
+    ledger = open_ledger(parent_directory)
+    recorded_respondents, rendered_keys = {}, {}
+    # Personality report layouts, built once per form and set of scored fields
+    if report_templates is None:
+        report_templates = {}
+    taken_report_paths = get_recorded_report_paths(ledger)
+    report_respondents = {}
+    report_keys, cached_results = {}, []
+    # Native reports differ from Kaleido ones, so the backend is part of the cache keys
+    if report_cache is not None:
+        backend_version = get_backend_version(render_backend)
+    # Packet mode: reports are rendered to numbered temporary files, then moved into their packet
+    packet_reports = {}
+    if packets is not None:
+        packet_directory = tempfile.TemporaryDirectory(dir=parent_directory / "Report")
+
+    def report_jobs():
+        for scored_export in reversed(scored_exports):
+            survey_type = scored_export['survey_type']
+            if survey_type not in recorded_respondents:
+                recorded_respondents[survey_type] = get_recorded_respondents(ledger, survey_type)
+                rendered_keys[survey_type] = set()
+            respondent_keys = scored_export['respondent_keys']
+            export_keys = set()
+
+            scored_data = scored_export['survey_data_scored']
+            if survey_type in ICAR_FORMS:
+                report_type = 'Cognitive_Report'
+                report_fields = get_report_fields(scored_export['dimension_items'])
+                report_version = (Cognitive_Report_Generation.REPORT_TEMPLATE_VERSION, scored_export['item_number'],
+                                  tuple(scored_export['dimension_items'].items()))
+                test_takers = zip(range(len(scored_data)), scored_data['Full Name'], scored_data.to_dict('records'))
+            else:
+                report_type = 'Personality_Report'
+                template_key = (scored_export['item_number'], tuple(scored_data.columns), render_backend)
+                if template_key not in report_templates:
+                    report_templates[template_key] = build_personality_report_template(
+                        scored_data.columns, codebook_all, scored_export['item_number'], backend=render_backend)
+                template = report_templates[template_key]
+                report_version = (Personality_Report_Generation.REPORT_TEMPLATE_VERSION, scored_export['item_number'],
+                                  tuple(template['value_fields']))
+                test_takers = zip(range(len(scored_data)), scored_data['Full Name'],
+                                  scored_data[template['value_fields']].to_numpy(dtype=object))
+            for respondent, name, test_taker_data in test_takers:
+                respondent_key = respondent_keys[respondent]
+                if respondent_key in rendered_keys[survey_type]:
+                    continue  # Already rendered from a newer export in this run
+                export_keys.add(respondent_key)
+
+                if packets is not None:
+                    output_path = Path(packet_directory.name) / f"{len(packet_reports):06d}.pdf"
+                    packet_reports[str(output_path)] = (
+                        parent_directory / "Report" / "Packets" / f"{report_type}s_{Path(scored_export['file_path']).stem}", name)
+                else:
+                    # Respondents keep their report file across runs; new namesakes get a numbered one
+                    output_path = get_report_path(
+                        recorded_respondents[survey_type], taken_report_paths, respondent_key,
+                        parent_directory / "Report" / f"{report_type}_{name}.pdf")
+                report_respondents[str(output_path)] = (survey_type, respondent_key, scored_export['content_hashes'][respondent])
+
+                if report_cache is not None:
+                    shown_values = (tuple(test_taker_data[f] for f in report_fields) if survey_type in ICAR_FORMS
+                                    else tuple(test_taker_data))
+                    report_key = get_report_key(backend_version, report_type, report_version, name, shown_values)
+                    if get_cached_report(report_cache, report_key, output_path):
+                        result = {'output_path': str(output_path), 'status': 'ok', 'attempts': 0, 'seconds': None,
+                                  'error': None, 'cached': True}
+                        cached_results.append(result)
+                        if packets is not None:
+                            add_to_packet(result)
+                        continue
+                    report_keys[str(output_path)] = report_key
+                    release_report_file(output_path)
+
+                with stage('build report', rows=1):
+                    if survey_type in ICAR_FORMS and render_backend == 'native':
+                        # The native writer draws the plain figure spec, without Plotly
+                        report = get_cognitive_report_spec(
+                            test_taker_data=test_taker_data, name=name, item_number=scored_export['item_number'],
+                            dimension_items=scored_export['dimension_items'])
+                    elif survey_type in ICAR_FORMS:
+                        report = cognitive_report_generation(
+                            test_taker_data=test_taker_data, name=name, item_number=scored_export['item_number'],
+                            dimension_items=scored_export['dimension_items']).to_dict()
+                    else:
+                        report = fill_personality_report(template, test_taker_data, name)
+                yield report, output_path
+            rendered_keys[survey_type] |= export_keys
+
+    def add_to_packet(result):
+        packet_name, title = packet_reports[result['output_path']]
+        result['packet_path'] = str(add_report_to_packets(packets, packet_name, result['output_path'], title))
+        Path(result['output_path']).unlink()
+
+    def on_rendered(result):
+        if report_cache is not None:
+            store_report(report_cache, report_keys[result['output_path']], result['output_path'])
+        if packets is not None:
+            add_to_packet(result)
+
+    try:
+        # Includes building the reports, which are built while earlier ones are rendered
+        with stage('render reports') as span:
+            render_results = render_reports(report_jobs(), workers=render_workers, on_rendered=on_rendered,
+                                            backend=render_backend, render_pool=render_pool) + cached_results
+            span['rows'] = len(render_results)
+        record_values('report render seconds', [r['seconds'] for r in render_results if r['status'] == 'ok'])
+        rendered = pd.DataFrame(
+            [report_respondents[r['output_path']] + (r.get('packet_path', r['output_path']),)
+             for r in render_results if r['status'] == 'ok'],
+            columns=['survey_type', 'respondent_key', 'content_hash', 'report_path'])
+        with stage('record reports', rows=len(rendered)):
+            for survey_type, rendered_type in rendered.groupby('survey_type'):
+                record_reports(ledger, survey_type, rendered_type['respondent_key'], rendered_type['content_hash'],
+                               rendered_type['report_path'])
+    finally:
+        ledger.close()
+        if packets is not None:
+            packet_directory.cleanup()
+    return render_results
+
+def write_run_metrics(parent_directory):
+    """
+    Writes the run metrics to the 'Metrics' folder if they are switched on (see Run_metrics).
+    """
+    summary_file = finish_run_metrics(parent_directory / 'Metrics')
+    if summary_file is not None:
+        print(f"Run metrics written to {summary_file}.")
+
+def print_packet_paths(packet_paths):
+    """
+    Prints the packet files written in a run.
+    """
+    for packet_path in packet_paths:
+        print(f"Report packet written to {packet_path}.")
+
+def main(render_workers=None, incremental=False, packet_format=None, reports_per_packet=None, report_cache=True,
+         render_backend='kaleido'):
+    """
+    Scores the latest survey export and writes one PDF report per test taker.
+
+    Args:
+        render_workers (int): Number of processes rendering PDF reports. Defaults to the
+            number of CPUs; 1 renders the reports one at a time in this process.
+        incremental (bool): Only score and render the responses of the latest export that the
+            respondent ledger has no up-to-date report for, instead of diffing the last two exports.
+        packet_format (str): 'pdf' to collect the reports of the export in one multi-page PDF
+            with a bookmark per test taker, or 'zip' for a zip archive of the reports.
+        reports_per_packet (int): Start a new packet file after this many reports.
+        report_cache (bool): Reuse reports whose content has not changed since they were last
+            rendered from 'Report_Cache' (bounded by REPORT_CACHE_MAX_BYTES) instead of rendering them again.
+        render_backend (str): 'kaleido' to render the reports with Plotly and Kaleido, or
+            'native' to draw them straight to PDF in this process, in milliseconds per report.
+    """
+    # Set up the working directory using pathlib
+    code_directory = Path.cwd()
+    parent_directory = code_directory.parent
+
+    latest_survey_data_path, last_survey_data_path = get_file_path(parent_directory=parent_directory, sub_directory='Data')
+    scored_export = score_survey_export(parent_directory, latest_survey_data_path, last_survey_data_path, incremental=incremental)
+    add_to_population(parent_directory, [scored_export])
+    if scored_export['respondents'] == 0:
+        print("No new or changed responses to process.")
+    else:
+        packets = open_report_packets(packet_format, reports_per_packet) if packet_format else None
+        cache = open_report_cache(parent_directory / 'Report_Cache') if report_cache else None
+        try:
+            render_results = render_scored_exports(parent_directory, [scored_export], render_workers=render_workers,
+                                                   packets=packets, report_cache=cache, render_backend=render_backend)
+        finally:
+            if packets is not None:
+                print_packet_paths(close_report_packets(packets))
+        summarize_render_results(render_results)
+        if cache is not None:
+            summarize_report_cache(cache)
+    write_run_metrics(parent_directory)
+
+def main_batch(scoring_workers=None, render_workers=None, incremental=False, packet_format=None, reports_per_packet=None,
+               report_cache=True, render_backend='kaleido'):
+    """
+    Processes every export waiting in the Data folder in one run.
+
+    Each pending export is classified by its header and moved into its survey sub-folder,
+    then all exports are read and scored in parallel and their reports rendered together.
+
+    Args:
+        scoring_workers (int): Number of processes reading and scoring exports. Defaults to
+            the number of CPUs; 1 scores them one at a time in this process.
+        render_workers (int): Number of processes rendering PDF reports (see main).
+        incremental (bool): Find new responses with the respondent ledger (see main). Otherwise
+            each export is compared with the export before it in its survey sub-folder.
+        packet_format (str): Collect the reports in one packet per export (see main).
+        reports_per_packet (int): Start a new packet file after this many reports (see main).
+        report_cache (bool): Reuse unchanged reports from the report cache (see main).
+        render_backend (str): 'kaleido' or 'native' (see main).
+    """
+    code_directory = Path.cwd()
+    parent_directory = code_directory.parent
+    data_directory = parent_directory / 'Data'
+
+    # Claim the pending exports; a file that cannot be classified or moved stays in the inbox
+    survey_data_paths = []
+    for file_path in get_pending_file_paths(parent_directory=parent_directory, sub_directory='Data'):
+        try:
+            survey_data_paths.append(move_to_survey_folder(file_path, data_directory))
+        except Exception as e:
+            print(f"Skipping {file_path.name}: {e}")
+    if not survey_data_paths:
+        print(f"No pending exports in {data_directory}.")
+        return
+    score_jobs = [(parent_directory, path, get_previous_file_path(path), incremental) for path in survey_data_paths]
+
+    if scoring_workers is None:
+        scoring_workers = os.cpu_count() or 1
+    scoring_workers = min(scoring_workers, len(score_jobs))
+    if scoring_workers <= 1:
+        scored_exports = [score_survey_export(*job) for job in score_jobs]
+    else:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=scoring_workers, mp_context=context) as executor:
+            scored_exports = list(executor.map(score_survey_export_in_worker, *zip(*score_jobs)))
+        for scored_export in scored_exports:
+            merge_run_metrics(scored_export.pop('run_metrics'))
+    add_to_population(parent_directory, scored_exports)
+
+    for scored_export in scored_exports:
+        print(f"{Path(scored_export['file_path']).name}: {scored_export['respondents']} new response(s) "
+              f"({scored_export['survey_type']}).")
+    packets = open_report_packets(packet_format, reports_per_packet) if packet_format else None
+    cache = open_report_cache(parent_directory / 'Report_Cache') if report_cache else None
+    try:
+        render_results = render_scored_exports(parent_directory, scored_exports, render_workers=render_workers,
+                                               packets=packets, report_cache=cache, render_backend=render_backend)
+    finally:
+        if packets is not None:
+            print_packet_paths(close_report_packets(packets))
+    summarize_render_results(render_results)
+    if cache is not None:
+        summarize_report_cache(cache)
+    write_run_metrics(parent_directory)
+
+def main_chunked(chunk_size=5000, render=False, render_workers=None, incremental=False,
+                 packet_format=None, reports_per_packet=None, report_cache=True, render_backend='kaleido'):
+    """
+    Scores the latest survey export in blocks of rows, so that memory use is bounded by the
+    block size instead of the export size.
+
+    The scores of each block (header fields, Social Desirability Score, Personality Score,
+    dimension and facet scores) are written to 'Results/<export name>/block_<number>' as soon
+    as the block is scored, so that main_render can render their reports later. Unlike main, every response of the export is scored, not only
+    those that differ from the previous export, unless incremental is True.
+    The Mahalanobis distance is measured against every response of the export (see
+    add_to_export_quality_reference), so that the scores do not depend on the block size. The
+    export is therefore streamed once to build that reference, and each block is kept as a
+    pickle in a temporary folder of the results directory while it is read; the blocks are then
+    scored (and rendered) from those pickles, without parsing the xlsx again.
+
+    Args:
+        chunk_size (int): Number of responses per block.
+        render (bool): Also render the reports of each block before reading the next one.
+        render_workers (int): Number of processes rendering PDF reports (see main).
+        incremental (bool): Only score and render the responses that the respondent ledger
+            has no up-to-date report for (see main). Needs render, since the ledger only
+            records responses once their report is rendered.
+        packet_format (str): Collect the reports of all blocks in one packet (see main).
+        reports_per_packet (int): Start a new packet file after this many reports (see main).
+        report_cache (bool): Reuse unchanged reports from the report cache (see main).
+        render_backend (str): 'kaleido' or 'native' (see main).
+    """
+    if incremental and not render:
+        raise ValueError("incremental scoring needs render=True: the respondent ledger only records rendered reports")
+    code_directory = Path.cwd()
+    parent_directory = code_directory.parent
+
+    latest_survey_data_path, _ = get_file_path(parent_directory=parent_directory, sub_directory='Data')
+    survey_type = Path(latest_survey_data_path).parent.name
+    results_directory = parent_directory / 'Results' / Path(latest_survey_data_path).stem
+    for old_block in list_tables(results_directory):
+        old_block.unlink()
+
+    (results_directory / 'export.json').unlink(missing_ok=True)
+    info_written = False
+    skipped_blocks = 0
+    results_directory.mkdir(parents=True, exist_ok=True)
+    block_directory = tempfile.TemporaryDirectory(dir=results_directory, prefix='export_blocks_')
+
+    render_results = []
+    # One packet series for all blocks, so the packets of an export do not depend on the block size
+    packets = open_report_packets(packet_format, reports_per_packet) if render and packet_format else None
+    cache = open_report_cache(parent_directory / 'Report_Cache') if render and report_cache else None
+    try:
+        # Mahalanobis distances are measured against every response of the export, not only the block
+        block_paths, quality_reference = [], None
+        for block_number, survey_data_block in enumerate(iter_survey_export_blocks(latest_survey_data_path, chunk_size)):
+            quality_reference = add_to_export_quality_reference(parent_directory, survey_type, survey_data_block,
+                                                                quality_reference)
+            with stage('keep export block', rows=len(survey_data_block)):
+                block_paths.append(Path(block_directory.name) / f"block_{block_number:06d}.pkl")
+                survey_data_block.to_pickle(block_paths[-1])
+
+        for block_number, block_path in enumerate(block_paths):
+            survey_data_block = pd.read_pickle(block_path)
+            block_path.unlink()
+            if incremental:
+                survey_data_block, respondent_keys, content_hashes = select_unprocessed_responses(
+                    parent_directory, survey_type, survey_data_block)
+            else:
+                respondent_keys = get_respondent_keys(survey_data_block)
+                content_hashes = get_content_hashes(survey_data_block)
+            if survey_data_block.empty:
+                continue
+
+            with stage('decode responses', rows=len(survey_data_block)):
+                survey_data_test_info, survey_data_numeric, likert_responses = split_survey_info_numeric_data(
+                    survey_data_block, survey_type, respondent_keys, content_hashes)
+            scored_block = score_survey_data(parent_directory, latest_survey_data_path, survey_data_test_info, survey_data_numeric,
+                                             likert_responses=likert_responses, quality_reference=quality_reference)
+            if 'survey_data_scored' not in scored_block:
+                print(f"Skipping block {block_number} ({scored_block['respondents']} response(s)): "
+                      f"the {survey_type} form is not recognized.")
+                skipped_blocks += 1
+                continue
+            with stage('write result block', rows=scored_block['respondents']):
+                write_result_block(results_directory, block_number, scored_block['survey_data_scored'].assign(**{
+                    'Respondent Key': scored_block['respondent_keys'], 'Content Hash': scored_block['content_hashes']}))
+            add_to_population(parent_directory, [scored_block])
+            print(f"Scored block {block_number} ({scored_block['respondents']} response(s)).")
+            if not info_written:
+                # What main_render needs to render the reports from the blocks later
+                write_results_info(results_directory, {key: scored_block[key] for key in
+                                                       ('file_path', 'survey_type', 'item_number', 'dimension_items')
+                                                       if key in scored_block})
+                info_written = True
+
+            if render:
+                render_results += render_scored_exports(parent_directory, [scored_block], render_workers=render_workers,
+                                                        packets=packets, report_cache=cache,
+                                                        render_backend=render_backend)
+            del survey_data_block, survey_data_test_info, survey_data_numeric, likert_responses, scored_block
+    finally:
+        block_directory.cleanup()
+        if packets is not None:
+            print_packet_paths(close_report_packets(packets))
+
+    if skipped_blocks:
+        print(f"{skipped_blocks} block(s) of {Path(latest_survey_data_path).name} were not scored.")
+    print(f"Scores written to {results_directory}.")
+    if render:
+        summarize_render_results(render_results)
+    if cache is not None:
+        summarize_report_cache(cache)
+    write_run_metrics(parent_directory)
+
+def main_render(export_name=None, render_workers=None, packet_format=None, reports_per_packet=None, report_cache=True,
+                render_backend='kaleido'):
+    """
+    Renders the reports of an export scored earlier by main_chunked, from its result blocks
+    in the 'Results' folder, without reading or scoring the export again.
+
+    Args:
+        export_name (str): Name of the export (without '.xlsx'). Defaults to the export
+            scored most recently.
+        render_workers (int): Number of processes rendering PDF reports (see main).
+        packet_format (str): Collect the reports in a packet (see main).
+        reports_per_packet (int): Start a new packet file after this many reports (see main).
+        report_cache (bool): Reuse unchanged reports from the report cache (see main).
+        render_backend (str): 'kaleido' or 'native' (see main).
+    """
+    code_directory = Path.cwd()
+    parent_directory = code_directory.parent
+
+    if export_name is None:
+        scored = [d for d in (parent_directory / 'Results').glob('*') if (d / 'export.json').exists()]
+        if not scored:
+            raise FileNotFoundError(f"No scored exports in {parent_directory / 'Results'}; score one first")
+        results_directory = max(scored, key=lambda d: (d / 'export.json').stat().st_mtime)
+    else:
+        results_directory = parent_directory / 'Results' / export_name
+    info = read_results_info(results_directory)
+    if info is None:
+        raise FileNotFoundError(f"No scored export in {results_directory}; score it first")
+
+    survey_data_scored = read_results(results_directory)
+    if survey_data_scored.empty:
+        print(f"No scored responses in {results_directory}.")
+        return
+    scored_export = dict(info, respondents=len(survey_data_scored),
+                         respondent_keys=survey_data_scored.pop('Respondent Key').to_numpy(),
+                         content_hashes=survey_data_scored.pop('Content Hash').to_numpy(),
+                         survey_data_scored=survey_data_scored)
+    print(f"Rendering the reports of {scored_export['respondents']} response(s) scored in {results_directory}.")
+    packets = open_report_packets(packet_format, reports_per_packet) if packet_format else None
+    cache = open_report_cache(parent_directory / 'Report_Cache') if report_cache else None
+    try:
+        render_results = render_scored_exports(parent_directory, [scored_export], render_workers=render_workers,
+                                               packets=packets, report_cache=cache, render_backend=render_backend)
+    finally:
+        if packets is not None:
+            print_packet_paths(close_report_packets(packets))
+    summarize_render_results(render_results)
+    if cache is not None:
+        summarize_report_cache(cache)
+    write_run_metrics(parent_directory)
+
+def watch_inbox(data_directory, export_queue, stop, poll_seconds):
+    """
+    Polls the Data inbox (the folder get_file_path reads) and puts each new export on the
+    queue once it has landed: when its size and modification time have not changed since the
+    previous poll, so an export that is still being copied in is not read half-written.
+
+    An export stays in the inbox until it is processed, so while the queue is full, new
+    exports simply wait there. Runs until stop is set.
+
+    Args:
+        data_directory (Path): The Data folder.
+        export_queue (Queue): Bounded queue of (export path, time the export was last
+            modified, time it was queued) tuples.
+        stop (Event): Set to stop watching.
+        poll_seconds (float): Time between two polls.
+    """
+    last_seen, queued = {}, set()
+    while not stop.is_set():
+        seen = {}
+        for file_path in get_pending_file_paths(parent_directory=data_directory.parent, sub_directory=data_directory.name):
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:
+                continue
+            seen[file_path] = (stat.st_size, stat.st_mtime_ns)
+        queued &= set(seen)
+        for file_path, signature in seen.items():
+            if file_path in queued or last_seen.get(file_path) != signature:
+                continue
+            while not stop.is_set():
+                try:
+                    export_queue.put((file_path, signature[1] / 1e9, time.time()), timeout=poll_seconds)
+                    queued.add(file_path)
+                    break
+                except queue.Full:
+                    pass
+        last_seen = seen
+        stop.wait(poll_seconds)
+
+def log_export_latency(parent_directory, entry):
+    """
+    Prints the latency of an export processed by the watch service and appends it to
+    'Metrics/watch_latency.csv'.
+    """
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {entry['export']}: {entry['responses']} new response(s), "
+          f"{entry['reports']} report(s), {entry['failed']} failed; waited {entry['queued_seconds']:.1f}s, "
+          f"processed in {entry['processing_seconds']:.1f}s, {entry['latency_seconds']:.1f}s after it landed."
+          + (f" Error: {entry['error']}" if entry['error'] else ''), flush=True)
+    log_file = parent_directory / 'Metrics' / 'watch_latency.csv'
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    new_file = not log_file.exists()
+    with open(log_file, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(entry))
+        if new_file:
+            writer.writeheader()
+        writer.writerow(entry)
+
+def main_watch(poll_seconds=2, queue_size=16, render_workers=None, incremental=False, packet_format=None,
+               reports_per_packet=None, report_cache=True, render_backend='kaleido'):
+    """
+    Runs as a service that processes every export landing in the Data folder, until it is
+    stopped with Ctrl+C or SIGTERM.
+
+    Unlike a run of main, the service keeps its state warm between exports: the codebooks and
+    norm index are loaded and the render workers are started once, and personality report
+    layouts and the report cache are kept in memory, so a new export is scored and rendered
+    within seconds of landing. Exports are taken from a bounded queue, oldest first; the
+    latency of each export is logged to 'Metrics/watch_latency.csv'. An export that cannot be
+    processed is moved to 'Data/Failed' (see move_to_failed_folder). On shutdown, the export
+    being processed is finished, and exports still waiting stay in the inbox for the next run.
+
+    Args:
+        poll_seconds (float): Time between two polls of the Data folder.
+        queue_size (int): Number of exports queued for processing at most.
+        render_workers (int): Number of processes rendering PDF reports (see main).
+        incremental (bool): Find new responses with the respondent ledger (see main).
+        packet_format (str): Collect the reports of each export in a packet (see main).
+        reports_per_packet (int): Start a new packet file after this many reports (see main).
+        report_cache (bool): Reuse unchanged reports from the report cache (see main).
+        render_backend (str): 'kaleido' or 'native' (see main).
+    """
+    code_directory = Path.cwd()
+    parent_directory = code_directory.parent
+    data_directory = parent_directory / 'Data'
+    (parent_directory / 'Report').mkdir(parents=True, exist_ok=True)
+
+    stop = threading.Event()
+    def request_stop(signal_number, frame):
+        print("Stopping after the export being processed...", flush=True)
+        stop.set()
+    previous_handlers = {s: signal.signal(s, request_stop) for s in (signal.SIGINT, signal.SIGTERM)}
+
+    # Warm state: codebooks, norm index and render workers are loaded once for all exports
+    for load in (get_personality_codebook, get_cognitive_codebook, get_icar_norm_index):
+        try:
+            load(parent_directory)
+        except FileNotFoundError as e:
+            print(f"Not preloaded: {e}")
+    render_pool = open_render_pool(render_workers, render_backend)
+    cache = open_report_cache(parent_directory / 'Report_Cache') if report_cache else None
+    report_templates = {}
+
+    export_queue = queue.Queue(maxsize=queue_size)
+    watcher = threading.Thread(target=watch_inbox, args=(data_directory, export_queue, stop, poll_seconds), daemon=True)
+    watcher.start()
+    print(f"Watching {data_directory} for new exports (Ctrl+C to stop).", flush=True)
+    try:
+        while not stop.is_set():
+            try:
+                file_path, landed_at, queued_at = export_queue.get(timeout=poll_seconds)
+            except queue.Empty:
+                continue
+            started_at = time.time()
+            entry = {'finished': None, 'export': file_path.name, 'survey_type': None, 'responses': 0, 'reports': 0,
+                     'failed': 0, 'queued_seconds': started_at - queued_at, 'processing_seconds': None,
+                     'latency_seconds': None, 'error': None}
+            survey_data_path = file_path
+            try:
+                survey_data_path = move_to_survey_folder(file_path, data_directory)
+                entry['survey_type'] = survey_data_path.parent.name
+                scored_export = score_survey_export(parent_directory, survey_data_path,
+                                                    get_previous_file_path(survey_data_path), incremental=incremental)
+                entry['responses'] = scored_export['respondents']
+                add_to_population(parent_directory, [scored_export])
+                if scored_export['respondents']:
+                    packets = open_report_packets(packet_format, reports_per_packet) if packet_format else None
+                    try:
+                        render_results = render_scored_exports(
+                            parent_directory, [scored_export], packets=packets, report_cache=cache,
+                            render_backend=render_backend, render_pool=render_pool, report_templates=report_templates)
+                    finally:
+                        if packets is not None:
+                            print_packet_paths(close_report_packets(packets))
+                    entry['reports'] = sum(r['status'] == 'ok' for r in render_results)
+                    entry['failed'] = len(render_results) - entry['reports']
+            except Exception as e:
+                # A bad export must not stop the service; it is set aside so it is neither lost nor retried
+                entry['error'] = repr(e)
+                try:
+                    entry['error'] += f"; moved to {move_to_failed_folder(survey_data_path, data_directory)}"
+                except OSError as move_error:
+                    entry['error'] += f"; left at {survey_data_path} ({move_error!r})"
+            finished_at = time.time()
+            # The latency runs from the last modification of the export, i.e. when it landed
+            entry.update(finished=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(finished_at)),
+                         processing_seconds=finished_at - started_at, latency_seconds=finished_at - landed_at)
+            log_export_latency(parent_directory, entry)
+    finally:
+        stop.set()
+        watcher.join()
+        close_render_pool(render_pool)
+        if cache is not None:
+            summarize_report_cache(cache)
+        write_run_metrics(parent_directory)
+        for signal_number, handler in previous_handlers.items():
+            signal.signal(signal_number, handler)
+    print("Watch service stopped.")
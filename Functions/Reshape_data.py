@@ -0,0 +1,68 @@
+import pandas as pd
+import numpy as np
+
+def reshape_scores_long(scored_data, codebook_all):
+    """
+    Reshapes the scored survey data into one long respondent-by-field table in a single pass.
+
+    Args:
+        scored_data (DataFrame): One row per test taker with a 'Full Name' column followed by
+            the header fields and the dimension and facet scores.
+        codebook_all (DataFrame): Codebook with 'Dimension' and 'Facet' columns.
+
+    Returns:
+        long_data (DataFrame): Columns 'Respondent' (position of the row in scored_data),
+            'Full Name', 'Facet' (field name), 'Dimension' (NaN for fields that are not facets)
+            and 'Value'. The fields of each respondent are contiguous and in column order.
+    """
+    fields = scored_data.columns.drop('Full Name')
+    facet_dimension = codebook_all[['Dimension', 'Facet']].drop_duplicates(subset='Facet').set_index('Facet')['Dimension']
+    field_dimension = facet_dimension.reindex(fields).to_numpy()
+
+    n_respondents, n_fields = len(scored_data), len(fields)
+    return pd.DataFrame({
+        'Respondent': np.repeat(np.arange(n_respondents), n_fields),
+        'Full Name': np.repeat(scored_data['Full Name'].to_numpy(), n_fields),
+        'Facet': np.tile(fields.to_numpy(dtype=object), n_respondents),
+        'Dimension': np.tile(field_dimension, n_respondents),
+        'Value': scored_data[fields].to_numpy(dtype=object).reshape(-1),
+    })
+
+def iter_test_taker_data(long_data):
+    """
+    Yields the report input of each test taker from the long table of reshape_scores_long.
+
+    Test takers who share a full name are kept apart and get a numbered report name
+    ('Name (2)', 'Name (3)', ...) in order of appearance.
+
+    Yields:
+        respondent (int): Position of the test taker's row in the scored data.
+        name (str): Full name of the test taker.
+        report_name (str): Name to use for the report file.
+        test_taker_df (DataFrame): Columns 'Facet', 'Dimension' and one value column named
+            after the test taker, as expected by personality_report_generation. The columns
+            are views on long_data, not copies.
+    """
+    if long_data.empty:
+        return
+    respondent = long_data['Respondent'].to_numpy()
+    boundaries = np.flatnonzero(np.diff(respondent)) + 1
+    starts = np.concatenate([[0], boundaries])
+    stops = np.concatenate([boundaries, [len(respondent)]])
+
+    names = long_data['Full Name'].to_numpy()
+    facets = long_data['Facet'].to_numpy()
+    dimensions = long_data['Dimension'].to_numpy()
+    values = long_data['Value'].to_numpy()
+
+    name_count = {}
+    for start, stop in zip(starts, stops):
+        name = names[start]
+        name_count[name] = name_count.get(name, 0) + 1
+        report_name = name if name_count[name] == 1 else f"{name} ({name_count[name]})"
+        test_taker_df = pd.DataFrame({
+            name: values[start:stop],
+            'Facet': facets[start:stop],
+            'Dimension': dimensions[start:stop],
+        }, copy=False)
+        yield respondent[start], name, report_name, test_taker_df
@@ -0,0 +1,151 @@
+import sqlite3
+import time
+import hashlib
+import pandas as pd
+import numpy as np
+from pathlib import Path
+
+def open_ledger(parent_directory):
+    """
+    Opens (and creates if needed) the respondent ledger in the Data folder.
+
+    The ledger records, per survey type and respondent, a hash of the response row and the
+    path of the report rendered from it, so later runs can skip unchanged responses.
+
+    Args:
+        parent_directory (str or Path): Parent folder for the repository.
+
+    Returns:
+        connection (sqlite3.Connection): Connection to the ledger database.
+    """
+    ledger_file = Path(parent_directory) / 'Data' / 'respondent_ledger.sqlite'
+    ledger_file.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(ledger_file)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS respondents (
+            survey_type TEXT NOT NULL,
+            respondent_key TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            report_path TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (survey_type, respondent_key)
+        )""")
+    connection.commit()
+    return connection
+
+def get_respondent_keys(survey_data):
+    """
+    Returns a key per response row: the SurveyMonkey respondent ID (first column) when present,
+    otherwise the IP address and end date (fifth and fourth columns).
+    """
+    respondent_id = survey_data.iloc[:, 0]
+    fallback_key = survey_data.iloc[:, 4].astype(str) + '|' + survey_data.iloc[:, 3].astype(str)
+    return respondent_id.astype(str).where(respondent_id.notna(), fallback_key)
+
+def get_cell_strings(column):
+    """
+    Returns the cells of a column as strings that do not depend on the dtype the column was
+    read with, which follows the other rows of the file or block: '' for an empty cell,
+    whole numbers without a decimal point (an integer column with one empty cell is read as
+    floats) and dates as str(Timestamp) gives them.
+    """
+    if column.dtype.kind == 'M':
+        strings = column.astype(object).map(str).to_numpy(dtype=object)
+    else:
+        strings = column.astype(str).to_numpy(dtype=object)
+    if column.dtype.kind == 'f':
+        # Whole numbers in object columns are already int, as the readers convert them
+        numbers = column.to_numpy()
+        whole = np.isfinite(numbers) & (numbers == np.round(numbers)) & (np.abs(numbers) < 2 ** 53)
+        strings[whole] = numbers[whole].astype(np.int64).astype(str)
+    strings[column.isna().to_numpy()] = ''
+    return strings
+
+def get_content_hashes(survey_data):
+    """
+    Returns a hash of the content of each response row, as a hexadecimal string.
+
+    Each row is hashed on its cells as strings (see get_cell_strings), so the hash of a row
+    is the same whichever other rows are read with it: in a later export with more rows, or
+    in a block of a chunked run.
+    """
+    columns = [get_cell_strings(survey_data.iloc[:, n]) for n in range(survey_data.shape[1])]
+    hashes = [hashlib.blake2b('\x1f'.join(row).encode('utf-8'), digest_size=8).hexdigest() for row in zip(*columns)]
+    return pd.Series(hashes, index=survey_data.index, dtype=object)
+
+def get_recorded_respondents(connection, survey_type):
+    """
+    Returns the ledger entries of one survey type as a DataFrame indexed by respondent key.
+    """
+    return pd.read_sql_query(
+        "SELECT respondent_key, content_hash, report_path FROM respondents WHERE survey_type = ?",
+        connection, params=(survey_type,), index_col='respondent_key')
+
+def get_recorded_report_paths(connection):
+    """
+    Returns the set of report paths recorded in the ledger, across all survey types.
+    """
+    return {row[0] for row in connection.execute("SELECT report_path FROM respondents WHERE report_path IS NOT NULL")}
+
+def find_unprocessed(connection, survey_type, respondent_keys, content_hashes):
+    """
+    Flags the responses that are new, have changed, or whose report is missing.
+
+    Args:
+        connection (sqlite3.Connection): Ledger connection.
+        survey_type (str): Survey type, e.g. 'NEO-IPIP 120'.
+        respondent_keys (Series): Key of each response row.
+        content_hashes (Series): Content hash of each response row.
+
+    Returns:
+        unprocessed (Series): Boolean mask aligned with respondent_keys.
+    """
+    recorded = get_recorded_respondents(connection, survey_type)
+    recorded_hash = recorded['content_hash'].reindex(respondent_keys.to_numpy()).to_numpy()
+    recorded_path = recorded['report_path'].reindex(respondent_keys.to_numpy())
+    report_exists = recorded_path.map(lambda p: isinstance(p, str) and Path(p).exists()).to_numpy()
+    unchanged = (recorded_hash == content_hashes.to_numpy()) & report_exists
+    return pd.Series(~unchanged, index=respondent_keys.index)
+
+def get_report_path(recorded, taken_paths, respondent_key, report_path):
+    """
+    Returns the report path to use for a respondent and marks it as taken.
+
+    A respondent who already has a report in the folder of the default path keeps its path
+    (a report collected in a packet does not count). Otherwise, if the default path
+    belongs to another respondent (e.g. someone with the same name from an earlier export),
+    a number is added to the file name: 'Name (2).pdf', 'Name (3).pdf', ...
+
+    Args:
+        recorded (DataFrame): Ledger entries from get_recorded_respondents.
+        taken_paths (set): Report paths already in use, as strings; start from
+            get_recorded_report_paths and pass the same set for every respondent of a run.
+        respondent_key (str): Key of the respondent.
+        report_path (Path): Default report path.
+
+    Returns:
+        report_path (Path): Report path for the respondent.
+    """
+    report_path = Path(report_path)
+    if respondent_key in recorded.index and isinstance(recorded.at[respondent_key, 'report_path'], str):
+        recorded_path = Path(recorded.at[respondent_key, 'report_path'])
+        if recorded_path.parent == report_path.parent:
+            return recorded_path
+    candidate, n = report_path, 1
+    while str(candidate) in taken_paths:
+        n += 1
+        candidate = report_path.with_name(f"{report_path.stem} ({n}){report_path.suffix}")
+    taken_paths.add(str(candidate))
+    return candidate
+
+def record_reports(connection, survey_type, respondent_keys, content_hashes, report_paths):
+    """
+    Records rendered reports in the ledger, replacing earlier entries of the same respondents.
+    """
+    updated_at = time.time()
+    connection.executemany(
+        "INSERT OR REPLACE INTO respondents (survey_type, respondent_key, content_hash, report_path, updated_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(survey_type, key, content_hash, str(path), updated_at)
+         for key, content_hash, path in zip(respondent_keys, content_hashes, report_paths)])
+    connection.commit()
@@ -0,0 +1,83 @@
+import pandas as pd
+import numpy as np
+
+# Answer labels of the IPIP items, in the order of their codes 1-5
+LIKERT_LABELS = ['Inaccurate', 'Moderately Inaccurate', 'Neither', 'Moderately Accurate', 'Accurate']
+
+def decode_likert_responses(survey_data):
+    """
+    Decodes the Likert answer labels of a survey into uint8 codes in one vectorized pass.
+
+    Item columns are the text columns that contain at least one Likert label. Any other
+    text in an item column is an unknown label; it is treated as a missing answer and counted.
+
+    Args:
+        survey_data (DataFrame): Survey responses with text answers.
+
+    Returns:
+        responses (ndarray): C-contiguous uint8 matrix with one row per response and one
+            column per item: 1-5 for 'Inaccurate' to 'Accurate', 0 for a missing answer.
+        items (Index): Names of the item columns, in survey order.
+        unknown_counts (Series): Number of unknown labels per item column.
+    """
+    text_columns = survey_data.columns[(survey_data.dtypes == object).to_numpy()]
+    values = survey_data[text_columns].to_numpy(dtype=object)
+    # Codes are -1 for missing answers and unknown labels
+    codes = pd.Categorical(values.ravel(), categories=LIKERT_LABELS).codes.reshape(values.shape)
+
+    is_item = (codes >= 0).any(axis=0)
+    items = text_columns[is_item]
+    codes = codes[:, is_item]
+    unknown = (codes < 0) & pd.notna(values[:, is_item])
+    responses = np.ascontiguousarray(codes + 1, dtype=np.uint8)
+    return responses, items, pd.Series(unknown.sum(axis=0), index=items)
+
+def decode_blank_items(survey_data, items):
+    """
+    Decodes the item columns that no respondent answered, which have no Likert label for
+    decode_likert_responses to find and are read as float NaN, into uint8 zeros (missing
+    answers), so that all items of a form have the same uint8 codes.
+
+    Args:
+        survey_data (DataFrame): Numeric responses; changed in place.
+        items (list): Item columns of the survey form.
+
+    Returns:
+        blank_items (list): The item columns that were decoded.
+    """
+    blank_items = [item for item in items if survey_data[item].dtype != np.uint8 and survey_data[item].isna().all()]
+    for item in blank_items:
+        survey_data[item] = np.zeros(len(survey_data), dtype=np.uint8)
+    return blank_items
+
+def get_item_matrix(survey_data, items, likert_responses=None):
+    """
+    Returns the answers to the given items as a respondent-by-item matrix.
+
+    With likert_responses, the uint8 codes are taken from the decoded matrix, without going
+    through the DataFrame columns; item columns that are not in it must have been decoded by
+    decode_blank_items, and are all zero. Otherwise the columns of survey_data are used:
+    uint8 if they all hold uint8 codes, else float.
+
+    Args:
+        survey_data (DataFrame): Numeric responses.
+        items (list): Item columns, in the order of the matrix columns.
+        likert_responses (dict): Output of get_numeric_responses for the same rows, with the
+            answers as decoded (before any reverse coding).
+
+    Returns:
+        item_matrix (ndarray): One row per response and one column per item.
+    """
+    if likert_responses is not None:
+        positions = likert_responses['items'].get_indexer(items)
+        blank = positions < 0
+        if len(likert_responses['responses']) != len(survey_data):
+            raise ValueError("The decoded Likert answers are not those of the survey data.")
+        if all(survey_data[item].dtype == np.uint8 for item in np.asarray(items, dtype=object)[blank]):
+            item_matrix = likert_responses['responses'].take(np.maximum(positions, 0), axis=1)
+            item_matrix[:, blank] = 0
+            return item_matrix
+    item_data = survey_data[items]
+    if (item_data.dtypes == np.uint8).all():
+        return item_data.to_numpy()
+    return item_data.to_numpy(dtype=float)
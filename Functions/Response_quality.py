@@ -0,0 +1,222 @@
+import pandas as pd
+import numpy as np
+
+from Functions.Codebook_loader import get_personality_codebook
+from Functions.NEO_IPIP_recode import compile_NEO_IPIP_key, get_NEO_IPIP_form_codebook
+from Functions.Response_decoder import decode_blank_items, get_item_matrix
+
+# Response quality fields added to the scored personality data, in report order
+QUALITY_FIELDS = ['Response Variance', 'Longest String', 'Even-Odd Consistency', 'Mahalanobis Distance',
+                  'Seconds per Item']
+# Respondents per block of the quality metrics, so memory stays bounded on large exports
+QUALITY_BLOCK_SIZE = 10000
+# Facets with answers in both halves needed for an even-odd consistency
+MIN_CONSISTENCY_FACETS = 3
+
+def get_longest_string(answers):
+    """
+    Returns the longest run of identical answers of each respondent, in the order the items
+    were asked. A missing answer (0) ends a run.
+
+    Args:
+        answers (ndarray): Answer codes, one row per respondent, 0 for a missing answer.
+    """
+    same = (answers[:, 1:] == answers[:, :-1]) & (answers[:, 1:] > 0)
+    repeats = np.cumsum(same, axis=1, dtype=np.int32)
+    # Repeats since the last change of answer
+    runs = repeats - np.maximum.accumulate(np.where(same, 0, repeats), axis=1)
+    longest = runs.max(axis=1, initial=0) + 1
+    return np.where((answers > 0).any(axis=1), longest, 0)
+
+def get_even_odd_consistency(recoded, answered, odd_facet, even_facet):
+    """
+    Returns the even-odd consistency of each respondent: the correlation over facets between
+    the mean of the odd and of the even items of each facet, with the Spearman-Brown
+    correction. Careless answers give values around 0; attentive answers values near 1.
+
+    Args:
+        recoded (ndarray): Reverse-coded answers as floats, 0 for a missing answer.
+        answered (ndarray): 1.0 for an answer, 0.0 for a missing answer.
+        odd_facet (ndarray): Item-to-facet matrix of the odd items of each facet.
+        even_facet (ndarray): Item-to-facet matrix of the even items of each facet.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        odd_means = (recoded @ odd_facet) / (answered @ odd_facet)
+        even_means = (recoded @ even_facet) / (answered @ even_facet)
+        valid = ~np.isnan(odd_means) & ~np.isnan(even_means)
+        facets = valid.sum(axis=1, keepdims=True)
+        odd_means, even_means = np.where(valid, odd_means, 0), np.where(valid, even_means, 0)
+        odd_centered = np.where(valid, odd_means - odd_means.sum(axis=1, keepdims=True) / facets, 0)
+        even_centered = np.where(valid, even_means - even_means.sum(axis=1, keepdims=True) / facets, 0)
+        correlation = (odd_centered * even_centered).sum(axis=1) / np.sqrt(
+            (odd_centered ** 2).sum(axis=1) * (even_centered ** 2).sum(axis=1))
+        consistency = 2 * correlation / (1 + correlation)
+    return np.where((facets[:, 0] >= MIN_CONSISTENCY_FACETS) & np.isfinite(consistency), consistency, np.nan)
+
+def add_to_quality_reference(scoring_key, answers, reference=None, block_size=QUALITY_BLOCK_SIZE):
+    """
+    Adds answers to the reference of the Mahalanobis distance: the sums over respondents
+    from which the item means and covariances are computed (see get_reference_covariance).
+    The sums are exact, so a reference built from the blocks of an export is the same as
+    one built from the whole export.
+
+    Args:
+        scoring_key (dict): Output of compile_NEO_IPIP_key, with the items in the order they
+            were asked.
+        answers (ndarray): uint8 answer codes (1-5, 0 for a missing answer) in the order of
+            scoring_key['items'].
+        reference (dict): Reference to add to, or None to start a new one.
+        block_size (int): Respondents per block.
+
+    Returns:
+        reference (dict): 'items', 'respondents', and the per-item answer sums and answer
+            counts, and the item-by-item sums of products of answers ('answer_products'),
+            of answers and answered flags ('answer_presence') and of answered flags
+            ('presence_products').
+    """
+    items = len(scoring_key['items'])
+    if reference is None:
+        reference = {'items': list(scoring_key['items']), 'respondents': 0,
+                     'answer_sums': np.zeros(items), 'answer_counts': np.zeros(items),
+                     'answer_products': np.zeros((items, items)), 'answer_presence': np.zeros((items, items)),
+                     'presence_products': np.zeros((items, items))}
+    elif reference['items'] != list(scoring_key['items']):
+        raise ValueError("The answers do not have the items of the response quality reference.")
+    for start in range(0, len(answers), block_size):
+        # Products of whole numbers stay exact in floating point
+        values = answers[start:start + block_size].astype(np.float64)
+        answered = (values > 0).astype(np.float64)
+        reference['answer_sums'] += values.sum(axis=0)
+        reference['answer_counts'] += answered.sum(axis=0)
+        reference['answer_products'] += values.T @ values
+        reference['answer_presence'] += values.T @ answered
+        reference['presence_products'] += answered.T @ answered
+    reference['respondents'] += len(answers)
+    return reference
+
+def get_reference_covariance(reference):
+    """
+    Returns the item means of a quality reference and the inverse of the covariance of its
+    answers, with missing answers at the item mean; the inverse is None unless the reference
+    has more respondents than items.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        item_means = np.nan_to_num(reference['answer_sums'] / reference['answer_counts'])
+    if reference['respondents'] <= len(item_means):
+        return item_means, None
+    # Sums of products of the answers minus the item means, over the answers given to both items
+    cross_products = (reference['answer_products'] - reference['answer_presence'] * item_means[None, :]
+                      - reference['answer_presence'].T * item_means[:, None]
+                      + reference['presence_products'] * np.outer(item_means, item_means))
+    return item_means, np.linalg.pinv(cross_products / (reference['respondents'] - 1), hermitian=True)
+
+def get_response_quality(scoring_key, answers, response_seconds, block_size=QUALITY_BLOCK_SIZE, reference=None):
+    """
+    Computes the response quality metrics of a cohort from its item answers, over blocks of
+    respondents.
+
+    Args:
+        scoring_key (dict): Output of compile_NEO_IPIP_key, with the items in the order they
+            were asked.
+        answers (ndarray): uint8 answer codes (1-5, 0 for a missing answer) in the order of
+            scoring_key['items'].
+        response_seconds (ndarray): Time each respondent took to answer, in seconds.
+        block_size (int): Respondents per block.
+        reference (dict): Output of add_to_quality_reference for the respondents the
+            Mahalanobis distance is measured against, e.g. the whole export the cohort comes
+            from. By default, the cohort itself.
+
+    Returns:
+        quality (dict): One array per field of QUALITY_FIELDS:
+            'Response Variance': standard deviation of the answers times 10, rounded;
+            'Longest String': longest run of identical answers;
+            'Even-Odd Consistency': see get_even_odd_consistency, rounded to 2 decimals;
+            'Mahalanobis Distance': distance of the answers from the reference's mean answers,
+                rounded to 1 decimal; NaN unless the reference has more respondents than items;
+            'Seconds per Item': response time per answered item, rounded to 1 decimal.
+    """
+    respondents, items = answers.shape
+    # Odd and even items of each facet, counted in the order they were asked
+    facet_position = np.cumsum(scoring_key['item_facet'], axis=0) * scoring_key['item_facet']
+    odd_facet = (facet_position % 2 == 1).astype(np.float64)
+    even_facet = ((facet_position > 0) & (facet_position % 2 == 0)).astype(np.float64)
+    blocks = [slice(start, start + block_size) for start in range(0, respondents, block_size)]
+
+    if reference is None:
+        reference = add_to_quality_reference(scoring_key, answers, block_size=block_size)
+    item_means, inverse_covariance = get_reference_covariance(reference)
+
+    quality = {field: np.full(respondents, np.nan) for field in QUALITY_FIELDS}
+    quality['Longest String'] = np.zeros(respondents, dtype=np.int64)
+    for block in blocks:
+        block_answers = answers[block]
+        answered = (block_answers > 0).astype(np.float64)
+        answer_values = block_answers.astype(np.float64)
+        answer_count = answered.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = answer_values.sum(axis=1) / answer_count
+            variance = ((answer_values - mean[:, None]) ** 2 * answered).sum(axis=1) / (answer_count - 1)
+            quality['Response Variance'][block] = np.where(answer_count > 1, np.round(np.sqrt(variance) * 10, 0), np.nan)
+            quality['Seconds per Item'][block] = np.round(response_seconds[block] / answer_count, 1)
+        quality['Longest String'][block] = get_longest_string(block_answers)
+
+        recoded = np.where(scoring_key['reverse'] & (block_answers > 0), 6.0 - answer_values, answer_values)
+        quality['Even-Odd Consistency'][block] = np.round(get_even_odd_consistency(recoded, answered, odd_facet, even_facet), 2)
+
+        if inverse_covariance is not None:
+            centered = np.where(block_answers > 0, answer_values - item_means, 0)
+            squared_distance = ((centered @ inverse_covariance) * centered).sum(axis=1)
+            quality['Mahalanobis Distance'][block] = np.round(np.sqrt(np.maximum(squared_distance, 0)), 1)
+    quality['Seconds per Item'][~np.isfinite(quality['Seconds per Item'])] = np.nan
+    return quality
+
+def get_quality_answers(parent_directory, survey_data_numeric, likert_responses=None):
+    """
+    Returns the NEO IPIP scoring key of the personality responses with the items in the order
+    they were asked, and the uint8 answer codes in that order, taken from likert_responses
+    (see get_numeric_responses) when given.
+    """
+    codebook_form = get_NEO_IPIP_form_codebook(get_personality_codebook(parent_directory), survey_data_numeric)
+    scoring_key = compile_NEO_IPIP_key(codebook_form, survey_data_numeric.columns)
+
+    # Items in the order they were asked, for the longest string and the even-odd halves
+    order = np.argsort(survey_data_numeric.columns.get_indexer(scoring_key['items']), kind='stable')
+    scoring_key = dict(scoring_key, items=[scoring_key['items'][n] for n in order],
+                       reverse=scoring_key['reverse'][order], item_facet=scoring_key['item_facet'][order])
+    item_data = survey_data_numeric[scoring_key['items']].copy()
+    decode_blank_items(item_data, scoring_key['items'])
+    answers = get_item_matrix(item_data, scoring_key['items'], likert_responses)
+    if answers.dtype != np.uint8:
+        answers = np.nan_to_num(answers).astype(np.uint8)
+    return scoring_key, answers
+
+def update_quality_reference(parent_directory, survey_data_numeric, reference=None, likert_responses=None):
+    """
+    Adds personality survey responses (e.g. a block of an export) to a response quality
+    reference (see add_to_quality_reference), or starts one.
+    """
+    scoring_key, answers = get_quality_answers(parent_directory, survey_data_numeric, likert_responses)
+    return add_to_quality_reference(scoring_key, answers, reference)
+
+def score_response_quality(parent_directory, survey_data_test_info, survey_data_numeric, reference=None, likert_responses=None):
+    """
+    Scores the response quality of the personality survey responses of one export or block.
+
+    Args:
+        parent_directory (str or Path): Parent folder for the repository.
+        survey_data_test_info (DataFrame): Test information with a 'Response Seconds' column
+            (see split_survey_info_numeric_data).
+        survey_data_numeric (DataFrame): Numeric responses, before recode_NEO_IPIP reverse codes them.
+        reference (dict): Response quality reference of the whole export (see
+            update_quality_reference), so that the Mahalanobis distances do not depend on
+            which of its responses are scored together. By default, the responses given.
+        likert_responses (dict): Decoded answers of the responses (see get_numeric_responses),
+            to take the item answers from; by default, the columns of survey_data_numeric.
+
+    Returns:
+        quality_df (DataFrame): The QUALITY_FIELDS columns (see get_response_quality).
+    """
+    scoring_key, answers = get_quality_answers(parent_directory, survey_data_numeric, likert_responses)
+    quality = get_response_quality(scoring_key, answers, survey_data_test_info['Response Seconds'].to_numpy(dtype=float),
+                                   reference=reference)
+    return pd.DataFrame(quality, index=survey_data_numeric.index)[QUALITY_FIELDS]
@@ -0,0 +1,86 @@
+import json
+import pandas as pd
+from pathlib import Path
+
+# parquet files need pyarrow, which is optional; without it tables are stored as pickles
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+def write_table(table, file_path):
+    """
+    Writes a DataFrame to a columnar parquet file, or to a pickle if pyarrow is not installed.
+
+    Args:
+        table (DataFrame): Table to write. Column names must be strings.
+        file_path (str or Path): Path without suffix; '.parquet' or '.pkl' is added.
+
+    Returns:
+        file_path (Path): Path of the written file.
+    """
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    if PARQUET_AVAILABLE:
+        file_path = file_path.with_name(file_path.name + '.parquet')
+        table.to_parquet(file_path)
+    else:
+        file_path = file_path.with_name(file_path.name + '.pkl')
+        table.to_pickle(file_path)
+    return file_path
+
+def read_table(file_path, columns=None):
+    """
+    Reads a table written by write_table, optionally only some of its columns.
+    """
+    file_path = Path(file_path)
+    if file_path.suffix == '.parquet':
+        return pd.read_parquet(file_path, columns=columns)
+    table = pd.read_pickle(file_path)
+    return table if columns is None else table[columns]
+
+def list_tables(directory):
+    """
+    Returns the tables written by write_table in a directory, sorted by file name.
+    """
+    directory = Path(directory)
+    if not directory.exists():
+        return []
+    return sorted(p for p in directory.iterdir() if p.suffix in ('.parquet', '.pkl'))
+
+def write_result_block(results_directory, block_number, scored_block):
+    """
+    Writes the scores of one block of respondents as 'block_<number>' in the results directory.
+    """
+    return write_table(scored_block, Path(results_directory) / f"block_{block_number:06d}")
+
+def read_results(results_directory, columns=None):
+    """
+    Reads all result blocks of a results directory into one DataFrame.
+
+    Args:
+        results_directory (str or Path): Directory written by write_result_block.
+        columns (list): Columns to read; all columns by default.
+    """
+    blocks = [read_table(p, columns=columns) for p in list_tables(results_directory)]
+    if not blocks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(blocks)
+
+def write_results_info(results_directory, info):
+    """
+    Writes what the result blocks of an export were scored from (export path, survey type,
+    item number, ...) as 'export.json' in the results directory, so that their reports can be
+    rendered later without scoring the export again.
+    """
+    results_directory = Path(results_directory)
+    results_directory.mkdir(parents=True, exist_ok=True)
+    (results_directory / 'export.json').write_text(json.dumps(info, indent=2))
+
+def read_results_info(results_directory):
+    """
+    Returns the information written by write_results_info, or None if there is none.
+    """
+    info_file = Path(results_directory) / 'export.json'
+    return json.loads(info_file.read_text()) if info_file.exists() else None
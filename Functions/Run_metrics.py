@@ -0,0 +1,192 @@
+import os
+import csv
+import json
+import time
+import cProfile
+import tracemalloc
+import multiprocessing
+from contextlib import contextmanager
+from pathlib import Path
+
+# Environment variables that switch on the run metrics and the cProfile dump. The metrics
+# switch is inherited by worker processes, which then collect metrics as well
+METRICS_ENVIRONMENT_VARIABLE = 'SURVEY_REPORT_METRICS'
+PROFILE_ENVIRONMENT_VARIABLE = 'SURVEY_REPORT_PROFILE'
+# Upper bucket edges of the histograms, in seconds
+HISTOGRAM_EDGES = [0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, float('inf')]
+
+# Metrics of this process; None while metrics are off
+_metrics = None
+
+def start_run_metrics(profile=False):
+    """
+    Switches on the collection of run metrics in this process, and in worker processes
+    started afterwards. Memory is traced with tracemalloc, which slows the run down.
+
+    Args:
+        profile (bool): Also run cProfile over the whole run.
+    """
+    global _metrics
+    os.environ[METRICS_ENVIRONMENT_VARIABLE] = '1'
+    if _metrics is None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _metrics = {'started': time.time(), 'start': time.perf_counter(), 'stages': {}, 'histograms': {},
+                    'open_stages': [], 'peak': 0, 'profiler': None}
+    if profile and _metrics['profiler'] is None:
+        _metrics['profiler'] = cProfile.Profile()
+        _metrics['profiler'].enable()
+
+def metrics_enabled():
+    """
+    Returns whether run metrics are collected in this process.
+    """
+    return _metrics is not None
+
+@contextmanager
+def _stage_off(name, rows=None):
+    yield {}
+
+@contextmanager
+def _stage_on(name, rows=None):
+    span = {'rows': rows}
+    open_stages = _metrics['open_stages']
+    # The peak of a stage includes the peaks of the stages inside it
+    if open_stages:
+        open_stages[-1]['peak'] = max(open_stages[-1]['peak'], tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+    current = tracemalloc.get_traced_memory()[0]
+    frame = {'peak': current}
+    open_stages.append(frame)
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        seconds = time.perf_counter() - start
+        open_stages.pop()
+        peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+        if open_stages:
+            open_stages[-1]['peak'] = max(open_stages[-1]['peak'], peak)
+        _metrics['peak'] = max(_metrics['peak'], peak)
+        totals = _metrics['stages'].setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                                      'rows': 0, 'peak_bytes': 0})
+        totals['calls'] += 1
+        totals['seconds'] += seconds
+        totals['max_seconds'] = max(totals['max_seconds'], seconds)
+        totals['rows'] += span['rows'] or 0
+        totals['peak_bytes'] = max(totals['peak_bytes'], peak - current)
+
+def stage(name, rows=None):
+    """
+    Measures a stage of the run: wall time, peak traced memory above the memory in use when
+    the stage starts, and the number of rows processed, which can also be set while the
+    stage runs ('with stage(name) as span: ... span["rows"] = len(data)').
+
+    Repeated stages with the same name are added up. While metrics are off, this costs
+    little more than an empty 'with' block.
+    """
+    if _metrics is None:
+        return _stage_off(name)
+    return _stage_on(name, rows)
+
+def record_values(name, values):
+    """
+    Adds values (e.g. the render time of each report, in seconds) to a histogram of the run.
+    """
+    if _metrics is None:
+        return
+    histogram = _metrics['histograms'].setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0,
+                                                         'buckets': [0] * len(HISTOGRAM_EDGES)})
+    for value in values:
+        if value is None:
+            continue
+        histogram['count'] += 1
+        histogram['sum'] += value
+        histogram['max'] = max(histogram['max'], value)
+        histogram['buckets'][next(n for n, edge in enumerate(HISTOGRAM_EDGES) if value <= edge)] += 1
+
+def take_run_metrics():
+    """
+    Returns the stage totals and histograms collected so far and clears them, e.g. to send
+    the metrics of a worker process back to the main process. None while metrics are off.
+    """
+    if _metrics is None:
+        return None
+    taken = {'stages': _metrics['stages'], 'histograms': _metrics['histograms']}
+    _metrics['stages'], _metrics['histograms'] = {}, {}
+    return taken
+
+def merge_run_metrics(taken):
+    """
+    Adds metrics returned by take_run_metrics (e.g. in a worker process) to those of this process.
+    """
+    if _metrics is None or taken is None:
+        return
+    for name, totals in taken['stages'].items():
+        merged = _metrics['stages'].setdefault(name, dict.fromkeys(totals, 0))
+        for field, value in totals.items():
+            merged[field] = max(merged[field], value) if field in ('max_seconds', 'peak_bytes') else merged[field] + value
+    for name, histogram in taken['histograms'].items():
+        merged = _metrics['histograms'].setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0,
+                                                          'buckets': [0] * len(HISTOGRAM_EDGES)})
+        merged['count'] += histogram['count']
+        merged['sum'] += histogram['sum']
+        merged['max'] = max(merged['max'], histogram['max'])
+        merged['buckets'] = [a + b for a, b in zip(merged['buckets'], histogram['buckets'])]
+
+def finish_run_metrics(metrics_directory):
+    """
+    Writes the run summary: 'run_<time>.json' with the stage totals (calls, seconds, rows per
+    second, peak memory) and histograms, 'run_<time>.csv' with one row per stage, and
+    'run_<time>.prof' with the cProfile statistics if profiling was on (read it with pstats
+    or snakeviz). Metrics are switched off afterwards.
+
+    Args:
+        metrics_directory (str or Path): Folder of the run summaries.
+
+    Returns:
+        summary_file (Path): Path of the JSON summary, or None if metrics were off.
+    """
+    global _metrics
+    if _metrics is None:
+        return None
+    metrics, _metrics = _metrics, None
+    if metrics['profiler'] is not None:
+        metrics['profiler'].disable()
+    os.environ.pop(METRICS_ENVIRONMENT_VARIABLE, None)
+
+    stages = []
+    for name, totals in metrics['stages'].items():
+        stages.append(dict(stage=name, **totals, rows_per_second=totals['rows'] / totals['seconds']
+                           if totals['rows'] and totals['seconds'] > 0 else None))
+    histograms = {name: dict(histogram, bucket_edges=[str(edge) for edge in HISTOGRAM_EDGES],
+                             mean=histogram['sum'] / histogram['count'] if histogram['count'] else None)
+                  for name, histogram in metrics['histograms'].items()}
+    summary = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(metrics['started'])),
+        'seconds': time.perf_counter() - metrics['start'],
+        'peak_traced_bytes': max(metrics['peak'], tracemalloc.get_traced_memory()[1]),
+        'stages': stages,
+        'histograms': histograms,
+    }
+    tracemalloc.stop()
+
+    metrics_directory = Path(metrics_directory)
+    metrics_directory.mkdir(parents=True, exist_ok=True)
+    run_name = f"run_{time.strftime('%Y%m%d-%H%M%S', time.localtime(metrics['started']))}"
+    summary_file = metrics_directory / f"{run_name}.json"
+    summary_file.write_text(json.dumps(summary, indent=2))
+    with open(metrics_directory / f"{run_name}.csv", 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['stage', 'calls', 'seconds', 'max_seconds', 'rows',
+                                               'rows_per_second', 'peak_bytes'])
+        writer.writeheader()
+        writer.writerows(stages)
+    if metrics['profiler'] is not None:
+        metrics['profiler'].dump_stats(metrics_directory / f"{run_name}.prof")
+    return summary_file
+
+# Worker processes inherit the switch from the process that started them; only the main
+# process is profiled
+if os.environ.get(METRICS_ENVIRONMENT_VARIABLE):
+    start_run_metrics(profile=bool(os.environ.get(PROFILE_ENVIRONMENT_VARIABLE))
+                      and multiprocessing.parent_process() is None)
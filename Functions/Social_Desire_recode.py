@@ -1,5 +1,7 @@
 import pandas as pd
-from pathlib import Path
+import numpy as np
+
+from Functions.Codebook_loader import get_personality_codebook
 
 def recode_SDS(parent_directory, survey_data):
     """
@@ -12,12 +14,11 @@ def recode_SDS(parent_directory, survey_data):
     Returns:
         SDS_df (DataFrame): DataFrame with the computed social desirability score.
     """
-    project_path = Path(parent_directory).parent
-    codebook_directory = project_path / 'IPIP'
-    codebook_file = codebook_directory / 'Personality Item Key.xlsx'
-    if not codebook_file.exists():
-        raise FileNotFoundError(f"Codebook not found: {codebook_file}")
-    codebook = pd.read_excel(codebook_file, sheet_name='Social_Desirability')
+    codebook = get_personality_codebook(parent_directory)['Social_Desirability']
     survey_data_SDS_slice = survey_data[survey_data.columns.intersection(codebook.Item.unique())]
-    SDS_df = pd.DataFrame({'Social Desirability Score': survey_data_SDS_slice.sum(axis=1)}, index=survey_data.index)
+    SDS_score = survey_data_SDS_slice.sum(axis=1)
+    # Sums of uint8 answer codes come back as uint64
+    if pd.api.types.is_unsigned_integer_dtype(SDS_score):
+        SDS_score = SDS_score.astype(np.int64)
+    SDS_df = pd.DataFrame({'Social Desirability Score': SDS_score}, index=survey_data.index)
     return SDS_df
@@ -0,0 +1,169 @@
+import datetime
+import numpy as np
+import pandas as pd
+import openpyxl
+from pathlib import Path
+
+from Functions.Response_decoder import LIKERT_LABELS
+from Functions.ICAR_recode import compile_ICAR_key, score_ICAR
+
+# Facets of the IPIP-NEO by key letter, in the order of their key numbers
+NEO_FACETS = {
+    'N': ['Anxiety', 'Anger', 'Depression', 'Self-Consciousness', 'Immoderation', 'Vulnerability'],
+    'E': ['Friendliness', 'Gregariousness', 'Assertiveness', 'Activity Level', 'Excitement-Seeking', 'Cheerfulness'],
+    'O': ['Imagination', 'Artistic Interests', 'Emotionality', 'Adventurousness', 'Intellect', 'Liberalism'],
+    'A': ['Trust', 'Morality', 'Altruism', 'Cooperation', 'Modesty', 'Sympathy'],
+    'C': ['Self-Efficacy', 'Orderliness', 'Dutifulness', 'Achievement-Striving', 'Self-Discipline', 'Cautiousness'],
+}
+# ICAR dimensions with their item name prefix and number of ICAR 60 items; the first four
+# items of each dimension make up the ICAR 16
+ICAR_DIMENSIONS = [('Verbal Reasoning', 'VR', 16), ('Letter-Number Series', 'LN', 9),
+                   ('Matrix Reasoning', 'MR', 11), ('Three-Dimensional Rotation', 'R3D', 24)]
+ICAR_OPTIONS = ['A', 'B', 'C', 'D', 'E', 'F']
+# Test information columns of a SurveyMonkey export: first header row, then second header row
+EXPORT_HEADER = (
+    ['Respondent ID', 'Collector ID', 'Start Date', 'End Date', 'IP Address', 'Email Address', 'First Name',
+     'Last Name', 'Custom Data 1', 'Contact Info', None, None, None, None, 'Gender'],
+    [None] * 9 + ['First name', 'Last name', 'Email address', 'Middle name', None, 'Response'],
+)
+
+def get_synthetic_personality_item_key(sds_items=10, seed=0):
+    """
+    Returns a synthetic 'Personality Item Key.xlsx' with the layout of the real one: 300 items
+    cycling through the 30 facets, the first 120 of which make up the short form, with about
+    40% reverse-keyed items, and a social desirability sheet.
+
+    Returns:
+        sheets (dict): 'IPIP-NEO-ItemKey' and 'Social_Desirability' DataFrames.
+    """
+    rng = np.random.default_rng(seed)
+    keys = [(letter, number, facet) for letter, facets in NEO_FACETS.items() for number, facet in enumerate(facets, 1)]
+    rows = []
+    for n in range(300):
+        letter, number, facet = keys[n % len(keys)]
+        rows.append({'Full#': n + 1, 'Short#': n + 1 if n < 120 else np.nan, 'Key': f"{letter}{number}",
+                     'Sign': '-' if rng.random() < 0.4 else '+', 'Facet': facet, 'Item': f"Synthetic item {n + 1}."})
+    return {
+        'IPIP-NEO-ItemKey': pd.DataFrame(rows),
+        'Social_Desirability': pd.DataFrame({'Item': [f"Synthetic desirability item {n + 1}." for n in range(sds_items)]}),
+    }
+
+def get_synthetic_icar_item_key(seed=0):
+    """
+    Returns a synthetic 'ICAR Item Key.xlsx' with a 'dimension', an 'ICAR60' and an 'ICAR16'
+    item name column and the correct 'answer' of each item.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for dimension, prefix, items in ICAR_DIMENSIONS:
+        for n in range(items):
+            rows.append({'dimension': dimension, 'ICAR60': f"{prefix}.{n + 1}",
+                         'ICAR16': f"{prefix}.{n + 1}" if n < 4 else np.nan, 'answer': rng.choice(ICAR_OPTIONS)})
+    return pd.DataFrame(rows)
+
+def get_synthetic_icar_norm_data(codebook, respondents=5000, seed=0):
+    """
+    Returns a synthetic ICAR norm table ('ICAR_Norm_Data.csv'): the age and the ICAR scores of
+    norm respondents who each answered a random subset of the items, as in the SAPA data.
+    """
+    rng = np.random.default_rng(seed)
+    ability = rng.normal(size=(respondents, 1))
+    correct = (rng.normal(size=(respondents, len(codebook))) + ability > 0).astype(np.float64)
+    correct[rng.random(correct.shape) < 0.6] = np.nan
+    scoring_key = compile_ICAR_key(codebook, 'ICAR60', pd.Index(codebook['ICAR60']))
+    scores = pd.DataFrame(score_ICAR(scoring_key, correct), columns=scoring_key['scores'])
+    scores.insert(0, 'age', rng.integers(14, 90, respondents))
+    return scores
+
+def write_synthetic_codebooks(root_directory, seed=0):
+    """
+    Writes the synthetic item keys and ICAR norm table where the pipeline looks for them:
+    'IPIP/Personality Item Key.xlsx', 'ICAR/ICAR Item Key.xlsx' and 'ICAR/ICAR_Norm_Data.csv'
+    in the root directory. Existing files are kept.
+    """
+    root_directory = Path(root_directory)
+    personality_key_file = root_directory / 'IPIP' / 'Personality Item Key.xlsx'
+    if not personality_key_file.exists():
+        personality_key_file.parent.mkdir(parents=True, exist_ok=True)
+        with pd.ExcelWriter(personality_key_file) as writer:
+            for sheet_name, sheet in get_synthetic_personality_item_key(seed=seed).items():
+                sheet.to_excel(writer, sheet_name=sheet_name, index=False)
+
+    icar_key_file = root_directory / 'ICAR' / 'ICAR Item Key.xlsx'
+    icar_codebook = get_synthetic_icar_item_key(seed=seed)
+    if not icar_key_file.exists():
+        icar_key_file.parent.mkdir(parents=True, exist_ok=True)
+        icar_codebook.to_excel(icar_key_file, index=False)
+    norm_file = root_directory / 'ICAR' / 'ICAR_Norm_Data.csv'
+    if not norm_file.exists():
+        get_synthetic_icar_norm_data(icar_codebook, seed=seed).to_csv(norm_file, index=False)
+
+def get_synthetic_answers(survey_type, rows, seed=0):
+    """
+    Returns the item names of a survey form and synthetic answers of a number of respondents.
+
+    Personality answers are Likert labels around a tendency of each respondent, with 1%
+    missing; cognitive answers are correct more often for more able respondents, with 5% missing.
+    """
+    rng = np.random.default_rng(seed)
+    if survey_type.startswith('ICAR'):
+        codebook = get_synthetic_icar_item_key(seed=seed)
+        if survey_type == 'ICAR 16':
+            codebook = codebook.dropna(subset=['ICAR16'])
+        answers = codebook['answer'].to_numpy(dtype=object)
+        correct = rng.normal(size=(rows, 1)) + rng.normal(size=(rows, len(answers))) > 0
+        wrong = np.asarray(ICAR_OPTIONS, dtype=object)[rng.integers(0, len(ICAR_OPTIONS), (rows, len(answers)))]
+        values = np.where(correct, answers, wrong)
+        values[rng.random(values.shape) < 0.05] = None
+        return list(codebook['ICAR60']), values
+
+    item_key = get_synthetic_personality_item_key(seed=seed)
+    items = list(item_key['IPIP-NEO-ItemKey']['Item'][:120 if survey_type == 'NEO-IPIP 120' else 300])
+    items += list(item_key['Social_Desirability']['Item'])
+    codes = np.clip(np.rint(rng.normal(2, 0.7, size=(rows, 1)) + rng.normal(0, 1.1, size=(rows, len(items)))), 0, 4)
+    values = np.asarray(LIKERT_LABELS, dtype=object)[codes.astype(np.int64)]
+    values[rng.random(values.shape) < 0.01] = None
+    return items, values
+
+def write_synthetic_export(file_path, survey_type, rows, seed=0):
+    """
+    Writes a synthetic SurveyMonkey export of a survey form ('NEO-IPIP 120', 'NEO-IPIP 300',
+    'ICAR 16' or 'ICAR 60'), with the two header rows and test information columns of a real
+    export. Cognitive exports also have an 'Age' column, name each item by its
+    question in the first header row and label it 'Response' in the second.
+
+    Args:
+        file_path (str or Path): Path of the xlsx file.
+        survey_type (str): Survey form.
+        rows (int): Number of respondents.
+        seed (int): Seed of the random answers; the same seed gives the same export.
+    """
+    rng = np.random.default_rng(seed + 1)
+    items, values = get_synthetic_answers(survey_type, rows, seed=seed)
+    cognitive = survey_type.startswith('ICAR')
+    first_row, second_row = list(EXPORT_HEADER[0]), list(EXPORT_HEADER[1])
+    if cognitive:
+        first_row += ['Age'] + list(items)
+        second_row += ['Age'] + ['Response'] * len(items)
+    else:
+        first_row += [survey_type] + [None] * (len(items) - 1)
+        second_row += items
+
+    start_dates = datetime.datetime(2024, 1, 1, 9, 0) + pd.to_timedelta(np.arange(rows), unit='min')
+    minutes = rng.integers(10, 60, rows)
+    ages = rng.integers(16, 80, rows)
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(first_row)
+    sheet.append(second_row)
+    for n in range(rows):
+        start = start_dates[n].to_pydatetime()
+        row = [100000000 + n, 1, start, start + datetime.timedelta(minutes=int(minutes[n])), f"10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}",
+               None, None, None, None, f"First{n}", f"Last{n}", f"respondent{n}@example.org", None, None, 1]
+        if cognitive:
+            row.append(int(ages[n]))
+        row += values[n].tolist()
+        sheet.append(row)
+    Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+    workbook.save(file_path)
@@ -1,13 +1,43 @@
 #!/usr/bin/env python3
 """
-Updated ICAR_norm_data.py: Processes norm data for ICAR tests using robust path handling,
-error checking, and without extraneous debug calls.
+Builds the ICAR norm table from the SAPA ICAR 60 norm data.
+
+Only the age and ICAR 60 item columns of the norm data are read, with typed columns. All
+dimension, '_60' and total scores are then computed in one matrix product of the
+respondent-by-item matrix with the compiled item key (see compile_ICAR_key and score_ICAR).
+The table is saved as 'ICAR/ICAR_Norm_Data.csv' with a binary copy, and the age-banded norm
+index used for the percentile lookups is rebuilt.
 """
 
 import pandas as pd
 import numpy as np
 from pathlib import Path
-from scipy import stats
+
+from Functions.Codebook_loader import get_cognitive_codebook
+from Functions.ICAR_norms import get_icar_norm_index
+from Functions.ICAR_recode import compile_ICAR_key, score_ICAR
+from Functions.Results_store import PARQUET_AVAILABLE, write_table
+
+def read_icar_norm_file(norm_file, codebook_all, item_column):
+    """
+    Reads the 'age' column and the ICAR item columns of a SAPA norm data file.
+
+    Only the needed columns are parsed, with the items as float32 (NaN when not administered),
+    using the pyarrow CSV engine when it is installed.
+
+    Returns:
+        age (Series): Age of each respondent.
+        item_matrix (ndarray): Respondent-by-item scores in the order of scoring_key['items'].
+        scoring_key (dict): Output of compile_ICAR_key for the items found in the file.
+    """
+    if not norm_file.exists():
+        raise FileNotFoundError(f"ICAR norm data file not found: {norm_file}")
+    header = pd.read_csv(norm_file, nrows=0).columns
+    scoring_key = compile_ICAR_key(codebook_all, item_column, header)
+    norm_data = pd.read_csv(norm_file, usecols=['age'] + scoring_key['items'],
+                            dtype={item: np.float32 for item in scoring_key['items']},
+                            engine='pyarrow' if PARQUET_AVAILABLE else 'c')
+    return norm_data['age'], norm_data[scoring_key['items']].to_numpy(), scoring_key
 
 def process_icar_norm_data():
     code_directory = Path.cwd()
@@ -16,63 +46,23 @@ def process_icar_norm_data():
     project_path = parent_directory.parent
     codebook_directory = project_path / 'ICAR'
 
-    ICAR16_norm_path = project_path / 'ICAR' / 'ICAR16' / 'ICAR 16 norm data'
     ICAR60_norm_path = project_path / 'ICAR' / 'ICAR60' / 'ICAR 60 norm data'
-
-    ICAR16_norm_raw_data_path = 'sapaICARData18aug2010thru20may2013.csv'
     ICAR60_norm_raw_data_path = 'sapaData20may2013thru10jun2014.csv'
 
-    # Check that the codebook exists
-    codebook_file = codebook_directory / 'ICAR Item Key.xlsx'
-    if not codebook_file.exists():
-        raise FileNotFoundError(f"Codebook not found: {codebook_file}")
-    codebook_all = pd.read_excel(codebook_file)
-    
-    # Process ICAR 16 norm data
-    icar16_file = ICAR16_norm_path / ICAR16_norm_raw_data_path
-    if not icar16_file.exists():
-        raise FileNotFoundError(f"ICAR16 raw data file not found: {icar16_file}")
-    ICAR_16_Norm_data = pd.read_csv(icar16_file, low_memory=False)
-    
-    for d in codebook_all.dimension.unique():
-        # ICAR 16 calculation for each dimension
-        dimension_column_names = codebook_all[codebook_all.dimension == d]['ICAR16'].unique()
-        ICAR_16_Norm_data_slice = ICAR_16_Norm_data[ICAR_16_Norm_data.columns.intersection(dimension_column_names)]
-        dimension_df = pd.DataFrame({d: ICAR_16_Norm_data_slice.sum(axis=1)}, index=ICAR_16_Norm_data_slice.index)
-        # ICAR 60 calculation based on ICAR16 data
-        dimension_column_names_60 = codebook_all[codebook_all.dimension == d]['ICAR60_original'].unique()
-        ICAR_16_Norm_data_slice_60 = ICAR_16_Norm_data[ICAR_16_Norm_data.columns.intersection(dimension_column_names_60)]
-        dimension_df_60 = pd.DataFrame({f'{d}_60': ICAR_16_Norm_data_slice_60.sum(axis=1) * (len(dimension_column_names_60) / 4)},
-                                       index=ICAR_16_Norm_data_slice_60.index)
-        ICAR_16_Norm_data = pd.concat([ICAR_16_Norm_data, dimension_df, dimension_df_60], axis=1)
-
-    # Compute total scores for ICAR16 and adjusted ICAR60
-    ICAR_16_Norm_data['ICAR16_Total'] = ICAR_16_Norm_data[codebook_all.dimension.unique()].sum(axis=1)
-    ICAR_16_Norm_data['ICAR60_Total'] = ICAR_16_Norm_data[[f"{x}_60" for x in codebook_all.dimension.unique()]].sum(axis=1)
-
-    # Process ICAR 60 norm data
-    icar60_file = ICAR60_norm_path / ICAR60_norm_raw_data_path
-    if not icar60_file.exists():
-        raise FileNotFoundError(f"ICAR60 raw data file not found: {icar60_file}")
-    ICAR_60_Norm_data = pd.read_csv(icar60_file, low_memory=False)
-    columns_ICAR60 = list(codebook_all.ICAR60.unique())
-    ICAR_60_Norm_data['ICAR16_Total'] = ICAR_60_Norm_data[ICAR_60_Norm_data.columns.intersection(columns_ICAR60)].sum(axis=1)
-    
-    for d in codebook_all.dimension.unique():
-        dimension_column_names = codebook_all[codebook_all.dimension == d]['ICAR60'].unique()
-        ICAR_60_Norm_data_slice = ICAR_60_Norm_data[ICAR_60_Norm_data.columns.intersection(dimension_column_names)]
-        dimension_df = pd.DataFrame({d: ICAR_60_Norm_data_slice.sum(axis=1)}, index=ICAR_60_Norm_data_slice.index)
-        dimension_df_60 = pd.DataFrame({f'{d}_60': ICAR_60_Norm_data_slice.sum(axis=1) * (len(dimension_column_names) / 4)},
-                                       index=ICAR_60_Norm_data_slice.index)
-        ICAR_60_Norm_data = pd.concat([ICAR_60_Norm_data, dimension_df, dimension_df_60], axis=1)
+    codebook_all = get_cognitive_codebook(parent_directory)
 
-    ICAR_60_Norm_data['ICAR60_Total'] = ICAR_60_Norm_data[[f"{x}_60" for x in codebook_all.dimension.unique()]].sum(axis=1)
-    
-    norm_data_columns = ['age'] + ['ICAR16_Total'] + ['ICAR60_Total'] + list(codebook_all.dimension.unique()) + [f"{x}_60" for x in codebook_all.dimension.unique()]
-    ICAR_Norm_data_use = ICAR_60_Norm_data[norm_data_columns]
+    # Score the ICAR 60 norm data: dimension, '_60' and total scores in one matrix product
+    age, item_matrix, scoring_key = read_icar_norm_file(
+        ICAR60_norm_path / ICAR60_norm_raw_data_path, codebook_all, 'ICAR60')
+    scores = pd.DataFrame(score_ICAR(scoring_key, item_matrix), index=age.index, columns=scoring_key['scores'])
+    ICAR_Norm_data_use = pd.concat([age, scores], axis=1)
 
     output_path = codebook_directory / 'ICAR_Norm_Data.csv'
     ICAR_Norm_data_use.to_csv(output_path, index=False)
+    # Binary copy of the norm table, for fast loading
+    write_table(ICAR_Norm_data_use, codebook_directory / 'ICAR_Norm_Data')
+    # Age-banded index of the sorted norm scores, for percentile lookups (see lookup_icar_norms)
+    get_icar_norm_index(parent_directory)
 
 if __name__ == '__main__':
     process_icar_norm_data()
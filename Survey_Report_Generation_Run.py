@@ -1,69 +1,187 @@
 #!/usr/bin/env python3
 """
-Updated Survey_Report_Generation_Run.py:
-Processes individual responses, recodes them, and generates PDF reports.
-The main logic is protected by a main guard.
+Command line of the survey report pipeline:
+
+    python Survey_Report_Generation_Run.py [run] [--batch | --chunked | --watch] [options]
+    python Survey_Report_Generation_Run.py score [--chunk-size N]
+    python Survey_Report_Generation_Run.py render [--export NAME] [options]
+    python Survey_Report_Generation_Run.py classify [--dry-run]
+    python Survey_Report_Generation_Run.py norms
+    python Survey_Report_Generation_Run.py population FORM [--cohort MONTH ...] [--score FIELD VALUE ...]
+
+Each command imports the modules it needs only when it runs, so '--help' and 'classify'
+start without pandas, and Plotly and Kaleido are only imported once reports are rendered.
+The run modes themselves are in Functions/Report_pipeline.py; they can still be used from
+this module, e.g. Survey_Report_Generation_Run.main(incremental=True).
 """
 
-import pandas as pd
+import sys
+import argparse
+import importlib
 from pathlib import Path
-import kaleido  # Ensure kaleido is installed and compatible
-
-from Functions.Get_data import get_survey_info_numeric_data
-from Functions.NEO_IPIP_recode import recode_NEO_IPIP
-from Functions.Social_Desire_recode import recode_SDS
-#from Functions.ICAR_recode import *  # Currently not in use
-from Functions.Personality_Report_Generation import personality_report_generation
-
-def main():
-    # Set up the working directory using pathlib
-    code_directory = Path.cwd()
-    parent_directory = code_directory.parent
-
-    # Retrieve both test info and numeric survey data
-    latest_survey_data_test_info, latest_survey_data_numeric = get_survey_info_numeric_data(parent_directory=parent_directory)
-
-    if len(latest_survey_data_numeric.columns) > 70:  # IPIP NEO 120 or NEO 300 survey
-        # Recode personality survey data
-        survey_data_numeric_calculate, survey_data_personality_score, codebook_all = recode_NEO_IPIP(
-            parent_directory=parent_directory, survey_data=latest_survey_data_numeric)
-        
-        # If the dataframe has a multi-index, flatten it
-        if hasattr(survey_data_numeric_calculate.columns, 'get_level_values'):
-            survey_data_numeric_calculate.columns = survey_data_numeric_calculate.columns.get_level_values(1)
-        
-        survey_data_SDS = recode_SDS(parent_directory=parent_directory, survey_data=latest_survey_data_numeric)
-        merge_cols = ['Full Name', 'Response Time', 'Completion Time', 'Email address', 'Response Variance']
-        survey_data_numeric_calculate_concat = pd.concat([
-            latest_survey_data_test_info[merge_cols],
-            survey_data_SDS,
-            survey_data_personality_score,
-            survey_data_numeric_calculate
-        ], axis=1)
-        
-        # Generate individual reports for each test taker
-        for name in survey_data_numeric_calculate_concat['Full Name'].unique():
-            original_individual_data = survey_data_numeric_calculate_concat[survey_data_numeric_calculate_concat['Full Name'] == name]
-            original_individual_data_t = original_individual_data.transpose()
-            # Use the first row as header
-            original_individual_data_t.columns = original_individual_data_t.iloc[0]
-            original_individual_data_t = original_individual_data_t.drop(original_individual_data_t.index[0])
-            original_individual_data_t['Facet'] = original_individual_data_t.index
-            # Merge with codebook to bring in Dimension and Facet information
-            original_individual_data_t_merge = original_individual_data_t.merge(
-                codebook_all[['Dimension', 'Facet']].drop_duplicates(), how='left', on='Facet')
-            
-            item_number = 120 if (len(latest_survey_data_numeric.columns) < 200) else 300
-            report = personality_report_generation(
-                test_taker_df=original_individual_data_t_merge, name=name, item_number=item_number)
-            
-            output_path = parent_directory / "Report" / f"Personality_Report_{name}.pdf"
-            report.write_image(str(output_path), engine='kaleido')
+
+# Module that runs each command, imported when the command starts
+COMMAND_MODULES = {
+    'run': 'Functions.Report_pipeline',
+    'score': 'Functions.Report_pipeline',
+    'render': 'Functions.Report_pipeline',
+    'classify': 'Functions.Export_inbox',
+    'norms': 'ICAR_norm_data',
+    'population': 'Functions.Population_store',
+}
+
+def load_command_module(command):
+    """
+    Imports the module that runs a command. Its import time is the cold start of the command,
+    which Benchmark_Run.py checks against a budget.
+    """
+    return importlib.import_module(COMMAND_MODULES[command])
+
+def get_render_options(arguments):
+    """
+    Returns the render options of a run as keyword arguments of the run modes.
+    """
+    return {
+        'render_workers': arguments.render_workers,
+        'packet_format': 'pdf' if arguments.pdf_packet else 'zip' if arguments.zip_packet else None,
+        'reports_per_packet': arguments.reports_per_file,
+        'report_cache': not arguments.no_report_cache,
+        'render_backend': 'native' if arguments.native_pdf else 'kaleido',
+    }
+
+def run_command(arguments):
+    pipeline = load_command_module('run')
+    if arguments.watch:
+        pipeline.main_watch(incremental=arguments.incremental, **get_render_options(arguments))
+    elif arguments.batch:
+        pipeline.main_batch(incremental=arguments.incremental, **get_render_options(arguments))
+    elif arguments.chunked:
+        pipeline.main_chunked(chunk_size=arguments.chunk_size, render=True, incremental=arguments.incremental,
+                              **get_render_options(arguments))
     else:
-        # Placeholder for handling ICAR data
-        print("ICAR survey handling not implemented yet.")
+        pipeline.main(incremental=arguments.incremental, **get_render_options(arguments))
 
-if __name__ == '__main__':
-    main()
+def score_command(arguments):
+    pipeline = load_command_module('score')
+    pipeline.main_chunked(chunk_size=arguments.chunk_size, render=False)
+
+def render_command(arguments):
+    pipeline = load_command_module('render')
+    pipeline.main_render(export_name=arguments.export, **get_render_options(arguments))
+
+def classify_command(arguments):
+    inbox = load_command_module('classify')
+    parent_directory = Path.cwd().parent
+    file_paths = inbox.get_pending_file_paths(parent_directory=parent_directory, sub_directory='Data')
+    if not file_paths:
+        print(f"No pending exports in {parent_directory / 'Data'}.")
+    for file_path in file_paths:
+        try:
+            survey_type = inbox.get_survey_type(inbox.get_header_column_count(file_path))
+            if not arguments.dry_run:
+                inbox.move_to_survey_folder(file_path, parent_directory / 'Data')
+        except Exception as e:
+            print(f"Skipping {file_path.name}: {e}")
+            continue
+        print(f"{file_path.name}: {survey_type}" + ('' if arguments.dry_run else f" (moved to Data/{survey_type})"))
+
+def norms_command(arguments):
+    load_command_module('norms').process_icar_norm_data()
+
+def population_command(arguments):
+    population = load_command_module('population')
+    store = population.open_population_store(Path.cwd().parent)
+    try:
+        summaries = population.get_population_summaries(store, arguments.form, cohorts=arguments.cohort)
+    finally:
+        population.close_population_store(store)
+    if not summaries:
+        print(f"No {arguments.form} respondents in the population store.")
+        return
+    print(f"{'score':<28}{'count':>8}{'mean':>9}{'sd':>8}{'min':>8}{'25%':>8}{'50%':>8}{'75%':>8}{'max':>8}")
+    for field, summary in summaries.items():
+        quartiles = population.get_population_quantiles(summary, [0.25, 0.5, 0.75])
+        print(f"{field:<28}{summary['count']:>8}{summary['mean']:>9.2f}{summary['std']:>8.2f}{summary['minimum']:>8g}"
+              + ''.join(f"{q:>8g}" for q in quartiles) + f"{summary['maximum']:>8g}")
+    for field, value in arguments.score or []:
+        if field not in summaries:
+            print(f"{field}: no population data")
+            continue
+        percentiles, z_scores = population.lookup_population_percentiles(summaries, [[float(value)]], [field])
+        print(f"{field} = {value}: percentile {percentiles[0, 0]:.1f}, z-score {z_scores[0, 0]:.2f}")
 
+def get_parser():
+    """
+    Returns the parser of the command line.
+    """
+    parser = argparse.ArgumentParser(description="Score SurveyMonkey exports and generate PDF reports.")
+    parser.add_argument('--metrics', action='store_true', help="record stage times and memory in the Metrics folder")
+    parser.add_argument('--profile', action='store_true', help="also save a cProfile dump of the run")
+    commands = parser.add_subparsers(dest='command', metavar='command')
 
+    render_options = argparse.ArgumentParser(add_help=False)
+    render_options.add_argument('--render-workers', type=int, help="processes rendering reports (default: number of CPUs)")
+    packet = render_options.add_mutually_exclusive_group()
+    packet.add_argument('--pdf-packet', action='store_true', help="collect the reports in one multi-page PDF")
+    packet.add_argument('--zip-packet', action='store_true', help="collect the reports in one zip archive")
+    render_options.add_argument('--reports-per-file', type=int, help="start a new packet after N reports")
+    render_options.add_argument('--no-report-cache', action='store_true', help="render every report again")
+    render_options.add_argument('--native-pdf', action='store_true', help="draw the reports without Plotly and Kaleido")
+
+    run = commands.add_parser('run', parents=[render_options], help="score the latest export and render its reports (default)")
+    mode = run.add_mutually_exclusive_group()
+    mode.add_argument('--batch', action='store_true', help="process every export waiting in the Data folder")
+    mode.add_argument('--chunked', action='store_true', help="score and render the latest export in blocks of rows")
+    mode.add_argument('--watch', action='store_true', help="keep running and process exports as they arrive")
+    run.add_argument('--incremental', action='store_true', help="only process responses without an up-to-date report")
+    run.add_argument('--chunk-size', type=int, default=5000, help="responses per block with --chunked")
+    run.set_defaults(handler=run_command)
+
+    score = commands.add_parser('score', help="score the latest export into the Results folder, without rendering")
+    score.add_argument('--chunk-size', type=int, default=5000, help="responses per block")
+    score.set_defaults(handler=score_command)
+
+    render = commands.add_parser('render', parents=[render_options], help="render the reports of a scored export")
+    render.add_argument('--export', help="name of the export (default: the one scored last)")
+    render.set_defaults(handler=render_command)
+
+    classify = commands.add_parser('classify', help="move the exports in the Data folder to their survey sub-folders")
+    classify.add_argument('--dry-run', action='store_true', help="only print the survey type of each export")
+    classify.set_defaults(handler=classify_command)
+
+    norms = commands.add_parser('norms', help="rebuild the ICAR norm table and index")
+    norms.set_defaults(handler=norms_command)
+
+    population = commands.add_parser('population', help="summarize the scores of all respondents of a survey form")
+    population.add_argument('form', help="survey form, e.g. 'NEO-IPIP 120'")
+    population.add_argument('--cohort', nargs='+', help="months of completion to include, e.g. 2024-01 (default: all)")
+    population.add_argument('--score', nargs=2, action='append', metavar=('FIELD', 'VALUE'),
+                            help="also print the population percentile of a score")
+    population.set_defaults(handler=population_command)
+    return parser
+
+def run_cli(argv=None):
+    """
+    Runs the command line. Without a command, 'run' is assumed, so the options of earlier
+    versions ('--batch', '--pdf-packet', ...) keep working.
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    global_options = [a for a in argv if a in ('--metrics', '--profile')]
+    rest = [a for a in argv if a not in global_options]
+    if not rest or (rest[0] not in COMMAND_MODULES and rest[0] not in ('-h', '--help')):
+        rest = ['run'] + rest
+    arguments = get_parser().parse_args(global_options + rest)
+    # Run metrics can also be switched on with the SURVEY_REPORT_METRICS environment variable
+    if arguments.metrics or arguments.profile:
+        from Functions.Run_metrics import start_run_metrics
+        start_run_metrics(profile=arguments.profile)
+    arguments.handler(arguments)
+
+def __getattr__(name):
+    # The run modes (main, main_batch, render_scored_exports, ...) are imported on first use
+    if name.startswith('__'):
+        raise AttributeError(name)
+    return getattr(importlib.import_module('Functions.Report_pipeline'), name)
+
+if __name__ == '__main__':
+    run_cli()
@@ -0,0 +1,71 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The pipeline imports its modules as 'Functions.<module>' from the code directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from Functions.Synthetic_exports import write_synthetic_codebooks, write_synthetic_export
+from Functions.Get_data import read_survey_export, split_survey_info_numeric_data
+from Functions.Respondent_ledger import get_respondent_keys, get_content_hashes
+
+@pytest.fixture(scope='session')
+def parent_directory(tmp_path_factory):
+    """
+    Parent folder of a synthetic project: the item keys and ICAR norm table are written next
+    to it, as Benchmark_Run.py does.
+    """
+    workspace = tmp_path_factory.mktemp('workspace')
+    write_synthetic_codebooks(workspace)
+    parent_directory = workspace / 'Project'
+    (parent_directory / 'Data').mkdir(parents=True)
+    (parent_directory / 'Report').mkdir()
+    return parent_directory
+
+@pytest.fixture(scope='session')
+def make_project():
+    """
+    Returns a function that sets up a new synthetic project in a folder: the item keys and
+    ICAR norm table, and the 'Project/code' and 'Project/Report' folders. The function
+    returns the code folder, from which the run modes and the command line are run.
+    """
+    def make(root_directory):
+        write_synthetic_codebooks(root_directory)
+        code_directory = Path(root_directory) / 'Project' / 'code'
+        code_directory.mkdir(parents=True)
+        (code_directory.parent / 'Report').mkdir()
+        return code_directory
+    return make
+
+@pytest.fixture
+def code_directory(make_project, tmp_path, monkeypatch):
+    """
+    Code folder of a new synthetic project, as the working directory of the run modes.
+    """
+    code_directory = make_project(tmp_path)
+    monkeypatch.chdir(code_directory)
+    return code_directory
+
+@pytest.fixture(scope='session')
+def synthetic_export(parent_directory):
+    """
+    Returns a function that writes (once) and reads a synthetic export of a survey form.
+    """
+    def get_export(survey_type, rows, seed=0):
+        file_path = parent_directory / 'Data' / survey_type / f"synthetic_{rows}_seed{seed}.xlsx"
+        if not file_path.exists():
+            write_synthetic_export(file_path, survey_type, rows, seed=seed)
+        return file_path, read_survey_export(file_path)
+    return get_export
+
+@pytest.fixture(scope='session')
+def split_export():
+    """
+    Returns a function that splits a read export into test information, numeric responses
+    and decoded Likert answers, as the run modes do.
+    """
+    def split(survey_data, survey_type):
+        return split_survey_info_numeric_data(survey_data, survey_type, get_respondent_keys(survey_data),
+                                              get_content_hashes(survey_data))
+    return split
@@ -0,0 +1,48 @@
+import os
+
+import pandas as pd
+import pytest
+
+from Functions import Codebook_loader
+from Functions.Codebook_loader import get_personality_codebook
+from Functions.Synthetic_exports import write_synthetic_codebooks
+
+def rewrite_item_key(codebook_file, sheets):
+    """
+    Writes the sheets to the item key, and moves its modification time on, as an edit a
+    second later would.
+    """
+    with pd.ExcelWriter(codebook_file) as writer:
+        for sheet_name, sheet in sheets.items():
+            sheet.to_excel(writer, sheet_name=sheet_name, index=False)
+    stat = codebook_file.stat()
+    os.utime(codebook_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+def test_codebook_is_parsed_again_after_the_item_key_changes(tmp_path):
+    write_synthetic_codebooks(tmp_path)
+    parent_directory = tmp_path / 'Project'
+    codebook_file = tmp_path / 'IPIP' / 'Personality Item Key.xlsx'
+    assert get_personality_codebook(parent_directory)['IPIP-NEO-ItemKey'].loc[0, 'Facet'] != 'Changed Facet'
+    assert codebook_file.with_suffix('.pkl').exists()
+
+    sheets = pd.read_excel(codebook_file, sheet_name=None)
+    sheets['IPIP-NEO-ItemKey'].loc[0, 'Facet'] = 'Changed Facet'
+    rewrite_item_key(codebook_file, sheets)
+    assert get_personality_codebook(parent_directory)['IPIP-NEO-ItemKey'].loc[0, 'Facet'] == 'Changed Facet'
+
+    # A new process reads the rewritten sidecar instead of the first version
+    Codebook_loader._loaded_codebooks.clear()
+    assert get_personality_codebook(parent_directory)['IPIP-NEO-ItemKey'].loc[0, 'Facet'] == 'Changed Facet'
+
+def test_codebook_with_the_same_content_is_not_parsed_again(tmp_path, monkeypatch):
+    write_synthetic_codebooks(tmp_path)
+    parent_directory = tmp_path / 'Project'
+    codebook_file = tmp_path / 'IPIP' / 'Personality Item Key.xlsx'
+    codebook = get_personality_codebook(parent_directory)['IPIP-NEO-ItemKey']
+
+    # Only the modification time changes, e.g. after the file is copied
+    stat = codebook_file.stat()
+    os.utime(codebook_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    Codebook_loader._loaded_codebooks.clear()
+    monkeypatch.setattr(Codebook_loader, 'build_personality_codebook', lambda codebook_file: pytest.fail('parsed again'))
+    pd.testing.assert_frame_equal(get_personality_codebook(parent_directory)['IPIP-NEO-ItemKey'], codebook)
@@ -0,0 +1,33 @@
+import os
+from pathlib import Path
+
+from Functions.Export_inbox import get_file_path, get_pending_file_paths, move_to_failed_folder
+from Functions.Synthetic_exports import write_synthetic_export
+
+def test_excel_lock_files_are_not_exports(tmp_path):
+    data_directory = tmp_path / 'Data'
+    export_path = data_directory / 'export1.xlsx'
+    write_synthetic_export(export_path, 'NEO-IPIP 120', 3)
+    # Excel writes a lock file next to an open export, after the export itself
+    lock_file = data_directory / '~$export1.xlsx'
+    lock_file.write_bytes(b'\x00' * 165)
+    os.utime(lock_file, (export_path.stat().st_mtime + 10,) * 2)
+
+    assert get_pending_file_paths(tmp_path, 'Data') == [export_path]
+    latest_survey_data_path, last_survey_data_path = get_file_path(tmp_path, 'Data')
+    assert Path(latest_survey_data_path) == data_directory / 'NEO-IPIP 120' / 'export1.xlsx'
+    assert last_survey_data_path == latest_survey_data_path
+    assert lock_file.exists()
+
+def test_failed_exports_are_set_aside_under_a_free_name(tmp_path):
+    data_directory = tmp_path / 'Data'
+    (data_directory / 'NEO-IPIP 120').mkdir(parents=True)
+    first = data_directory / 'export1.xlsx'
+    second = data_directory / 'NEO-IPIP 120' / 'export1.xlsx'
+    first.write_bytes(b'first')
+    second.write_bytes(b'second')
+
+    assert move_to_failed_folder(first, data_directory) == data_directory / 'Failed' / 'export1.xlsx'
+    assert move_to_failed_folder(second, data_directory) == data_directory / 'Failed' / 'export1 (2).xlsx'
+    assert (data_directory / 'Failed' / 'export1 (2).xlsx').read_bytes() == b'second'
+    assert get_pending_file_paths(tmp_path, 'Data') == []
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from ICAR_norm_data import process_icar_norm_data
+from Functions.Synthetic_exports import write_synthetic_codebooks, get_synthetic_icar_item_key
+
+def get_sapa_norm_data(codebook, respondents=300, seed=0):
+    """
+    Returns raw SAPA norm data: the age, every ICAR 60 item (1 correct, 0 incorrect, NaN when
+    not given) and other columns the norm table does not use.
+    """
+    rng = np.random.default_rng(seed)
+    items = (rng.random((respondents, len(codebook))) < 0.6).astype(np.float64)
+    items[rng.random(items.shape) < 0.7] = np.nan
+    # A respondent who was given none of the items
+    items[0] = np.nan
+    norm_data = pd.DataFrame(items, columns=codebook['ICAR60'])
+    norm_data.insert(0, 'age', rng.integers(14, 90, respondents))
+    norm_data['country'] = 'USA'
+    norm_data['education'] = rng.integers(1, 8, respondents)
+    return norm_data
+
+def score_norm_data_by_column(norm_data, codebook):
+    """
+    The per-column loop that the matrix product replaced, with the current '_60' rule: the
+    share of correct answers among the items given, times the number of items.
+    """
+    scores = pd.DataFrame({'age': norm_data['age']})
+    dimensions = list(codebook.dimension.unique())
+    for d in dimensions:
+        dimension_items = codebook[codebook.dimension == d]['ICAR60'].unique()
+        norm_data_slice = norm_data[norm_data.columns.intersection(dimension_items)]
+        scores[d] = norm_data_slice.sum(axis=1)
+        scores[f"{d}_60"] = (norm_data_slice.sum(axis=1) / norm_data_slice.notna().sum(axis=1).replace(0, np.nan)
+                             * len(dimension_items))
+    scores['ICAR_Total'] = scores[dimensions].sum(axis=1)
+    all_items = norm_data[codebook['ICAR60']]
+    scores['ICAR60_Total'] = all_items.sum(axis=1) / all_items.notna().sum(axis=1).replace(0, np.nan) * len(codebook)
+    return scores
+
+def test_norm_table_matches_per_column_scoring(tmp_path, monkeypatch):
+    write_synthetic_codebooks(tmp_path)
+    codebook = get_synthetic_icar_item_key()
+    norm_data = get_sapa_norm_data(codebook)
+    norm_directory = tmp_path / 'ICAR' / 'ICAR60' / 'ICAR 60 norm data'
+    norm_directory.mkdir(parents=True)
+    norm_data.to_csv(norm_directory / 'sapaData20may2013thru10jun2014.csv', index=False)
+    code_directory = tmp_path / 'Project' / 'code'
+    code_directory.mkdir(parents=True)
+    monkeypatch.chdir(code_directory)
+
+    process_icar_norm_data()
+    norm_table = pd.read_csv(tmp_path / 'ICAR' / 'ICAR_Norm_Data.csv')
+    expected = score_norm_data_by_column(norm_data, codebook)
+    assert norm_table['ICAR60_Total'].isna().sum() == 1
+    pd.testing.assert_frame_equal(norm_table[expected.columns], expected, check_dtype=False)
@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from Functions.ICAR_norms import MIN_NORM_GROUP_SIZE, get_age_bands, build_icar_norm_index, lookup_icar_norms
+
+def test_age_bands_include_their_lower_edge():
+    ages = [17.99, 18, 24.99, 25, 34, 35, 64.5, 65, 110, 0, -1, np.nan, np.inf]
+    np.testing.assert_array_equal(get_age_bands(ages), [0, 1, 1, 2, 2, 3, 5, 6, 6, 0, -1, -1, -1])
+
+def test_lookup_uses_the_age_band_at_its_edges(tmp_path):
+    # 18-24 year olds all score 10, 25-34 year olds all 0; the 35-44 band is too small to use
+    norm_data = pd.DataFrame({
+        'age': [18] * 15 + [24] * 15 + [25] * 15 + [34] * 15 + [40] * (MIN_NORM_GROUP_SIZE - 1),
+        'ICAR60_Total': [10] * 30 + [0] * 30 + [5] * (MIN_NORM_GROUP_SIZE - 1),
+    })
+    norm_file = tmp_path / 'ICAR_Norm_Data.csv'
+    norm_data.to_csv(norm_file, index=False)
+    norm_index = build_icar_norm_index(norm_file)
+
+    ages = [17.9, 18, 24.9, 25, 34.9, 35, np.nan]
+    percentiles, _ = lookup_icar_norms(norm_index, ages, [[5]] * len(ages), ['ICAR60_Total'])
+    # Under 18, the small band and a missing age fall back to all ages, where the 30 zeros are lower
+    all_ages = 30 / len(norm_data) * 100
+    np.testing.assert_allclose(percentiles[:, 0], [all_ages, 0, 0, 100, 100, all_ages, all_ages])
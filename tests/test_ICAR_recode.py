@@ -0,0 +1,72 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Functions.Codebook_loader import get_cognitive_codebook
+from Functions.Get_data import iter_survey_export_blocks
+from Functions.ICAR_norms import build_icar_norm_index, lookup_icar_norms
+from Functions.ICAR_recode import compile_ICAR_key, score_ICAR, recode_ICAR
+
+def get_test_taker(codebook_all, survey_type, correct_items):
+    """
+    Returns the answers of one test taker to the items of a form, correct for the given items
+    and wrong for the others.
+    """
+    form_codebook = codebook_all.dropna(subset=[survey_type.replace(' ', '')])
+    answers = [answer if item in correct_items else 'wrong'
+               for item, answer in zip(form_codebook['ICAR60'], form_codebook['answer'])]
+    return pd.DataFrame([answers], columns=list(form_codebook['ICAR60']))
+
+def test_test_takers_and_norm_data_share_the_60_scale(parent_directory, tmp_path):
+    codebook_all = get_cognitive_codebook(parent_directory)
+    dimension = 'Letter-Number Series'
+    dimension_items = list(codebook_all[codebook_all.dimension == dimension]['ICAR60'])
+    assert len(dimension_items) == 9
+
+    # 6 of the 9 items right on the ICAR 60, 3 of the 4 items right on the ICAR 16
+    _, scores_60, _ = recode_ICAR(parent_directory, get_test_taker(codebook_all, 'ICAR 60', dimension_items[:6]), 'ICAR 60')
+    _, scores_16, _ = recode_ICAR(parent_directory, get_test_taker(codebook_all, 'ICAR 16', dimension_items[:3]), 'ICAR 16')
+    assert scores_60.at[0, f"{dimension}_60"] == 6
+    assert scores_16.at[0, f"{dimension}_60"] == 3 / 4 * 9
+
+    # A norm respondent given 2 of the items, 1 right, is on the same scale; one given none has no score
+    scoring_key = compile_ICAR_key(codebook_all, 'ICAR60', pd.Index(codebook_all['ICAR60']))
+    position = scoring_key['scores'].index(f"{dimension}_60")
+    item_matrix = np.full((2, len(scoring_key['items'])), np.nan)
+    item_matrix[0, [scoring_key['items'].index(dimension_items[0]), scoring_key['items'].index(dimension_items[5])]] = [1, 0]
+    norm_scores = score_ICAR(scoring_key, item_matrix)[:, position]
+    assert norm_scores[0] == 1 / 2 * 9
+    assert np.isnan(norm_scores[1])
+
+    # Percentile: share of the norm respondents with the score who scored strictly lower
+    norm_file = tmp_path / 'ICAR_Norm_Data.csv'
+    pd.DataFrame({'age': [30] * 6, f"{dimension}_60": [0, 2.25, 4.5, 6.75, 9, np.nan]}).to_csv(norm_file, index=False)
+    norm_index = build_icar_norm_index(norm_file)
+    percentiles, z_scores = lookup_icar_norms(norm_index, [30, 30], [[6], [6.75]], [f"{dimension}_60"])
+    np.testing.assert_array_equal(percentiles[:, 0], [3 / 5 * 100, 3 / 5 * 100])
+    assert z_scores[0, 0] == pytest.approx((6 - 4.5) / np.std([0, 2.25, 4.5, 6.75, 9], ddof=1))
+
+def test_export_items_are_named_by_their_questions(parent_directory, synthetic_export):
+    file_path, survey_data = synthetic_export('ICAR 16', 12)
+    codebook_all = get_cognitive_codebook(parent_directory)
+    form_items = list(codebook_all['ICAR16'].dropna())
+    # The second header row labels each item 'Response'; the first row names it
+    assert set(form_items) <= set(survey_data.columns)
+    assert 'Response' not in survey_data.columns
+
+    chunked_data = pd.concat(list(iter_survey_export_blocks(file_path, 5)))
+    assert list(chunked_data.columns) == list(survey_data.columns)
+    _, whole_scores, _ = recode_ICAR(parent_directory, survey_data, 'ICAR 16')
+    _, chunked_scores, _ = recode_ICAR(parent_directory, chunked_data, 'ICAR 16')
+    pd.testing.assert_frame_equal(chunked_scores, whole_scores)
+
+def test_missing_items_are_reported(parent_directory, synthetic_export):
+    _, survey_data = synthetic_export('ICAR 16', 12)
+    codebook_all = get_cognitive_codebook(parent_directory)
+    missing_item = codebook_all['ICAR16'].dropna().iloc[3]
+    # Items in other columns, e.g. a question renamed in the survey, are not guessed at
+    renamed = survey_data.rename(columns={missing_item: 'Question 4'})
+    with pytest.raises(ValueError, match=re.escape(repr(missing_item))):
+        recode_ICAR(parent_directory, renamed, 'ICAR 16')
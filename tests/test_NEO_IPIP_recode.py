@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pathlib import Path
+
+from Functions.Codebook_loader import get_personality_codebook
+from Functions.NEO_IPIP_recode import (recode_NEO_IPIP, score_NEO_IPIP, compile_NEO_IPIP_key,
+                                       get_NEO_IPIP_form_codebook)
+from Functions.Response_quality import score_response_quality
+
+def recode_NEO_IPIP_reference(parent_directory, survey_data):
+    """
+    The column-by-column NEO IPIP scoring that the compiled matrix key replaced, on float
+    answers with NaN for a missing answer; the 120- and 300-item branches only differed in
+    their codebook.
+    """
+    codebook_all = pd.read_excel(Path(parent_directory).parent / 'IPIP' / 'Personality Item Key.xlsx',
+                                 sheet_name='IPIP-NEO-ItemKey')
+    codebook_all['Dimension'] = np.where(codebook_all.Key.str.contains('O'), 'Openness',
+                                  np.where(codebook_all.Key.str.contains('C'), 'Conscientiousness',
+                                  np.where(codebook_all.Key.str.contains('E'), 'Extroversion',
+                                  np.where(codebook_all.Key.str.contains('A'), 'Agreeableness',
+                                  np.where(codebook_all.Key.str.contains('N'), 'Neuroticism', pd.NA)))))
+    codebook_all['Recode'] = np.where(codebook_all.Sign.str.contains('-'), 'Yes', 'No')
+    if len(survey_data.columns) < 300:
+        codebook = codebook_all.dropna(subset=['Short#']).copy()[['Dimension', 'Recode', 'Facet', 'Item']]
+    else:
+        codebook = codebook_all[['Dimension', 'Recode', 'Facet', 'Item']].copy()
+
+    for i in codebook.Item.unique():
+        if codebook[codebook.Item == i]['Recode'].str.contains('Yes').all():
+            survey_data[i] = 6 - survey_data[i]
+    for d in codebook_all.Dimension.unique():
+        dimension_items = codebook[codebook.Dimension == d]['Item'].unique()
+        survey_data_slice = survey_data[survey_data.columns.intersection(dimension_items)]
+        if len(dimension_items) > 0:
+            dimension_df = pd.DataFrame({d: (survey_data_slice.sum(axis=1) /
+                len(codebook[codebook.Dimension == d]['Facet'].unique())).round(0)}, index=survey_data_slice.index)
+            survey_data = pd.concat([survey_data, dimension_df], axis=1)
+    for f in codebook.Facet.unique():
+        facet_items = codebook[codebook.Facet == f]['Item'].unique()
+        survey_data_slice = survey_data[survey_data.columns.intersection(facet_items)]
+        survey_data = pd.concat([survey_data, pd.DataFrame({f: survey_data_slice.sum(axis=1)}, index=survey_data.index)], axis=1)
+    data_reorganize_list = {}
+    for d in codebook_all.Dimension.unique():
+        facet_items = codebook[codebook.Dimension == d]['Facet'].unique()
+        data_reorganize_list[d] = pd.concat([survey_data[d], survey_data[survey_data.columns.intersection(facet_items)]], axis=1)
+    survey_data_personality_score = pd.DataFrame(
+        {'Personality Score': survey_data[survey_data.columns.intersection(codebook.Item.unique())].sum(axis=1)},
+        index=survey_data.index)
+    return pd.concat(data_reorganize_list, axis=1), survey_data_personality_score, survey_data
+
+def as_float_answers(survey_data_numeric):
+    """
+    Returns the numeric responses with the uint8 answer codes as floats and NaN for a missing
+    answer, as the export was decoded before the uint8 decoder.
+    """
+    item_columns = survey_data_numeric.columns[(survey_data_numeric.dtypes == np.uint8).to_numpy()]
+    return survey_data_numeric.astype({c: float for c in item_columns}).replace({c: {0: np.nan} for c in item_columns})
+
+@pytest.mark.parametrize('survey_type', ['NEO-IPIP 120', 'NEO-IPIP 300'])
+def test_compiled_key_matches_reference(parent_directory, synthetic_export, split_export, survey_type):
+    _, survey_data = synthetic_export(survey_type, 50)
+    _, survey_data_numeric, _ = split_export(survey_data, survey_type)
+    reference_data = as_float_answers(survey_data_numeric)
+    # The synthetic answers leave about 1% of the items unanswered
+    assert reference_data.isna().any().any()
+
+    reorganized, personality_score, _ = recode_NEO_IPIP(parent_directory, survey_data_numeric)
+    expected_reorganized, expected_personality_score, expected_items = recode_NEO_IPIP_reference(parent_directory, reference_data)
+
+    pd.testing.assert_frame_equal(reorganized, expected_reorganized, check_dtype=False)
+    pd.testing.assert_frame_equal(personality_score, expected_personality_score, check_dtype=False)
+    # Reverse-coded answers are written back, with 0 still marking a missing answer
+    items = [c for c in survey_data_numeric.columns if survey_data_numeric[c].dtype == np.uint8]
+    np.testing.assert_array_equal(survey_data_numeric[items].to_numpy(dtype=float),
+                                  expected_items[items].fillna(0).to_numpy(dtype=float))
+
+def test_blank_item_does_not_score_missing_reverse_keyed_answers(parent_directory, synthetic_export, split_export):
+    _, survey_data = synthetic_export('NEO-IPIP 120', 20)
+    codebook_form = get_NEO_IPIP_form_codebook(get_personality_codebook(parent_directory), survey_data)
+    scoring_key = compile_NEO_IPIP_key(codebook_form, survey_data.columns)
+    items = [i for i in scoring_key['items'] if i in survey_data.columns]
+    reverse_item = next(i for i, reverse in zip(scoring_key['items'], scoring_key['reverse']) if reverse)
+    blank_item = next(i for i in items if i != reverse_item)
+    survey_data = survey_data.copy()
+    # An item nobody answered is read as a float column of NaN, next to uint8 answer codes
+    survey_data[blank_item] = np.nan
+    survey_data.loc[0, reverse_item] = np.nan
+    _, survey_data_numeric, _ = split_export(survey_data, 'NEO-IPIP 120')
+    assert survey_data_numeric[blank_item].dtype == np.float64
+    reference_data = as_float_answers(survey_data_numeric)
+
+    reorganized, personality_score, _ = recode_NEO_IPIP(parent_directory, survey_data_numeric)
+    expected_reorganized, expected_personality_score, _ = recode_NEO_IPIP_reference(parent_directory, reference_data)
+
+    pd.testing.assert_frame_equal(reorganized, expected_reorganized, check_dtype=False)
+    pd.testing.assert_frame_equal(personality_score, expected_personality_score, check_dtype=False)
+    assert survey_data_numeric[blank_item].dtype == np.uint8
+    assert survey_data_numeric.loc[0, reverse_item] == 0
+
+def test_scoring_from_decoded_answers_matches_columns(parent_directory, synthetic_export, split_export):
+    _, survey_data = synthetic_export('NEO-IPIP 300', 30)
+    survey_data = survey_data.copy()
+    # An item nobody answered is not in the decoded matrix
+    blank_item = 'Synthetic item 300.'
+    survey_data[blank_item] = np.nan
+    survey_data_test_info, survey_data_numeric, likert_responses = split_export(survey_data, 'NEO-IPIP 300')
+    assert blank_item not in likert_responses['items']
+    pd.testing.assert_frame_equal(
+        score_response_quality(parent_directory, survey_data_test_info, survey_data_numeric, likert_responses=likert_responses),
+        score_response_quality(parent_directory, survey_data_test_info, survey_data_numeric))
+    from_columns = recode_NEO_IPIP(parent_directory, survey_data_numeric.copy())
+    from_matrix = recode_NEO_IPIP(parent_directory, survey_data_numeric, likert_responses)
+
+    pd.testing.assert_frame_equal(from_matrix[0], from_columns[0])
+    pd.testing.assert_frame_equal(from_matrix[1], from_columns[1])
+
+def test_float_scoring_keeps_missing_reverse_keyed_answers_missing():
+    scoring_key = {'reverse': np.array([True, False]), 'item_facet': np.array([[1.0], [1.0]]),
+                   'facet_dimension': np.array([[1.0]]), 'facet_count': np.array([1.0])}
+    # uint8 codes (0 for a missing answer) mixed with a float column
+    item_matrix = np.array([[0.0, 4.0], [2.0, np.nan]])
+    recoded, facet_scores, _, personality_score = score_NEO_IPIP(scoring_key, item_matrix)
+    np.testing.assert_array_equal(facet_scores[:, 0], [4.0, 4.0])
+    np.testing.assert_array_equal(personality_score, [4.0, 4.0])
+    assert np.isnan(recoded[0, 0])
@@ -0,0 +1,181 @@
+import json
+import os
+import re
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Functions.Codebook_loader import get_personality_codebook
+from Functions.Cognitive_Report_Generation import get_cognitive_report_spec
+from Functions.Native_Report_Rendering import write_native_report, get_text_width
+from Functions.Personality_Report_Generation import build_personality_report_template, fill_personality_report
+from Functions.Report_Rendering import write_report
+
+# Bar rectangles and text baselines of reference reports; rewritten when UPDATE_GOLDEN=1
+GOLDEN_FILE = Path(__file__).parent / 'data' / 'native_report_geometry.json'
+# Time the native writer may take per personality report: it takes a few milliseconds, so
+# this only catches a writer that has become far slower (Benchmark_Run.py measures it)
+MAX_SECONDS_PER_REPORT = 1.0
+# Kaleido measures the tick labels, and so places the left edge of the plots, with the fonts
+# of the system it runs on, where the native writer uses the Helvetica metrics
+PLOT_LEFT_TOLERANCE = 30
+
+def get_report_geometry(pdf_path):
+    """
+    Returns the page size (in points), the bar rectangles (x, y, width, height) and the text
+    runs (text, font, size, x, baseline) of a PDF written by write_native_report, in figure
+    pixels from the top left corner.
+    """
+    pdf = Path(pdf_path).read_bytes()
+    page_size = [float(v) for v in re.search(rb'/MediaBox \[0 0 ([\d.]+) ([\d.]+)\]', pdf).groups()]
+    content = zlib.decompress(re.search(rb'stream\n(.*)\nendstream', pdf, re.DOTALL).group(1)).decode('cp1252')
+    bars = [[float(v) for v in match] for match in re.findall(r'([\d.-]+) ([\d.-]+) ([\d.-]+) ([\d.-]+) re B', content)]
+    texts = [[text, font, float(size), float(x), float(y)] for font, size, x, y, text in
+             re.findall(r'/(F\d) ([\d.]+) Tf 1 0 0 -1 ([\d.-]+) ([\d.-]+) Tm \((.*?)\) Tj', content)]
+    return {'page_size': page_size, 'bars': bars, 'texts': texts}
+
+def get_kaleido_geometry(figure_spec):
+    """
+    Returns the bars, bar texts and y tick labels of a figure as Kaleido renders it to SVG, in
+    figure pixels from the top left corner: the bar rectangles (x, y, width, height), the
+    bar texts (text, center, baseline) and the tick labels (text, right edge, baseline).
+    """
+    import plotly.graph_objects as go
+    svg = go.Figure(figure_spec).to_image(format='svg').decode()
+    bars, bar_texts = [], []
+    # Each subplot's bars are drawn in a group moved to the subplot's top left corner
+    subplots = re.split(r'<g class="x\d*y\d*" transform="translate\(([\d.]+),([\d.]+)\)"', svg)
+    for left, top, subplot in zip(subplots[1::3], subplots[2::3], subplots[3::3]):
+        left, top = float(left), float(top)
+        for x0, y0, y1, x1 in re.findall(r'<path d="M([\d.]+),([\d.]+)V([\d.]+)H([\d.]+)V[\d.]+Z"', subplot):
+            bars.append([left + float(x0), top + float(y0), float(x1) - float(x0), float(y1) - float(y0)])
+        for x, y, text in re.findall(r'class="bartext[^>]*transform="translate\(([\d.]+),([\d.]+)\)">(.*?)</text>', subplot):
+            bar_texts.append([text, left + float(x), top + float(y)])
+    tick_labels = [[re.sub(r'<[^>]*>', '', text), float(x), float(y) + float(dy)] for x, y, dy, text in re.findall(
+        r'<g class="y\d*tick"><text text-anchor="end" x="([\d.]+)" y="([\d.]+)" transform="translate\(0,([\d.]+)\)"[^>]*>(.*?)</text>',
+        svg)]
+    return {'bars': bars, 'bar_texts': bar_texts, 'tick_labels': tick_labels}
+
+def get_reference_reports(parent_directory):
+    """
+    Returns the figure specs of a personality and a cognitive report with fixed scores.
+    """
+    codebook_all = get_personality_codebook(parent_directory)['IPIP-NEO-ItemKey']
+    dimensions = list(pd.unique(codebook_all.Dimension.dropna()))
+    facets = list(pd.unique(codebook_all.Facet.dropna()))
+    fields = pd.Index(['Full Name', 'Email address', 'Completion Time', 'Response Time', 'Response Variance',
+                       'Longest String', 'Even-Odd Consistency', 'Mahalanobis Distance', 'Seconds per Item',
+                       'Social Desirability Score', 'Personality Score'] + dimensions + facets)
+    scores = [(7 * n) % 29 + 1 for n in range(len(dimensions) + len(facets))]
+    values = np.array(['ann@example.com', '01/15/2024 10:30:00 AM', '00:12:34', 9, 6, 0.81, np.nan, 4.2, 5, 384]
+                      + scores, dtype=object)
+    template = build_personality_report_template(fields, codebook_all, 120, backend='native')
+    personality = fill_personality_report(template, values, 'Ann Example')
+
+    test_taker_data = {'Email address': 'bo@example.com', 'Completion Time': '02/01/2024 09:00:00 AM',
+                       'Response Time': '00:20:00', 'ICAR_Total': 11.0, 'ICAR60_Total Percentile': 64.0,
+                       'Verbal Reasoning': 3.0, 'Letter-Number Series': 2.0, 'Verbal Reasoning_60 Percentile': 71.5,
+                       'Letter-Number Series_60 Percentile': 38.0}
+    cognitive = get_cognitive_report_spec(test_taker_data, 'Bo Example', 16,
+                                          {'Verbal Reasoning': 4, 'Letter-Number Series': 4})
+    return {'personality': personality, 'cognitive': cognitive}
+
+def test_native_reports_match_reference_geometry(parent_directory, tmp_path):
+    geometry = {}
+    for report, figure_spec in get_reference_reports(parent_directory).items():
+        write_native_report(figure_spec, str(tmp_path / f"{report}.pdf"))
+        geometry[report] = get_report_geometry(tmp_path / f"{report}.pdf")
+    if os.environ.get('UPDATE_GOLDEN') == '1':
+        GOLDEN_FILE.write_text(json.dumps(geometry, indent=1) + '\n')
+    reference = json.loads(GOLDEN_FILE.read_text())
+
+    for report, expected in reference.items():
+        actual = geometry[report]
+        assert actual['page_size'] == expected['page_size'], report
+        np.testing.assert_allclose(actual['bars'], expected['bars'], atol=0.01, err_msg=report)
+        assert [t[:3] for t in actual['texts']] == [t[:3] for t in expected['texts']], report
+        np.testing.assert_allclose([t[3:] for t in actual['texts']], [t[3:] for t in expected['texts']],
+                                   atol=0.01, err_msg=report)
+
+def test_native_reports_match_kaleido_reports(parent_directory, tmp_path):
+    for report, figure_spec in get_reference_reports(parent_directory).items():
+        write_native_report(figure_spec, str(tmp_path / f"{report}.pdf"))
+        native = get_report_geometry(tmp_path / f"{report}.pdf")
+        kaleido = get_kaleido_geometry(figure_spec)
+        plot_right = 700 - figure_spec['layout']['margin']['r']
+
+        # Same bars, at the same heights and with the same lengths relative to the plot width
+        native_bars, kaleido_bars = sorted(native['bars'], key=lambda b: b[1]), sorted(kaleido['bars'], key=lambda b: b[1])
+        assert len(native_bars) == len(kaleido_bars) > 0, report
+        for (x, y, width, height), (k_x, k_y, k_width, k_height) in zip(native_bars, kaleido_bars):
+            assert abs(x - k_x) <= PLOT_LEFT_TOLERANCE, report
+            np.testing.assert_allclose([y, height], [k_y, k_height], atol=0.5, err_msg=report)
+            assert abs(width / (plot_right - x) - k_width / (plot_right - k_x)) <= 0.002, report
+
+        def find_text(text, baseline):
+            # The native text run on the same baseline, as (left edge, width)
+            runs = [(x, get_text_width(text, size, font == 'F2')) for run_text, font, size, x, run_baseline
+                    in native['texts'] if run_text == text and abs(run_baseline - baseline) <= 0.5]
+            assert len(runs) == 1, (report, text)
+            return runs[0]
+
+        def find_bar(bars, baseline):
+            return min(bars, key=lambda bar: abs(bar[1] + bar[3] / 2 - baseline))
+
+        # Bar texts on the same baselines, just after their bars
+        for text, center, baseline in kaleido['bar_texts']:
+            x, text_width = find_text(text, baseline)
+            native_bar, kaleido_bar = find_bar(native_bars, baseline), find_bar(kaleido_bars, baseline)
+            assert abs((x + text_width / 2 - native_bar[0] - native_bar[2])
+                       - (center - kaleido_bar[0] - kaleido_bar[2])) <= 0.15 * text_width + 1, (report, text)
+
+        # Tick labels on the same baselines, ending just before the plot
+        assert len(kaleido['tick_labels']) == len(native_bars), report
+        for text, right, baseline in kaleido['tick_labels']:
+            x, text_width = find_text(text, baseline)
+            assert abs((x + text_width - find_bar(native_bars, baseline)[0])
+                       - (right - find_bar(kaleido_bars, baseline)[0])) <= 0.5, (report, text)
+
+def test_native_report_speed(parent_directory, tmp_path):
+    figure_spec = get_reference_reports(parent_directory)['personality']
+    seconds = []
+    for n in range(20):
+        start = time.perf_counter()
+        write_native_report(figure_spec, str(tmp_path / f"report{n}.pdf"))
+        seconds.append(time.perf_counter() - start)
+    assert np.median(seconds) < MAX_SECONDS_PER_REPORT
+
+def test_missing_percentiles_are_shown_as_not_available(parent_directory, tmp_path):
+    # No norm group has a score, e.g. for a dimension the test taker was given no item of
+    test_taker_data = {'Email address': 'bo@example.com', 'Completion Time': '02/01/2024 09:00:00 AM',
+                       'Response Time': '00:20:00', 'ICAR_Total': 11.0, 'ICAR60_Total Percentile': np.nan,
+                       'Verbal Reasoning': 3.0, 'Verbal Reasoning_60 Percentile': 71.5}
+    figure_spec = get_cognitive_report_spec(test_taker_data, 'Bo Example', 16, {'Verbal Reasoning': 4})
+    write_native_report(figure_spec, str(tmp_path / 'cognitive.pdf'))
+    texts = [text for text, *_ in get_report_geometry(tmp_path / 'cognitive.pdf')['texts']]
+    assert '11 of 16 correct | percentile n/a' in texts
+    assert '3 of 4 correct | percentile 72' in texts
+    assert 'n/a' in texts and not any('nan' in text for text in texts)
+
+def test_names_outside_the_standard_fonts_are_rendered_with_kaleido(parent_directory, tmp_path):
+    test_taker_data = {'Email address': 'bo@example.com', 'Completion Time': '02/01/2024 09:00:00 AM',
+                       'Response Time': '00:20:00', 'ICAR_Total': 11.0, 'ICAR60_Total Percentile': 64.0,
+                       'Verbal Reasoning': 3.0, 'Verbal Reasoning_60 Percentile': 71.5}
+    for name in ['Łukasz Wiśniewski', 'Иван Петров']:
+        figure_spec = get_cognitive_report_spec(test_taker_data, name, 16, {'Verbal Reasoning': 4})
+        with pytest.raises(UnicodeEncodeError):
+            write_native_report(figure_spec, str(tmp_path / 'native.pdf'))
+        assert not (tmp_path / 'native.pdf').exists()
+        write_report(figure_spec, str(tmp_path / 'report.pdf'), backend='native')
+        # Kaleido's PDF files are written by Chromium's Skia
+        assert b'/Producer (Skia' in (tmp_path / 'report.pdf').read_bytes(), name
+
+    # Western European names are drawn by the native writer
+    figure_spec = get_cognitive_report_spec(test_taker_data, 'Zoë Müller', 16, {'Verbal Reasoning': 4})
+    write_report(figure_spec, str(tmp_path / 'report.pdf'), backend='native')
+    texts = [text for text, *_ in get_report_geometry(tmp_path / 'report.pdf')['texts']]
+    assert 'Zoë Müller' in texts
@@ -0,0 +1,38 @@
+import json
+
+import numpy as np
+import pytest
+
+from Functions.Codebook_loader import get_personality_codebook
+from Functions.Report_pipeline import score_survey_data
+from Functions.Reshape_data import reshape_scores_long, iter_test_taker_data
+from Functions.Personality_Report_Generation import (get_personality_report_spec, personality_report_generation,
+                                                     build_personality_report_template, fill_personality_report)
+
+def as_json(figure_spec):
+    """
+    Returns a figure spec as Plotly serializes it for rendering, so that specs which render
+    the same compare equal.
+    """
+    import plotly.io as pio
+    return json.loads(pio.to_json(figure_spec, validate=False))
+
+@pytest.mark.parametrize('backend', ['native', 'kaleido'])
+def test_filled_reports_match_generated_reports(parent_directory, synthetic_export, split_export, backend):
+    file_path, survey_data = synthetic_export('NEO-IPIP 120', 30)
+    # Blank answers, as in real exports; with fewer test takers than items, the Mahalanobis
+    # distance is missing too
+    survey_data = survey_data.copy()
+    survey_data.iloc[3, -5:] = np.nan
+    scored_export = score_survey_data(parent_directory, file_path, *split_export(survey_data, 'NEO-IPIP 120'))
+    scored_data = scored_export['survey_data_scored']
+    codebook_all = get_personality_codebook(parent_directory)['IPIP-NEO-ItemKey']
+
+    template = build_personality_report_template(scored_data.columns, codebook_all, 120, backend=backend)
+    values = scored_data[template['value_fields']].to_numpy(dtype=object)
+    for respondent, name, _, test_taker_df in iter_test_taker_data(reshape_scores_long(scored_data, codebook_all)):
+        if backend == 'native':
+            expected = get_personality_report_spec(test_taker_df, name, 120)
+        else:
+            expected = personality_report_generation(test_taker_df, name, 120).to_dict()
+        assert as_json(fill_personality_report(template, values[respondent], name)) == as_json(expected), name
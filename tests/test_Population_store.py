@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from Functions.Population_store import (open_population_store, close_population_store, append_to_population,
+                                        get_population_summaries, lookup_population_percentiles, read_population)
+
+def get_scored_data(respondents, seed):
+    """
+    Returns scored data of respondents as score_survey_data gives it: a name, whole-number
+    scores, a score with decimals and a norm percentile, which the store leaves out.
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Full Name': [f"Respondent {n}" for n in range(respondents)],
+        'Anxiety': rng.integers(4, 21, respondents),
+        'Mahalanobis Distance': np.round(rng.normal(11, 2, respondents), 1),
+        'ICAR60_Total Percentile': rng.random(respondents) * 100,
+    })
+
+def summarize_latest_scores(population):
+    """
+    The summaries computed directly from the latest scores of each respondent: count, mean,
+    standard deviation, minimum and maximum of each score per cohort.
+    """
+    population = population.drop_duplicates(subset='Respondent Key', keep='last')
+    return population.groupby('Cohort')[['Anxiety', 'Mahalanobis Distance']].agg(['count', 'mean', 'std', 'min', 'max'])
+
+def test_rescored_respondents_replace_their_stored_scores(tmp_path):
+    first = get_scored_data(40, seed=0)
+    first_keys = np.array([f"key{n}" for n in range(40)])
+    first_cohorts = np.where(np.arange(40) < 20, '2024-01', '2024-02')
+    # A later export: respondents 0-9 edited their answers (respondents 0-4 also completed
+    # the survey again in March), and 10 new respondents
+    second = get_scored_data(20, seed=1)
+    second_keys = np.array([f"key{n}" for n in range(10)] + [f"key{n}" for n in range(40, 50)])
+    second_cohorts = np.array(['2024-03'] * 5 + ['2024-01'] * 5 + ['2024-02'] * 10)
+
+    store = open_population_store(tmp_path)
+    try:
+        assert append_to_population(store, 'NEO-IPIP 120', first, first_keys, first_cohorts) == 40
+        assert append_to_population(store, 'NEO-IPIP 120', second, second_keys, second_cohorts) == 20
+        summaries = {cohort: get_population_summaries(store, 'NEO-IPIP 120', cohorts=[cohort])
+                     for cohort in ['2024-01', '2024-02', '2024-03']}
+        all_summaries = get_population_summaries(store, 'NEO-IPIP 120')
+        stored = read_population(store, 'NEO-IPIP 120')
+    finally:
+        close_population_store(store)
+
+    latest = pd.concat([first.assign(**{'Respondent Key': first_keys, 'Cohort': first_cohorts}),
+                        second.assign(**{'Respondent Key': second_keys, 'Cohort': second_cohorts})], ignore_index=True)
+    expected = summarize_latest_scores(latest)
+    assert sorted(stored['Respondent Key']) == sorted(set(latest['Respondent Key']))
+    pd.testing.assert_frame_equal(summarize_latest_scores(stored), expected, check_dtype=False)
+    for cohort, cohort_summaries in summaries.items():
+        for field in ['Anxiety', 'Mahalanobis Distance']:
+            summary = cohort_summaries[field]
+            np.testing.assert_allclose([summary['count'], summary['mean'], summary['std'], summary['minimum'],
+                                        summary['maximum']], expected.loc[cohort, field].to_numpy(dtype=float))
+    assert 'ICAR60_Total Percentile' not in all_summaries
+
+    # The percentiles count each respondent once, with their latest score
+    latest_anxiety = latest.drop_duplicates(subset='Respondent Key', keep='last')['Anxiety'].to_numpy()
+    percentiles, _ = lookup_population_percentiles(all_summaries, [[4], [12], [21]], ['Anxiety'])
+    np.testing.assert_allclose(percentiles[:, 0], [(latest_anxiety < score).mean() * 100 for score in [4, 12, 21]])
@@ -0,0 +1,79 @@
+import os
+
+from Functions.Render_cache import (open_report_cache, get_report_key, get_cached_report, release_report_file,
+                                    store_report)
+
+def write_report(file_path, content):
+    """
+    Writes a stand-in for a rendered report.
+    """
+    file_path.write_bytes(b'%PDF-1.4\n' + content)
+    return file_path
+
+def test_reports_are_reused_until_their_inputs_change(tmp_path):
+    cache = open_report_cache(tmp_path / 'Report_Cache')
+    report_key = get_report_key(('kaleido', '0.2.1'), 2, 'Ann Example', 120, (13, 27.0, 'ann@example.com'))
+    output_path = tmp_path / 'Ann Example.pdf'
+    assert not get_cached_report(cache, report_key, output_path)
+    store_report(cache, report_key, write_report(output_path, b'Ann'))
+
+    # A later run finds the report, but not that of other scores or of another renderer version
+    output_path.unlink()
+    cache = open_report_cache(tmp_path / 'Report_Cache')
+    assert get_cached_report(cache, report_key, output_path)
+    assert output_path.read_bytes() == b'%PDF-1.4\nAnn'
+    for changed_key in [get_report_key(('kaleido', '0.2.1'), 2, 'Ann Example', 120, (14, 27.0, 'ann@example.com')),
+                        get_report_key(('kaleido', '0.2.1'), 3, 'Ann Example', 120, (13, 27.0, 'ann@example.com')),
+                        get_report_key(('kaleido', '0.4.0'), 2, 'Ann Example', 120, (13, 27.0, 'ann@example.com')),
+                        get_report_key(('native', '1'), 2, 'Ann Example', 120, (13, 27.0, 'ann@example.com'))]:
+        assert changed_key != report_key
+        assert not get_cached_report(cache, changed_key, tmp_path / 'changed.pdf')
+    assert (cache['hits'], cache['misses']) == (1, 4)
+
+def test_least_recently_used_reports_are_evicted(tmp_path):
+    reports = {name: write_report(tmp_path / f"{name}.pdf", name.encode() * 100) for name in ['a', 'b', 'c']}
+    size = reports['a'].stat().st_size
+    cache = open_report_cache(tmp_path / 'Report_Cache', max_bytes=int(2.5 * size))
+    store_report(cache, 'a', reports['a'])
+    store_report(cache, 'b', reports['b'])
+    # Using 'a' makes 'b' the least recently used report
+    assert get_cached_report(cache, 'a', tmp_path / 'a_report.pdf')
+    assert get_cached_report(cache, 'b', tmp_path / 'b_report.pdf')
+    assert get_cached_report(cache, 'a', tmp_path / 'a_report.pdf')
+
+    # A report hard-linked to its cache file by an earlier version
+    os.link(cache['directory'] / 'b.pdf', tmp_path / 'b_linked.pdf')
+    store_report(cache, 'c', reports['c'])
+    assert list(cache['files']) == ['a', 'c']
+    assert (cache['bytes'], cache['evicted']) == (2 * size, 1)
+    assert sorted(p.name for p in cache['directory'].iterdir()) == ['a.pdf', 'c.pdf']
+    # The reports taken from the evicted entry are still there
+    assert (tmp_path / 'b_report.pdf').read_bytes() == reports['b'].read_bytes()
+    assert (tmp_path / 'b_linked.pdf').read_bytes() == reports['b'].read_bytes()
+    assert not get_cached_report(cache, 'b', tmp_path / 'b_report.pdf')
+
+def test_editing_a_report_leaves_the_cached_copy_intact(tmp_path):
+    cache = open_report_cache(tmp_path / 'Report_Cache')
+    output_path = write_report(tmp_path / 'Ann Example.pdf', b'Ann')
+    store_report(cache, 'ann', output_path)
+    assert get_cached_report(cache, 'ann', output_path)
+
+    # E.g. annotations saved into the report in the Report folder
+    with open(output_path, 'r+b') as report:
+        report.seek(0, os.SEEK_END)
+        report.write(b'\n% annotation')
+    assert (cache['directory'] / 'ann.pdf').read_bytes() == b'%PDF-1.4\nAnn'
+    assert get_cached_report(cache, 'ann', output_path)
+    assert output_path.read_bytes() == b'%PDF-1.4\nAnn'
+
+def test_hard_links_into_the_cache_are_released(tmp_path):
+    cache = open_report_cache(tmp_path / 'Report_Cache')
+    store_report(cache, 'ann', write_report(tmp_path / 'rendered.pdf', b'Ann'))
+    # A report linked to its cache file, as earlier versions took reports from the cache
+    linked_path, plain_path = tmp_path / 'linked.pdf', write_report(tmp_path / 'plain.pdf', b'Bo')
+    os.link(cache['directory'] / 'ann.pdf', linked_path)
+    release_report_file(linked_path)
+    release_report_file(plain_path)
+    release_report_file(tmp_path / 'missing.pdf')
+    assert not linked_path.exists() and plain_path.exists()
+    assert (cache['directory'] / 'ann.pdf').read_bytes() == b'%PDF-1.4\nAnn'
@@ -0,0 +1,156 @@
+import re
+import zipfile
+
+import pytest
+
+from Functions.Cognitive_Report_Generation import get_cognitive_report_spec
+from Functions.Native_Report_Rendering import write_native_report
+from Functions.Report_Packets import (PACKET_CATALOG, PACKET_PAGES, read_pdf_objects, get_pdf_dictionary_value,
+                                      get_pdf_reference, open_report_packet, add_report_to_packet, close_report_packet)
+
+def write_test_pdf(pdf_path, objects, root, update=None):
+    """
+    Writes a PDF file with a classic cross-reference table, and optionally an incremental
+    update with a second table linked by /Prev.
+
+    Args:
+        objects (dict): Object number -> dictionary, or (dictionary, stream data).
+        root (int): Object number of the catalog.
+        update (dict): Objects of the incremental update, as objects.
+    """
+    pdf = bytearray(b'%PDF-1.4\n')
+    previous = None
+    for section in [objects] + ([update] if update else []):
+        offsets = {}
+        for number, value in section.items():
+            dictionary, stream = value if isinstance(value, tuple) else (value, None)
+            offsets[number] = len(pdf)
+            pdf += b'%d 0 obj\n' % number + dictionary
+            if stream is not None:
+                pdf += b'\nstream\n' + stream + b'\nendstream'
+            pdf += b'\nendobj\n'
+        xref_offset = len(pdf)
+        pdf += b'xref\n'
+        if previous is None:
+            pdf += b'0 1\n0000000000 65535 f \n'
+        for number in sorted(offsets):
+            pdf += b'%d 1\n%010d 00000 n \n' % (number, offsets[number])
+        prev = b' /Prev %d' % previous if previous is not None else b''
+        pdf += b'trailer\n<</Size %d /Root %d 0 R%s>>\nstartxref\n%d\n%%%%EOF\n' % (
+            max(objects) + 1, root, prev, xref_offset)
+        previous = xref_offset
+    pdf_path.write_bytes(bytes(pdf))
+
+def read_packet(packet_path):
+    """
+    Checks the cross-reference table of a PDF packet against the objects in the file, and
+    returns its objects, its pages and its bookmarks as (title, page object number).
+    """
+    pdf_data = packet_path.read_bytes()
+    startxref = int(re.search(rb'startxref\s+(\d+)\s+%%EOF\s*$', pdf_data).group(1))
+    assert pdf_data.startswith(b'xref\n0 ', startxref)
+    size = int(re.search(rb'/Size (\d+)', pdf_data[startxref:]).group(1))
+    entries = re.findall(rb'(\d{10}) (\d{5}) ([nf]) \n', pdf_data[startxref:])
+    assert len(entries) == size
+    for number, (offset, _, kind) in enumerate(entries):
+        if kind == b'n':
+            assert pdf_data.startswith(b'%d 0 obj\n' % number, int(offset)), number
+
+    objects, trailer = read_pdf_objects(pdf_data)
+    assert get_pdf_reference(get_pdf_dictionary_value(trailer, b'Root')) == PACKET_CATALOG
+    page_tree = objects[PACKET_PAGES][0]
+    pages = [int(n) for n in re.findall(rb'(\d+) 0 R', get_pdf_dictionary_value(page_tree, b'Kids'))]
+    assert int(get_pdf_dictionary_value(page_tree, b'Count')) == len(pages)
+
+    outlines = objects[get_pdf_reference(get_pdf_dictionary_value(objects[PACKET_CATALOG][0], b'Outlines'))][0]
+    bookmarks, bookmark = [], get_pdf_reference(get_pdf_dictionary_value(outlines, b'First'))
+    while bookmark is not None:
+        dictionary = objects[bookmark][0]
+        title = bytes.fromhex(get_pdf_dictionary_value(dictionary, b'Title')[5:-1].decode()).decode('utf-16-be')
+        page = int(re.match(rb'\[(\d+) 0 R', get_pdf_dictionary_value(dictionary, b'Dest')).group(1))
+        bookmarks.append((title, page))
+        bookmark = get_pdf_reference(get_pdf_dictionary_value(dictionary, b'Next'))
+    assert len(bookmarks) == int(get_pdf_dictionary_value(outlines, b'Count'))
+    return objects, pages, bookmarks
+
+@pytest.fixture
+def report_files(tmp_path):
+    """
+    Returns a cognitive report rendered by Kaleido and one written by the native writer.
+    """
+    import plotly.graph_objects as go
+    test_taker_data = {'Email address': 'bo@example.com', 'Completion Time': '02/01/2024 09:00:00 AM',
+                       'Response Time': '00:20:00', 'ICAR_Total': 11.0, 'ICAR60_Total Percentile': 64.0,
+                       'Verbal Reasoning': 3.0, 'Verbal Reasoning_60 Percentile': 71.5}
+    figure_spec = get_cognitive_report_spec(test_taker_data, 'Bo Example', 16, {'Verbal Reasoning': 4})
+    kaleido_file, native_file = tmp_path / 'kaleido.pdf', tmp_path / 'native.pdf'
+    go.Figure(figure_spec).write_image(str(kaleido_file))
+    write_native_report(figure_spec, str(native_file))
+    return kaleido_file, native_file
+
+def test_pdf_packet_of_kaleido_and_native_reports(report_files, tmp_path):
+    kaleido_file, native_file = report_files
+    packet = open_report_packet(tmp_path / 'packet.pdf')
+    for report_file, title in [(kaleido_file, 'Ann Example'), (native_file, 'Łukasz Nowák'), (kaleido_file, 'Ann Example')]:
+        add_report_to_packet(packet, report_file, title)
+    objects, pages, bookmarks = read_packet(close_report_packet(packet))
+
+    assert len(pages) == 3
+    assert bookmarks == [('Ann Example', pages[0]), ('Łukasz Nowák', pages[1]), ('Ann Example', pages[2])]
+    for page in pages:
+        dictionary = objects[page][0]
+        assert re.search(rb'/Type\s*/Page\b', dictionary)
+        assert get_pdf_reference(get_pdf_dictionary_value(dictionary, b'Parent')) == PACKET_PAGES
+        assert get_pdf_dictionary_value(dictionary, b'MediaBox') is not None
+        assert get_pdf_dictionary_value(dictionary, b'Resources') is not None
+        assert get_pdf_dictionary_value(dictionary, b'StructParents') is None
+
+def test_zip_packet_of_kaleido_and_native_reports(report_files, tmp_path):
+    kaleido_file, native_file = report_files
+    packet = open_report_packet(tmp_path / 'packet.zip')
+    for report_file, title in [(kaleido_file, 'Ann Example'), (native_file, 'Łukasz Nowák'), (kaleido_file, 'Ann Example')]:
+        add_report_to_packet(packet, report_file, title)
+    with zipfile.ZipFile(close_report_packet(packet)) as archive:
+        assert archive.namelist() == ['Ann Example.pdf', 'Łukasz Nowák.pdf', 'Ann Example (2).pdf']
+        assert archive.read('Ann Example (2).pdf') == kaleido_file.read_bytes()
+        assert archive.read('Łukasz Nowák.pdf') == native_file.read_bytes()
+
+def test_pages_get_the_attributes_of_their_page_tree(tmp_path):
+    report_file = tmp_path / 'report.pdf'
+    write_test_pdf(report_file, {
+        1: b'<</Type /Catalog /Pages 2 0 R /StructTreeRoot 9 0 R>>',
+        2: b'<</Type /Pages /Count 2 /Kids [3 0 R] /MediaBox [0 0 200 100] /Resources 4 0 R>>',
+        3: b'<</Type /Pages /Count 2 /Parent 2 0 R /Kids [6 0 R 5 0 R] /Rotate 90>>',
+        4: b'<</Font <</F1 8 0 R>>>>',
+        5: b'<</Type /Page /Parent 3 0 R /MediaBox [0 0 50 50] /Contents 7 0 R /StructParents 1>>',
+        6: b'<</Type /Page /Parent 3 0 R /Contents 7 0 R /StructParents 0 /Annots [<</T (a [b) /P 6 0 R>>]>>',
+        7: (b'<</Length 5>>', b'old()'),
+        8: b'<</Type /Font /Subtype /Type1 /BaseFont /Helvetica>>',
+        9: b'<</Type /StructTreeRoot /K 10 0 R>>',
+        10: b'<</Type /StructElem /S /Document /P 9 0 R>>',
+    }, root=1, update={7: (b'<</Length 5>>', b'new()')})
+
+    packet = open_report_packet(tmp_path / 'packet.pdf')
+    add_report_to_packet(packet, report_file, 'Report')
+    objects, pages, bookmarks = read_packet(close_report_packet(packet))
+
+    # The pages in document order, each with the attributes it inherits and without its structure
+    assert bookmarks == [('Report', pages[0])]
+    first, second = (objects[page][0] for page in pages)
+    assert get_pdf_dictionary_value(first, b'MediaBox') == b'[0 0 200 100]'
+    assert get_pdf_dictionary_value(second, b'MediaBox') == b'[0 0 50 50]'
+    assert get_pdf_dictionary_value(first, b'Rotate') == get_pdf_dictionary_value(second, b'Rotate') == b'90'
+    assert get_pdf_dictionary_value(first, b'StructParents') is None
+    resources = objects[get_pdf_reference(get_pdf_dictionary_value(first, b'Resources'))][0]
+    assert b'/Helvetica' in objects[int(re.search(rb'/F1 (\d+) 0 R', resources).group(1))][0]
+    assert get_pdf_dictionary_value(first, b'Annots') == b'[<</T (a [b) /P %d 0 R>>]' % pages[0]
+    assert objects[get_pdf_reference(get_pdf_dictionary_value(first, b'Contents'))][1] == b'new()'
+    # The structure tree, catalog and page tree nodes of the report are left out
+    assert not any(b'/StructTreeRoot' in d or b'/StructElem' in d for d, _ in objects.values())
+    assert len(objects) == 3 + 2 + 3 + 1
+
+def test_cross_reference_streams_are_rejected(tmp_path):
+    pdf = b'%PDF-1.5\n1 0 obj\n<</Type /XRef /Size 2 /W [1 2 1] /Root 2 0 R /Length 0>>\nstream\n\nendstream\nendobj\n'
+    pdf += b'startxref\n9\n%%EOF\n'
+    with pytest.raises(ValueError, match='cross-reference stream'):
+        read_pdf_objects(pdf)
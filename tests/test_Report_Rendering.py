@@ -0,0 +1,26 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from Functions.Report_Rendering import start_render_deadlines, get_worker_processes
+
+def test_only_reports_taken_up_by_a_worker_are_timed():
+    pending = {f"future{n}": (f"spec{n}", {'attempts': 1}, None) for n in range(5)}
+    pending['future0'] = ('spec0', {'attempts': 1}, 1.0)
+    before = time.monotonic()
+    start_render_deadlines(pending, workers=2, timeout=120)
+
+    deadlines = [deadline for _, _, deadline in pending.values()]
+    # A deadline that was running is kept; the second report is taken up now; the rest wait in the queue
+    assert deadlines[0] == 1.0
+    assert deadlines[1] >= before + 120
+    assert deadlines[2:] == [None, None, None]
+    assert list(pending) == [f"future{n}" for n in range(5)]
+
+def test_worker_processes_are_found_or_left_to_shutdown():
+    executor = ProcessPoolExecutor(max_workers=1)
+    try:
+        executor.submit(time.sleep, 0).result()
+        assert [process.is_alive() for process in get_worker_processes(executor)] == [True]
+    finally:
+        executor.shutdown()
+    assert get_worker_processes(object()) == []
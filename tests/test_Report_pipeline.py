@@ -0,0 +1,142 @@
+import os
+import signal
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from Functions import Report_pipeline, Run_metrics
+from Functions.Response_quality import QUALITY_FIELDS
+from Functions.Results_store import read_results
+from Functions.Synthetic_exports import write_synthetic_export
+
+def test_chunked_skips_blocks_of_unrecognized_forms(code_directory, monkeypatch, capsys):
+    write_synthetic_export(code_directory.parent / 'Data' / 'export1.xlsx', 'NEO-IPIP 120', 6)
+    score_survey_data = Report_pipeline.score_survey_data
+
+    def score_without_form(*args, **kwargs):
+        # As score_survey_data returns a survey it has no scoring for
+        scored_block = score_survey_data(*args, **kwargs)
+        return {key: scored_block[key] for key in ('file_path', 'survey_type', 'respondents')}
+    monkeypatch.setattr(Report_pipeline, 'score_survey_data', score_without_form)
+
+    Report_pipeline.main_chunked(chunk_size=4)
+    output = capsys.readouterr().out
+    assert "Skipping block 0 (4 response(s))" in output
+    assert "Skipping block 1 (2 response(s))" in output
+    assert "2 block(s) of export1.xlsx were not scored." in output
+
+def test_incremental_chunked_scoring_needs_rendering(code_directory):
+    with pytest.raises(ValueError, match='render=True'):
+        Report_pipeline.main_chunked(render=False, incremental=True)
+
+def test_chunked_quality_matches_whole_export(code_directory, monkeypatch):
+    # More responses than items in every block would hide a reference taken per block
+    write_synthetic_export(code_directory.parent / 'Data' / 'export1.xlsx', 'NEO-IPIP 120', 300)
+    iter_survey_export_blocks, streams = Report_pipeline.iter_survey_export_blocks, []
+
+    def count_streams(*args, **kwargs):
+        streams.append(args)
+        return iter_survey_export_blocks(*args, **kwargs)
+    monkeypatch.setattr(Report_pipeline, 'iter_survey_export_blocks', count_streams)
+
+    Report_pipeline.main_chunked(chunk_size=100)
+    chunked = read_results(code_directory.parent / 'Results' / 'export1', columns=QUALITY_FIELDS)
+    # The reference is built while the xlsx is streamed, and the kept blocks are removed after scoring
+    assert len(streams) == 1
+    assert not list((code_directory.parent / 'Results' / 'export1').glob('export_blocks_*'))
+
+    export_path = code_directory.parent / 'Data' / 'NEO-IPIP 120' / 'export1.xlsx'
+    whole = Report_pipeline.score_survey_export(code_directory.parent, export_path, export_path)['survey_data_scored']
+    assert whole['Mahalanobis Distance'].notna().all()
+    pd.testing.assert_frame_equal(chunked.reset_index(drop=True), whole[QUALITY_FIELDS].reset_index(drop=True),
+                                  check_dtype=False)
+
+def test_batch_drains_every_pending_export(code_directory, capsys):
+    data_directory = code_directory.parent / 'Data'
+    write_synthetic_export(data_directory / 'personality.xlsx', 'NEO-IPIP 120', 5)
+    write_synthetic_export(data_directory / 'cognitive.xlsx', 'ICAR 16', 3)
+    (data_directory / 'broken.xlsx').write_bytes(b'not a workbook')
+
+    Report_pipeline.main_batch(scoring_workers=2, render_workers=1, report_cache=False, render_backend='native')
+    output = capsys.readouterr().out
+    assert "personality.xlsx: 5 new response(s) (NEO-IPIP 120)." in output
+    assert "cognitive.xlsx: 3 new response(s) (ICAR 16)." in output
+    assert "Skipping broken.xlsx" in output
+    # Only the export that cannot be read is left in the inbox
+    assert sorted(p.name for p in data_directory.glob('*.xlsx')) == ['broken.xlsx']
+    assert (data_directory / 'NEO-IPIP 120' / 'personality.xlsx').exists()
+    assert (data_directory / 'ICAR 16' / 'cognitive.xlsx').exists()
+    reports = list((code_directory.parent / 'Report').glob('*.pdf'))
+    assert len([p for p in reports if p.name.startswith('Personality_Report_')]) == 5
+    assert len([p for p in reports if p.name.startswith('Cognitive_Report_')]) == 3
+
+    # The inbox is drained, so a second run has nothing to claim
+    Report_pipeline.main_batch(scoring_workers=1, render_workers=1, report_cache=False, render_backend='native')
+    assert "No pending exports" in capsys.readouterr().out
+
+def test_metrics_leave_results_and_reports_unchanged(make_project, tmp_path, monkeypatch):
+    outputs = {}
+    for metrics in (False, True):
+        project = make_project(tmp_path / ('metrics_on' if metrics else 'metrics_off')).parent
+        write_synthetic_export(project / 'Data' / 'export1.xlsx', 'NEO-IPIP 120', 30)
+        monkeypatch.chdir(project / 'code')
+        if metrics:
+            Run_metrics.start_run_metrics()
+        try:
+            Report_pipeline.main_chunked(chunk_size=12, render=True, report_cache=False, render_backend='native')
+        finally:
+            Run_metrics.finish_run_metrics(tmp_path / 'Metrics')
+        outputs[metrics] = {
+            'results': read_results(project / 'Results' / 'export1'),
+            'reports': {p.name: p.read_bytes() for p in (project / 'Report').glob('*.pdf')},
+            'metrics': list((project / 'Metrics').glob('run_*.json')),
+        }
+
+    assert len(outputs[False]['metrics']) == 0 and len(outputs[True]['metrics']) == 1
+    pd.testing.assert_frame_equal(outputs[True]['results'], outputs[False]['results'])
+    assert len(outputs[False]['reports']) == 30
+    assert outputs[True]['reports'] == outputs[False]['reports']
+
+def test_watch_sets_failed_exports_aside_and_keeps_going(code_directory, monkeypatch):
+    data_directory = code_directory.parent / 'Data'
+    data_directory.mkdir()
+    score_survey_export = Report_pipeline.score_survey_export
+
+    def score_or_fail(parent_directory, survey_data_path, *args, **kwargs):
+        # An export that is recognized, but fails while it is scored
+        if survey_data_path.name == 'unscorable.xlsx':
+            raise ValueError('cannot be scored')
+        return score_survey_export(parent_directory, survey_data_path, *args, **kwargs)
+    monkeypatch.setattr(Report_pipeline, 'score_survey_export', score_or_fail)
+
+    (data_directory / 'broken.xlsx').write_bytes(b'not a workbook')
+    write_synthetic_export(data_directory / 'unscorable.xlsx', 'NEO-IPIP 120', 3)
+    write_synthetic_export(data_directory / 'personality.xlsx', 'NEO-IPIP 120', 5, seed=1)
+    log_file = code_directory.parent / 'Metrics' / 'watch_latency.csv'
+
+    def stop_when_processed():
+        # As a service manager would stop the service once the three exports are logged
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline and not (log_file.exists() and len(pd.read_csv(log_file)) >= 3):
+            time.sleep(0.1)
+        os.kill(os.getpid(), signal.SIGTERM)
+    stopper = threading.Thread(target=stop_when_processed)
+    stopper.start()
+    try:
+        Report_pipeline.main_watch(poll_seconds=0.1, render_workers=1, report_cache=False, render_backend='native')
+    finally:
+        stopper.join()
+
+    log = pd.read_csv(log_file).set_index('export')
+    assert sorted(log.index) == ['broken.xlsx', 'personality.xlsx', 'unscorable.xlsx']
+    assert "moved to" in log.at['broken.xlsx', 'error']
+    assert "cannot be scored" in log.at['unscorable.xlsx', 'error']
+    assert pd.isna(log.at['personality.xlsx', 'error'])
+    assert (log.at['personality.xlsx', 'responses'], log.at['personality.xlsx', 'reports']) == (5, 5)
+    # The failed exports are set aside, from the inbox and from their survey folder
+    assert sorted(p.name for p in (data_directory / 'Failed').iterdir()) == ['broken.xlsx', 'unscorable.xlsx']
+    assert not list(data_directory.glob('*.xlsx'))
+    assert [p.name for p in (data_directory / 'NEO-IPIP 120').glob('*.xlsx')] == ['personality.xlsx']
+    assert len(list((code_directory.parent / 'Report').glob('Personality_Report_*.pdf'))) == 5
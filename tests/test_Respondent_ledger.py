@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from Functions.Get_data import iter_survey_export_blocks
+from Functions.Respondent_ledger import get_content_hashes
+
+def test_appended_response_leaves_existing_hashes_unchanged(synthetic_export):
+    _, survey_data = synthetic_export('ICAR 16', 20)
+    assert survey_data['Age'].dtype == np.int64
+    appended_row = survey_data.iloc[[0]].assign(**{'Age': np.nan, survey_data.columns[0]: 999})
+    # The blank age turns the Age column of the later export into floats
+    later_export = pd.concat([survey_data, appended_row], ignore_index=True)
+    assert later_export['Age'].dtype == np.float64
+
+    hashes = get_content_hashes(survey_data)
+    later_hashes = get_content_hashes(later_export)
+    pd.testing.assert_series_equal(later_hashes.iloc[:20], hashes)
+    assert later_hashes.iloc[20] not in set(hashes)
+
+def test_chunked_read_gives_the_same_hashes(synthetic_export):
+    file_path, survey_data = synthetic_export('ICAR 16', 20)
+    # A blank age in one block only changes the dtypes of that block
+    survey_data = pd.concat([survey_data, survey_data.iloc[[0]].assign(Age=np.nan)], ignore_index=True)
+    blank_age_path = file_path.with_name('blank_age.xlsx')
+    with pd.ExcelWriter(blank_age_path) as writer:
+        pd.read_excel(file_path, header=None, nrows=1).to_excel(writer, header=False, index=False)
+        survey_data.to_excel(writer, startrow=1, index=False)
+
+    whole_hashes = get_content_hashes(pd.read_excel(blank_age_path, skiprows=1))
+    chunked_hashes = pd.concat([get_content_hashes(block) for block in iter_survey_export_blocks(blank_age_path, 7)])
+    pd.testing.assert_series_equal(chunked_hashes, whole_hashes)
@@ -0,0 +1,50 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from Benchmark_Run import IMPORT_BUDGETS, check_import_budgets
+from Functions.Synthetic_exports import write_synthetic_export
+
+CODE_DIRECTORY = Path(__file__).resolve().parent.parent
+# The cold start budgets of Benchmark_Run.py are for a quiet machine; the tests only catch a
+# command that has become far slower to start, e.g. by importing pandas at the top of a module
+COLD_START_MARGIN = 4
+
+# Runs a command line in a fresh interpreter and prints the modules it imported
+RUN_COMMAND = """
+import sys, json
+sys.path.insert(0, sys.argv[1])
+import Survey_Report_Generation_Run as cli
+try:
+    cli.run_cli(sys.argv[2:])
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)))
+"""
+
+@pytest.fixture(scope='module')
+def working_directory(make_project, tmp_path_factory):
+    """
+    Code folder of a synthetic project with one export in its inbox.
+    """
+    working_directory = make_project(tmp_path_factory.mktemp('cli'))
+    write_synthetic_export(working_directory.parent / 'Data' / 'export1.xlsx', 'NEO-IPIP 120', 5)
+    return working_directory
+
+# In this order: 'score' scores the export that 'render' then renders
+@pytest.mark.parametrize('command', [['--help'], ['classify', '--dry-run'], ['score'], ['render', '--native-pdf']])
+def test_commands_run_without_plotly_and_kaleido(working_directory, command):
+    output = subprocess.run([sys.executable, '-c', RUN_COMMAND, str(CODE_DIRECTORY)] + command, cwd=working_directory,
+                            capture_output=True, text=True, check=True).stdout
+    imported = {name.split('.')[0] for name in json.loads(output.splitlines()[-1])}
+    assert not imported & {'plotly', 'kaleido'}
+    if command[0] == 'render':
+        assert len(list((working_directory.parent / 'Report').glob('Personality_Report_*.pdf'))) == 5
+
+def test_commands_start_within_their_budget():
+    budgets = {command: (budget * COLD_START_MARGIN, forbidden) for command, (budget, forbidden) in IMPORT_BUDGETS.items()}
+    imports = check_import_budgets(CODE_DIRECTORY, repeat=2, budgets=budgets)
+    assert [command for command, check in imports.items() if not check['passed']] == []